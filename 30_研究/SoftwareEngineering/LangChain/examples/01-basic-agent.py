@@ -3,9 +3,15 @@ LangChain 基础示例 1: 基础代理
 展示如何创建一个简单的天气查询代理
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 from langchain.agents import create_agent
 from langchain.tools import tool
 
+from coalescing import CoalescingAgent
+from http_pool import get_chat_model
+from streaming_repl import start_repl
+
 
 @tool
 def get_weather(city: str) -> str:
@@ -55,14 +61,42 @@ def get_time(city: str) -> str:
     return current_time.strftime("%Y-%m-%d %H:%M:%S")
 
 
+MODEL_NAME = "claude-sonnet-4-5-20250929"
+
+
+def demo_concurrent_queries(agent, tools):
+    """
+    演示相同请求合并：多个用户同时问同一个问题，只执行一次
+    """
+    print("\n" + "=" * 50)
+    print("并发相同请求合并")
+    print("=" * 50)
+    
+    coalescing_agent = CoalescingAgent(agent, model=MODEL_NAME, tools=tools)
+    # 空白和全角/半角标点不同，规范化后是同一个请求
+    queries = ["北京今天天气怎么样？", " 北京今天天气怎么样? "] * 5
+    
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        list(pool.map(
+            lambda q: coalescing_agent.invoke({"messages": [{"role": "user", "content": q}]}),
+            queries
+        ))
+    
+    stats = coalescing_agent.metrics()
+    print(f"请求数: {stats['requests']}，实际执行: {stats['executions']}，合并: {stats['coalesced']}")
+    print(f"节省模型调用: {stats['saved_model_calls']}，节省工具调用: {stats['saved_tool_calls']}")
+
+
 def main():
     """主函数：演示基础代理的使用"""
     
+    tools = [get_weather, get_time]
+    
     # 创建代理
     # 注意：需要设置 ANTHROPIC_API_KEY 环境变量
     agent = create_agent(
-        model="claude-sonnet-4-5-20250929",  # 或其他可用模型
-        tools=[get_weather, get_time],
+        model=get_chat_model(MODEL_NAME),  # 或其他可用模型，共享限流
+        tools=tools,
         system_prompt="""你是一个有帮助的助手，可以查询天气和时间。
         
 当用户询问天气时，使用 get_weather 工具。
@@ -96,23 +130,17 @@ def main():
             print(f"错误: {e}")
             print("提示: 请确保已设置 ANTHROPIC_API_KEY 环境变量")
     
-    # 交互模式
+    try:
+        demo_concurrent_queries(agent, tools)
+    except Exception as e:
+        print(f"错误: {e}")
+    
+    # 交互模式：流式输出，Ctrl-C 取消当前生成
     print("\n" + "=" * 50)
-    print("进入交互模式 (输入 'exit' 退出)")
+    print("进入交互模式 (输入 'exit' 退出，Ctrl-C 取消当前回答)")
     print("=" * 50)
     
-    while True:
-        user_input = input("\n用户: ").strip()
-        if user_input.lower() == 'exit':
-            break
-        
-        try:
-            response = agent.invoke({
-                "messages": [{"role": "user", "content": user_input}]
-            })
-            print(f"代理: {response}")
-        except Exception as e:
-            print(f"错误: {e}")
+    start_repl(agent)
 
 
 if __name__ == "__main__":
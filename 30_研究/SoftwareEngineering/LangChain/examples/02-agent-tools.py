@@ -3,10 +3,21 @@ LangChain 基础示例 2: Agent + Tools
 展示如何创建一个可以调用多个工具的代理
 """
 
-from langchain.agents import create_agent, AgentExecutor
+from langchain.agents import create_agent
+from langchain.agents.middleware import ModelCallLimitMiddleware
 from langchain.tools import tool
-import requests
 import json
+import os
+
+from http_pool import get_chat_model, http_get
+from run_budget import RunBudget, run_with_budget, with_timeout
+from streaming_repl import start_repl
+from tracing import JsonlSink, JsonlTracer
+
+# 时延预算（秒）
+RUN_BUDGET = 30      # 单次运行的墙钟预算
+MODEL_TIMEOUT = 15   # 单次模型调用超时
+TOOL_TIMEOUT = 5     # 单次工具调用超时
 
 
 @tool
@@ -53,7 +64,12 @@ def search_web(query: str) -> str:
         搜索结果摘要
     """
     # 实际使用时应该调用真实搜索 API，如 Google Custom Search、Bing API 等
-    # 这里使用模拟数据
+    # 设置 SEARCH_API_URL 后走共享连接池（限流 + 重试），否则使用模拟数据
+    search_api = os.getenv("SEARCH_API_URL")
+    if search_api:
+        response = http_get(search_api, params={"q": query})
+        return f"搜索结果: {response.text[:500]}"
+    
     mock_results = {
         "python": "Python 是一种高级编程语言，由 Guido van Rossum 于 1991 年创建。",
         "langchain": "LangChain 是一个用于构建 LLM 应用的 Python 框架。",
@@ -130,8 +146,11 @@ def translate(text: str, target_lang: str = "Chinese") -> str:
 def main():
     """主函数"""
     
-    # 创建工具列表
-    tools = [calculate, search_web, get_news, translate]
+    # 创建工具列表（每个工具带单次调用超时）
+    tools = [
+        with_timeout(t, TOOL_TIMEOUT)
+        for t in [calculate, search_web, get_news, translate]
+    ]
     
     # 创建系统提示词
     system_prompt = """你是一个多功能的 AI 助手，可以使用以下工具帮助用户：
@@ -151,21 +170,27 @@ def main():
 始终保持友好和专业。"""
     
     # 创建代理
-    agent = create_agent(
-        model="claude-sonnet-4-5-20250929",
-        tools=tools,
-        system_prompt=system_prompt
+    # 模型调用超时；重试次数设小，避免一次慢调用吃掉整个预算
+    # 通过 get_chat_model 复用实例并接入进程级共享限流
+    model = get_chat_model(
+        "claude-sonnet-4-5-20250929",
+        timeout=MODEL_TIMEOUT,
+        max_retries=1
     )
     
-    # 使用 AgentExecutor 进行更精细的控制
-    agent_executor = AgentExecutor(
-        agent=agent,
+    # 最多 5 次模型调用；超出时抛错，由 run_with_budget 返回部分答案
+    # 时间上限由 run_with_budget 的预算负责
+    agent = create_agent(
+        model=model,
         tools=tools,
-        handle_parsing_errors=True,
-        max_iterations=5,
-        verbose=True  # 显示详细执行过程
+        system_prompt=system_prompt,
+        middleware=[ModelCallLimitMiddleware(run_limit=5, exit_behavior="error")]
     )
     
+    # 结构化追踪代替 verbose=True，汇总: python tracing.py agent_trace.jsonl
+    # 放在调用配置里而不是构造参数里，LLM 和工具的子运行才会继承
+    tracer = JsonlTracer(JsonlSink("agent_trace.jsonl"))
+    
     # 测试查询
     test_queries = [
         "计算 123 * 456",
@@ -185,28 +210,24 @@ def main():
         print('-' * 60)
         
         try:
-            # 使用 agent_executor
-            result = agent_executor.invoke({"input": query})
-            print(f"\n最终结果: {result['output']}")
+            # 在时延预算内运行，超时返回部分答案
+            result = run_with_budget(
+                agent,
+                {"messages": [{"role": "user", "content": query}]},
+                RunBudget(RUN_BUDGET),
+                callbacks=[tracer]
+            )
+            label = "部分结果" if result["partial"] else "最终结果"
+            print(f"\n{label}: {result['output']}")
         except Exception as e:
             print(f"错误: {e}")
     
-    # 交互模式
+    # 交互模式：流式输出 token 和工具事件，Ctrl-C 取消当前生成
     print("\n" + "=" * 60)
-    print("进入交互模式 (输入 'exit' 退出)")
+    print("进入交互模式 (输入 'exit' 退出，Ctrl-C 取消当前回答)")
     print("=" * 60)
     
-    while True:
-        user_input = input("\n用户: ").strip()
-        if user_input.lower() == 'exit':
-            print("再见！")
-            break
-        
-        try:
-            result = agent_executor.invoke({"input": user_input})
-            print(f"\n代理: {result['output']}")
-        except Exception as e:
-            print(f"错误: {e}")
+    start_repl(agent, config={"callbacks": [tracer]})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+"""
+LangChain 本地流式对话网关
+
+把 simple_chat.py 中 streaming_chat 的 ChatOpenAI(streaming=True) 调用
+放到一个 asyncio HTTP/SSE 网关后面，单进程同时服务数百个流式客户端：
+1. 每个客户端一个有界队列 + writer.drain()，慢读者的反压一路传到上游读取
+2. 信号量限制同时进行的上游流数量
+3. 每条流记录首 token 延迟（TTFT，含排队等待上游的时间）和 tokens/sec
+4. FakeStreamingModel 可以在不调用真实模型的情况下压测
+
+接口：
+    POST /chat      {"message": "..."}  → text/event-stream
+    GET  /metrics   → 汇总指标 JSON
+
+用法：
+    python chat_gateway.py serve --port 8080            # 真实模型
+    python chat_gateway.py loadtest --clients 300       # 假模型压测
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import time
+from collections import deque
+from http import HTTPStatus
+
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from tracing import percentile
+
+_DONE = object()
+
+
+class FakeStreamingModel:
+    """按固定速率吐 token 的假模型，接口与 ChatOpenAI.astream 一致"""
+
+    def __init__(self, first_token_delay: float = 0.2, tokens_per_sec: float = 50, tokens: int = 100):
+        self.first_token_delay = first_token_delay
+        self.tokens_per_sec = tokens_per_sec
+        self.tokens = tokens
+
+    async def astream(self, messages):
+        await asyncio.sleep(self.first_token_delay * random.uniform(0.5, 1.5))
+        for i in range(self.tokens):
+            yield AIMessageChunk(content=f"t{i} ")
+            await asyncio.sleep(1 / self.tokens_per_sec)
+
+
+class ChatGateway:
+    """
+    SSE 流式网关
+
+    Args:
+        llm: 支持 astream(messages) 的模型
+        max_upstream: 同时进行的上游流上限
+        queue_size: 每个客户端的缓冲 chunk 数，满了就暂停读取上游
+        slow_client_timeout: 客户端持续不读超过该秒数，断开并释放上游
+        metrics_window: 分位数只统计最近这么多条流，长期运行时内存有界
+    """
+
+    def __init__(
+        self,
+        llm,
+        max_upstream: int = 64,
+        queue_size: int = 32,
+        slow_client_timeout: float = 30.0,
+        metrics_window: int = 10_000,
+    ):
+        self.llm = llm
+        self.upstream = asyncio.Semaphore(max_upstream)
+        self.queue_size = queue_size
+        self.slow_client_timeout = slow_client_timeout
+        self.active = 0
+        self.streams = deque(maxlen=metrics_window)  # 最近每条流的 {"ttft", "tps", "tokens", "status"}
+        self.completed = 0
+        self.statuses = {}  # 累计值，不受窗口限制
+
+    # ---------- HTTP ----------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "GET" and path == "/metrics":
+                await self._send_json(writer, 200, self.metrics())
+            elif method == "POST" and path == "/chat":
+                try:
+                    payload = json.loads(body or b"{}")
+                    message = payload.get("message", "") if isinstance(payload, dict) else None
+                except ValueError:
+                    message = None
+                if not isinstance(message, str):
+                    await self._send_json(writer, 400, {"error": "body must be JSON like {\"message\": \"...\"}"})
+                else:
+                    await self._stream_chat(writer, message)
+            else:
+                await self._send_json(writer, 404, {"error": "not found"})
+        except ValueError:
+            # 请求行或 Content-Length 不合法
+            with contextlib.suppress(ConnectionError):
+                await self._send_json(writer, 400, {"error": "bad request"})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    # ---------- 流式 ----------
+
+    async def _produce(self, message: str, queue: asyncio.Queue, stats: dict):
+        """读取上游流，写入有界队列；队列满时 put 阻塞，上游读取随之暂停"""
+        started = time.perf_counter()
+        async with self.upstream:
+            stats["queue_wait"] = time.perf_counter() - started
+            async for chunk in self.llm.astream([HumanMessage(content=message)]):
+                if not chunk.content:
+                    continue
+                if stats["ttft"] is None:
+                    stats["ttft"] = time.perf_counter() - started
+                stats["tokens"] += 1
+                await asyncio.wait_for(queue.put(chunk.content), self.slow_client_timeout)
+            stats["duration"] = time.perf_counter() - started - stats["queue_wait"]
+        await queue.put(_DONE)
+
+    async def _stream_chat(self, writer: asyncio.StreamWriter, message: str):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        stats = {"ttft": None, "queue_wait": None, "tokens": 0, "duration": None, "status": "ok"}
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        producer = asyncio.create_task(self._produce(message, queue, stats))
+        self.active += 1
+
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({get, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    # 生产者先结束：要么出错，要么 _DONE 马上就会到
+                    get.cancel()
+                    if producer.exception() is not None:
+                        raise producer.exception()
+                    continue
+                item = get.result()
+                if item is _DONE:
+                    break
+                writer.write(f"data: {json.dumps({'token': item}, ensure_ascii=False)}\n\n".encode())
+                # 慢读者在这里阻塞；超时视为放弃，断开并释放上游
+                await asyncio.wait_for(writer.drain(), self.slow_client_timeout)
+            writer.write(b"event: done\ndata: {}\n\n")
+            await writer.drain()
+        except asyncio.TimeoutError:
+            stats["status"] = "slow_client"
+        except (ConnectionError, asyncio.CancelledError):
+            stats["status"] = "disconnected"
+        except Exception as e:
+            stats["status"] = f"error: {e}"
+            writer.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode())
+        finally:
+            producer.cancel()  # 取消上游，避免被放弃的流继续消耗 token
+            self.active -= 1
+            if stats["duration"]:
+                stats["tps"] = stats["tokens"] / stats["duration"]
+            self.streams.append(stats)
+            self.completed += 1
+            self.statuses[stats["status"]] = self.statuses.get(stats["status"], 0) + 1
+
+    def metrics(self) -> dict:
+        ttfts = [s["ttft"] for s in self.streams if s["ttft"] is not None]
+        waits = [s["queue_wait"] for s in self.streams if s["queue_wait"] is not None]
+        tps = [s["tps"] for s in self.streams if s.get("tps")]
+        return {
+            "active_streams": self.active,
+            "completed_streams": self.completed,
+            "status": dict(self.statuses),
+            "queue_wait_p95": round(percentile(waits, 95), 3),
+            "ttft_p50": round(percentile(ttfts, 50), 3),
+            "ttft_p95": round(percentile(ttfts, 95), 3),
+            "ttft_p99": round(percentile(ttfts, 99), 3),
+            "tokens_per_sec_p50": round(percentile(tps, 50), 1),
+        }
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        return await asyncio.start_server(self.handle, host, port, backlog=2048)
+
+
+# ========== 压测 ==========
+
+async def _client(host: str, port: int, message: str, slow: bool) -> dict:
+    """一个 SSE 客户端；slow=True 时模拟读得很慢的客户端"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps({"message": message}).encode()
+    writer.write(
+        f"POST /chat HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+    ttft = None
+    tokens = 0
+    await reader.readuntil(b"\r\n\r\n")
+    while True:
+        line = await reader.readline()
+        if not line or line.startswith(b"event: done"):
+            break
+        if line.startswith(b"data: "):
+            tokens += 1
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            if slow:
+                await asyncio.sleep(0.05)
+    writer.close()
+    return {"ttft": ttft, "tokens": tokens, "total": time.perf_counter() - started}
+
+
+async def loadtest(clients: int, max_upstream: int, slow_ratio: float, tokens: int):
+    gateway = ChatGateway(FakeStreamingModel(tokens=tokens), max_upstream=max_upstream, queue_size=16)
+    server = await gateway.serve(port=0)
+    host, port = server.sockets[0].getsockname()[:2]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        _client(host, port, f"问题 {i}", slow=random.random() < slow_ratio)
+        for i in range(clients)
+    ])
+    elapsed = time.perf_counter() - started
+    server.close()
+    await server.wait_closed()
+
+    client_ttft = [r["ttft"] for r in results if r["ttft"] is not None]
+    total_tokens = sum(r["tokens"] for r in results)
+    print("=" * 60)
+    print(f"压测：{clients} 个客户端，上游并发上限 {max_upstream}，慢读者比例 {slow_ratio:.0%}")
+    print("=" * 60)
+    print(f"总耗时: {elapsed:.2f}s，总 token: {total_tokens}，聚合吞吐: {total_tokens / elapsed:.0f} tokens/s")
+    print(f"客户端 TTFT p50/p95/p99: {percentile(client_ttft, 50):.3f}s / "
+          f"{percentile(client_ttft, 95):.3f}s / {percentile(client_ttft, 99):.3f}s")
+    print("网关指标:", json.dumps(gateway.metrics(), ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地流式对话网关")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve", help="使用真实模型启动网关")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--max-upstream", type=int, default=64)
+
+    load_parser = sub.add_parser("loadtest", help="使用假模型压测")
+    load_parser.add_argument("--clients", type=int, default=300)
+    load_parser.add_argument("--max-upstream", type=int, default=100)
+    load_parser.add_argument("--slow-ratio", type=float, default=0.1)
+    load_parser.add_argument("--tokens", type=int, default=50)
+
+    args = parser.parse_args()
+    if args.command == "loadtest":
+        asyncio.run(loadtest(args.clients, args.max_upstream, args.slow_ratio, args.tokens))
+        return
+
+    from http_pool import get_chat_model
+
+    async def run():
+        gateway = ChatGateway(get_chat_model("gpt-4o", streaming=True), max_upstream=args.max_upstream)
+        server = await gateway.serve(port=args.port)
+        print(f"网关已启动: http://127.0.0.1:{args.port}  (POST /chat, GET /metrics)")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
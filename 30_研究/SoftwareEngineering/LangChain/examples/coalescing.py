@@ -0,0 +1,176 @@
+"""
+LangChain 相同请求合并（single-flight）
+
+很多用户同时问同一个问题（"北京今天天气怎么样？"）时，
+每次 agent.invoke 都会各自调用模型和工具。
+本模块按「规范化后的消息 + 模型 + 工具集」生成键，
+同一时刻相同键的请求只执行一次，所有等待者共享结果。
+
+注意：只合并「同时在途」的请求，执行结束后立即移除，不是缓存。
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+
+from langchain_core.messages import convert_to_messages
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、去首尾空白、合并连续空白、英文转小写"""
+    text = unicodedata.normalize("NFKC", text).strip().lower()
+    return re.sub(r"\s+", " ", text)
+
+
+def request_key(messages: list, model: str, tools: list) -> str:
+    """
+    计算合并键
+
+    Args:
+        messages: 本次请求的消息列表（dict 或 BaseMessage）
+        model: 模型名称
+        tools: 工具列表（按名称参与计算，与顺序无关）
+    """
+    normalized = []
+    # 统一转成 BaseMessage：{"role": "user"}、("human", ...) 和 HumanMessage 的 type 都是 "human"
+    for message in convert_to_messages(messages):
+        role, content = message.type, message.content
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        normalized.append([role, normalize_text(content)])
+
+    payload = {
+        "messages": normalized,
+        "model": model,
+        "tools": sorted(getattr(t, "name", str(t)) for t in tools),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """一次在途执行"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同键请求合并
+
+    do() 用于线程并发，ado() 用于 asyncio 并发。
+    异步版本把执行放在独立任务中并用 shield 等待，
+    单个调用方被取消不会影响其他共享同一执行的调用方。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.stats = {"requests": 0, "executions": 0, "coalesced": 0}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            self.stats["requests"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, True
+
+    async def ado(self, key: str, coro_fn):
+        with self._lock:
+            self.stats["requests"] += 1
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(coro_fn())
+                task.add_done_callback(lambda _: self._tasks.pop(key, None))
+                self.stats["executions"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        return await asyncio.shield(task), leader
+
+
+def _share(result):
+    """给每个等待者一份浅拷贝，避免调用方修改共享结果"""
+    if isinstance(result, dict):
+        return {k: list(v) if isinstance(v, list) else v for k, v in result.items()}
+    return result
+
+
+class CoalescingAgent:
+    """
+    为 Agent 加上请求合并的包装
+
+    用法与原 agent 相同：invoke / ainvoke({"messages": [...]})。
+    合并键不包含 config，只适合无会话状态的请求；
+    带 thread_id 的对话不要走这个包装，否则会共享到别人的上下文。
+    """
+
+    def __init__(self, agent, model: str, tools: list):
+        self.agent = agent
+        self.model = model
+        self.tools = tools
+        self.flight = SingleFlight()
+        self.saved = {"model_calls": 0, "tool_calls": 0}
+        self._saved_lock = threading.Lock()
+
+    def _key(self, inputs: dict) -> str:
+        return request_key(inputs.get("messages", []), self.model, self.tools)
+
+    def _record_saved(self, result, leader: bool):
+        """跟随者每共享一次结果，就省下了该次执行中的全部模型和工具调用"""
+        if leader or not isinstance(result, dict):
+            return
+        messages = result.get("messages", [])
+        with self._saved_lock:
+            self.saved["model_calls"] += sum(1 for m in messages if getattr(m, "type", "") == "ai")
+            self.saved["tool_calls"] += sum(1 for m in messages if getattr(m, "type", "") == "tool")
+
+    def invoke(self, inputs: dict, config: dict | None = None):
+        result, leader = self.flight.do(
+            self._key(inputs), lambda: self.agent.invoke(inputs, config)
+        )
+        self._record_saved(result, leader)
+        return _share(result)
+
+    async def ainvoke(self, inputs: dict, config: dict | None = None):
+        result, leader = await self.flight.ado(
+            self._key(inputs), lambda: self.agent.ainvoke(inputs, config)
+        )
+        self._record_saved(result, leader)
+        return _share(result)
+
+    def metrics(self) -> dict:
+        stats = dict(self.flight.stats)
+        stats["saved_model_calls"] = self.saved["model_calls"]
+        stats["saved_tool_calls"] = self.saved["tool_calls"]
+        stats["coalesce_ratio"] = stats["coalesced"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
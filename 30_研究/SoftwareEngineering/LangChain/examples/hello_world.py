@@ -10,6 +10,9 @@ LangChain Hello World - 第一个 Agent
 from langchain.agents import create_agent
 from langchain.tools import tool
 
+from http_pool import get_chat_model
+from streaming_repl import start_repl
+
 # ========== 步骤1：定义工具 ==========
 # 工具必须有清晰的 docstring，Agent 用它来理解工具用途
 
@@ -55,7 +58,7 @@ def calculate(expression: str) -> str:
 # 使用 create_agent 快速创建一个 Agent
 
 agent = create_agent(
-    model="gpt-4o",  # 模型名称
+    model=get_chat_model("gpt-4o"),  # 模型实例：共享连接池、限流和重试
     tools=[get_weather, calculate],  # 可用工具列表
     system_prompt="""你是一个有帮助的助手。你可以：
 1. 查询天气信息
@@ -66,33 +69,10 @@ agent = create_agent(
 # ========== 步骤3：运行 Agent ==========
 
 def main():
-    """主函数：运行 Agent 对话"""
-    print("🤖 Agent 已启动！输入 'exit' 退出\n")
+    """主函数：运行 Agent 对话（流式输出，Ctrl-C 取消当前回答）"""
+    print("🤖 Agent 已启动！输入 'exit' 退出，Ctrl-C 取消当前回答\n")
     
-    while True:
-        user_input = input("你: ").strip()
-        
-        if user_input.lower() == 'exit':
-            print("👋 再见！")
-            break
-        
-        if not user_input:
-            continue
-        
-        try:
-            # 调用 Agent
-            response = agent.invoke({
-                "messages": [{"role": "user", "content": user_input}]
-            })
-            
-            # 提取并显示回复
-            if isinstance(response, dict):
-                print(f"🤖: {response}\n")
-            else:
-                print(f"🤖: {response.content}\n")
-                
-        except Exception as e:
-            print(f"❌ 错误: {str(e)}\n")
+    start_repl(agent, prompt="你: ", reply_prefix="🤖: ")
 
 if __name__ == "__main__":
     # 测试一些示例问题
@@ -0,0 +1,432 @@
+"""
+LangChain 共享限流、重试与连接池
+
+每个示例各自创建模型客户端，并发调用之间没有任何协调：
+一旦触发 429，大家同时重试，吞吐反而崩成重试风暴。
+本模块提供进程级共享的：
+1. RateLimiter：令牌桶限流，同时限制每分钟请求数和每分钟 token 数
+2. RetryPolicy：429/5xx 时带抖动的指数退避，并用重试预算防止重试风暴
+3. 共享的 keep-alive 连接池（httpx），模型客户端和 HTTP 工具共用
+4. get_chat_model()：按参数复用模型实例，而不是每次新建
+
+OpenAI（ChatOpenAI 接受 http_client）和 Anthropic（替换 ChatAnthropic 的 SDK 客户端）模型
+与工具共用限流器和传输层重试；其他提供商只接入共享限流器，重试和连接池仍是 SDK 自带的。
+新版 SDK 只接受 httpx2 的客户端，这时按同样的配置另建一个 httpx2 连接池，限流器和重试预算仍是同一份。
+
+环境变量：
+    LLM_RPM  每分钟请求数上限（默认 500）
+    LLM_TPM  每分钟 token 数上限（默认 200000）
+
+运行 `python http_pool.py` 可以用模拟服务对比朴素重试和共享策略的吞吐。
+"""
+
+import asyncio
+import importlib
+import os
+import random
+import threading
+import time
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# ========== 令牌桶限流 ==========
+
+class RateLimiter(BaseRateLimiter):
+    """
+    请求数 + token 数双令牌桶
+
+    请求桶在 acquire 时扣 1；token 桶在调用结束后按实际用量扣减（可以欠账），
+    欠账期间新的请求会被挡住，直到桶重新填满到非负。
+    实现了 BaseRateLimiter 接口，可以直接传给模型的 rate_limiter 参数。
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, burst: int = 10):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = float(burst)
+        self.token_capacity = float(tokens_per_minute) / 6  # 允许 10 秒的突发
+        self.request_tokens = self.request_capacity
+        self.token_tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {"acquired": 0, "throttled": 0, "tokens_used": 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        delta = now - self.updated
+        self.updated = now
+        self.request_tokens = min(self.request_capacity, self.request_tokens + delta * self.request_rate)
+        self.token_tokens = min(self.token_capacity, self.token_tokens + delta * self.token_rate)
+
+    def _try_acquire(self) -> float:
+        """成功返回 0，否则返回需要等待的秒数"""
+        with self.lock:
+            self._refill()
+            if self.request_tokens >= 1 and self.token_tokens >= 0:
+                self.request_tokens -= 1
+                self.stats["acquired"] += 1
+                return 0.0
+            self.stats["throttled"] += 1
+            wait_request = max(0.0, (1 - self.request_tokens) / self.request_rate)
+            wait_token = max(0.0, -self.token_tokens / self.token_rate)
+            return max(wait_request, wait_token, 0.001)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(min(wait, 1.0))
+
+    def record_tokens(self, tokens: int):
+        """调用结束后按实际 token 用量扣减"""
+        with self.lock:
+            self._refill()
+            self.token_tokens -= tokens
+            self.stats["tokens_used"] += tokens
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """把每次模型调用的实际 token 用量记入限流器"""
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        total = usage.get("total_tokens", 0)
+        if not total:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if metadata:
+                        total += metadata.get("total_tokens", 0)
+        if total:
+            self.limiter.record_tokens(total)
+
+
+# ========== 重试策略 ==========
+
+class RetryPolicy:
+    """
+    带抖动的指数退避 + 重试预算
+
+    - 退避使用 full jitter：sleep = uniform(0, min(cap, base * 2^attempt))，
+      服务端给了 Retry-After 时至少等那么久
+    - 重试预算：每个首次请求存入 budget_ratio 个额度，每次重试消耗 1 个，
+      额度不足时直接失败，保证重试流量最多是正常流量的 budget_ratio 倍
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base: float = 0.5,
+        cap: float = 20.0,
+        budget_ratio: float = 0.2,
+        max_budget: float = 10.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.budget_ratio = budget_ratio
+        self.max_budget = max_budget
+        self.budget = max_budget
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "budget_exhausted": 0}
+
+    def on_request(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.budget = min(self.budget + self.budget_ratio, self.max_budget)
+
+    def should_retry(self, attempt: int) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        with self.lock:
+            if self.budget < 1:
+                self.stats["budget_exhausted"] += 1
+                return False
+            self.budget -= 1
+            self.stats["retries"] += 1
+            return True
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+
+# ========== 传输层：限流 + 重试 ==========
+
+def _package_of(cls: type):
+    """cls 来自 httpx 还是 httpx2：两者接口相同，但请求、响应和异常类型互不相通"""
+    for base in cls.__mro__:
+        package = base.__module__.partition(".")[0]
+        if package in ("httpx", "httpx2"):
+            return importlib.import_module(package)
+    return httpx
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """每次发送（包括重试）前先过限流器，429/5xx 和连接错误按策略重试"""
+
+    def __init__(self, inner: httpx.BaseTransport, limiter: RateLimiter, policy: RetryPolicy):
+        self.inner = inner
+        self.limiter = limiter
+        self.policy = policy
+        self.transport_error = _package_of(type(inner)).TransportError
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.on_request()
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self.inner.handle_request(request)
+            except self.transport_error:
+                if not self.policy.should_retry(attempt):
+                    raise
+                time.sleep(self.policy.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUSES or not self.policy.should_retry(attempt):
+                return response
+            retry_after = response.headers.get("retry-after")
+            response.close()
+            time.sleep(self.policy.backoff(attempt, retry_after))
+            attempt += 1
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """LimitedTransport 的异步版本"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, limiter: RateLimiter, policy: RetryPolicy):
+        self.inner = inner
+        self.limiter = limiter
+        self.policy = policy
+        self.transport_error = _package_of(type(inner)).TransportError
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.on_request()
+        attempt = 0
+        while True:
+            await self.limiter.aacquire()
+            try:
+                response = await self.inner.handle_async_request(request)
+            except self.transport_error:
+                if not self.policy.should_retry(attempt):
+                    raise
+                await asyncio.sleep(self.policy.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUSES or not self.policy.should_retry(attempt):
+                return response
+            retry_after = response.headers.get("retry-after")
+            await response.aclose()
+            await asyncio.sleep(self.policy.backoff(attempt, retry_after))
+            attempt += 1
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+# ========== 进程级共享实例 ==========
+
+# httpx 与 httpx2 的 Limits / Timeout 不通用，按参数在各自的包里构造
+POOL_LIMITS = {"max_connections": 100, "max_keepalive_connections": 20, "keepalive_expiry": 30}
+HTTP_TIMEOUT = {"timeout": 60.0, "connect": 5.0}
+
+_lock = threading.RLock()  # 工厂函数之间会嵌套获取
+_shared = {}
+_models = {}
+
+
+def _get_shared(name: str, factory):
+    with _lock:
+        if name not in _shared:
+            _shared[name] = factory()
+        return _shared[name]
+
+
+def get_limiter() -> RateLimiter:
+    return _get_shared("limiter", lambda: RateLimiter(
+        requests_per_minute=float(os.getenv("LLM_RPM", 500)),
+        tokens_per_minute=float(os.getenv("LLM_TPM", 200_000)),
+    ))
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _get_shared("policy", RetryPolicy)
+
+
+def get_http_client(package=httpx) -> httpx.Client:
+    """共享的同步 keep-alive 连接池（模型客户端和工具共用）；package 为 httpx 或 httpx2"""
+    return _get_shared(f"client:{package.__name__}", lambda: package.Client(
+        transport=LimitedTransport(
+            package.HTTPTransport(limits=package.Limits(**POOL_LIMITS)), get_limiter(), get_retry_policy()
+        ),
+        timeout=package.Timeout(**HTTP_TIMEOUT),
+    ))
+
+
+def get_async_http_client(package=httpx) -> httpx.AsyncClient:
+    """共享的异步 keep-alive 连接池"""
+    return _get_shared(f"async_client:{package.__name__}", lambda: package.AsyncClient(
+        transport=AsyncLimitedTransport(
+            package.AsyncHTTPTransport(limits=package.Limits(**POOL_LIMITS)), get_limiter(), get_retry_policy()
+        ),
+        timeout=package.Timeout(**HTTP_TIMEOUT),
+    ))
+
+
+def http_get(url: str, **kwargs) -> httpx.Response:
+    """HTTP 工具用的 GET，走共享连接池、限流和重试"""
+    response = get_http_client().get(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def get_chat_model(model: str, **kwargs):
+    """
+    获取（复用）一个挂接共享限流和连接池的模型实例
+
+    - OpenAI / Claude 模型：使用共享 httpx 连接池，SDK 自带重试关闭（max_retries=0），
+      重试统一由传输层按 RetryPolicy 执行，每次重试也要过限流器
+    - 其他提供商：只通过 rate_limiter 参数接入同一个限流器，连接池和重试仍是 SDK 自带的
+
+    Args:
+        model: 模型名称，如 "gpt-4o"、"claude-sonnet-4-5-20250929"
+        **kwargs: 透传给 init_chat_model 的参数
+    """
+    from langchain.chat_models import init_chat_model
+
+    key = (model, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+    with _lock:
+        if key in _models:
+            return _models[key]
+
+    limiter = get_limiter()
+    kwargs.setdefault("callbacks", [TokenUsageCallback(limiter)])
+    if model.startswith(("gpt-", "o1", "o3", "o4")) or kwargs.get("model_provider") == "openai":
+        kwargs.setdefault("max_retries", 0)
+        instance = init_chat_model(
+            model,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
+            **kwargs
+        )
+    elif model.startswith("claude") or kwargs.get("model_provider") == "anthropic":
+        kwargs.setdefault("max_retries", 0)
+        instance = _use_shared_clients(init_chat_model(model, **kwargs))
+    else:
+        instance = init_chat_model(model, rate_limiter=limiter, **kwargs)
+
+    with _lock:
+        return _models.setdefault(key, instance)
+
+
+def _use_shared_clients(model):
+    """
+    让 ChatAnthropic 走共享连接池
+
+    ChatAnthropic 没有 http_client 参数，SDK 客户端由 _client / _async_client 这两个
+    cached_property 按需创建；这里按它自己的参数（api_key、base_url、超时、请求头）提前建好，
+    只把 httpx 客户端换成共享的，之后不会再触发它的默认实现。
+    SDK 用 httpx 还是 httpx2 由它的 DefaultHttpxClient 的基类决定。
+    """
+    import anthropic
+
+    package = _package_of(anthropic.DefaultHttpxClient)
+    params = model._client_params
+    model.__dict__["_client"] = anthropic.Client(**params, http_client=get_http_client(package))
+    model.__dict__["_async_client"] = anthropic.AsyncClient(**params, http_client=get_async_http_client(package))
+    return model
+
+
+# ========== 模拟：朴素重试 vs 共享策略 ==========
+
+def _simulate(use_policy: bool, workers: int = 32, calls: int = 20, capacity: int = 8) -> dict:
+    """模拟一个每秒最多处理 capacity*10 个请求的服务，超出即返回 429"""
+    window = {"start": time.monotonic(), "count": 0}
+    window_lock = threading.Lock()
+
+    def handler(request):
+        time.sleep(0.005)
+        with window_lock:
+            now = time.monotonic()
+            if now - window["start"] >= 0.1:
+                window["start"], window["count"] = now, 0
+            window["count"] += 1
+            overloaded = window["count"] > capacity
+        return httpx.Response(429 if overloaded else 200)
+
+    mock = httpx.MockTransport(handler)
+    if use_policy:
+        limiter = RateLimiter(requests_per_minute=capacity * 10 * 60, tokens_per_minute=10**9, burst=capacity)
+        policy = RetryPolicy(max_attempts=6, base=0.02, cap=0.5)
+        client = httpx.Client(transport=LimitedTransport(mock, limiter, policy))
+    else:
+        client = httpx.Client(transport=mock)
+
+    stats = {"ok": 0, "failed": 0, "sent": 0}
+    stats_lock = threading.Lock()
+
+    def worker():
+        for _ in range(calls):
+            for _attempt in range(6 if not use_policy else 1):
+                response = client.get("http://sim/")
+                with stats_lock:
+                    stats["sent"] += 1
+                if response.status_code == 200:
+                    break
+            with stats_lock:
+                stats["ok" if response.status_code == 200 else "failed"] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats["elapsed"] = time.monotonic() - started
+    if use_policy:
+        stats["sent"] = policy.stats["requests"] + policy.stats["retries"]
+    return stats
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("模拟 429 场景：朴素立即重试 vs 共享限流 + 抖动退避")
+    print("=" * 60)
+    for label, use_policy in [("朴素重试", False), ("共享策略", True)]:
+        s = _simulate(use_policy)
+        total = s["ok"] + s["failed"]
+        print(
+            f"{label}: 成功率 {s['ok'] / total:.0%}，放大倍数 {s['sent'] / total:.1f}x，"
+            f"耗时 {s['elapsed']:.2f}s，有效吞吐 {s['ok'] / s['elapsed']:.0f} req/s"
+        )
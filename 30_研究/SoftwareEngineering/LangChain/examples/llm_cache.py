@@ -0,0 +1,255 @@
+"""
+LangChain 持久化 LLM 响应缓存
+
+开发和回归测试时，同样的消息列表会被反复发送给模型。
+本模块提供基于 SQLite（WAL 模式）的磁盘缓存：
+1. 键：模型名 + 生成参数 + 消息内容的规范化哈希（不含消息 id 等随机字段）
+2. 只在 temperature=0 或显式 force 时生效，避免把随机输出固化
+3. 按总字节数做 LRU 淘汰
+4. 同时支持 invoke 和 stream，stream 命中时按原样回放缓存的 chunk
+5. 包装结果本身是 BaseChatModel，bind_tools 后的模型和 | 组合的链同样走缓存
+
+用法：
+    llm = cached(ChatOpenAI(model="gpt-4o-mini", temperature=0))
+    llm.invoke(messages)          # 第二次起直接读缓存
+    for chunk in llm.stream(messages): ...
+
+设置环境变量 LLM_CACHE_FORCE=1 可在 temperature != 0 时也强制缓存。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    convert_to_messages,
+    messages_from_dict,
+    message_to_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# 不影响输出内容的参数，不参与缓存键
+_IGNORED_PARAMS = {"stream", "streaming", "stream_usage", "max_retries", "request_timeout", "timeout"}
+
+
+def _canonical_message(message) -> dict:
+    """只保留决定模型输出的字段"""
+    return {
+        "type": message.type,
+        "content": message.content,
+        "name": getattr(message, "name", None),
+        "tool_calls": getattr(message, "tool_calls", None) or None,
+        "tool_call_id": getattr(message, "tool_call_id", None),
+    }
+
+
+def _unwrap(llm) -> tuple:
+    """剥开 bind_tools / bind 产生的 RunnableBinding，返回 (底层模型, 绑定的参数)"""
+    bound = {}
+    while hasattr(llm, "bound") and hasattr(llm, "kwargs"):
+        bound = {**llm.kwargs, **bound}
+        llm = llm.bound
+    return llm, bound
+
+
+def cache_key(llm, messages, kind: str, **kwargs) -> str:
+    """
+    模型 + 参数 + 消息 的规范化哈希
+
+    messages 可以是字符串、dict 或消息对象，先统一成消息对象；
+    绑定的工具和调用时的 stop 等参数都参与哈希。
+    """
+    model, bound = _unwrap(llm)
+    params = {
+        k: v for k, v in {**getattr(model, "_identifying_params", {}), **bound, **kwargs}.items()
+        if k not in _IGNORED_PARAMS
+    }
+    if isinstance(messages, str):
+        messages = [messages]
+    payload = {
+        "kind": kind,
+        "llm": type(model).__name__,
+        "params": params,
+        "messages": [_canonical_message(m) for m in convert_to_messages(messages)],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteResponseCache:
+    """SQLite 磁盘缓存（WAL 模式，按总大小 LRU 淘汰）"""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._total += size - (old[0] if old else 0)
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """超出上限时，按最近访问时间从旧到新删除"""
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total -= size
+                self.stats["evicted"] += 1
+
+    def size_bytes(self) -> int:
+        return self._total
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedChatModel(BaseChatModel):
+    """
+    带缓存的模型包装
+
+    本身是一个 BaseChatModel，bind_tools、| 组合、with_config 得到的仍是带缓存的模型；
+    _generate / _stream 先查缓存，未命中再委托给原模型。
+
+    Args:
+        llm: 原模型（或 bind_tools 之后的模型）
+        cache: SQLiteResponseCache 实例
+        force: temperature != 0 时也缓存
+    """
+
+    llm: Any
+    response_cache: Any  # BaseChatModel 自己有 cache 字段，这里换个名字
+    force: bool = False
+
+    def __init__(self, llm, cache: SQLiteResponseCache, force: bool = False, **kwargs):
+        super().__init__(
+            llm=llm, response_cache=cache, force=force or os.getenv("LLM_CACHE_FORCE") == "1", **kwargs
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "cached-chat-model"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return getattr(_unwrap(self.llm)[0], "_identifying_params", {})
+
+    @property
+    def cacheable(self) -> bool:
+        model, bound = _unwrap(self.llm)
+        return self.force or bound.get("temperature", getattr(model, "temperature", None)) == 0
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"llm": self.llm.bind_tools(tools, **kwargs)})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if not self.cacheable:
+            response = self.llm.invoke(messages, stop=stop, **kwargs)
+            return ChatResult(generations=[ChatGeneration(message=response)])
+
+        key = cache_key(self.llm, messages, "invoke", stop=stop, **kwargs)
+        hit = self.response_cache.get(key)
+        if hit is not None:
+            return ChatResult(generations=[ChatGeneration(message=messages_from_dict([hit])[0])])
+
+        response = self.llm.invoke(messages, stop=stop, **kwargs)
+        if isinstance(response, AIMessage):
+            self.response_cache.put(key, message_to_dict(response))
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.cacheable:
+            for chunk in self.llm.stream(messages, stop=stop, **kwargs):
+                yield self._emit(chunk, run_manager)
+            return
+
+        key = cache_key(self.llm, messages, "stream", stop=stop, **kwargs)
+        hit = self.response_cache.get(key)
+        if hit is not None:
+            for chunk in messages_from_dict(hit):
+                yield self._emit(chunk, run_manager)
+            return
+
+        chunks = []
+        for chunk in self.llm.stream(messages, stop=stop, **kwargs):
+            chunks.append(chunk)
+            yield self._emit(chunk, run_manager)
+        # 只缓存完整读完、且非空的流；中途放弃的流走不到这里
+        if chunks and all(isinstance(c, AIMessageChunk) for c in chunks):
+            self.response_cache.put(key, [message_to_dict(c) for c in chunks])
+
+    @staticmethod
+    def _emit(chunk, run_manager) -> ChatGenerationChunk:
+        generation = ChatGenerationChunk(message=chunk)
+        if run_manager:
+            run_manager.on_llm_new_token(generation.text, chunk=generation)
+        return generation
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> SQLiteResponseCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = SQLiteResponseCache()
+        return _default_cache
+
+
+def cached(llm, force: bool = False) -> CachedChatModel:
+    """用进程共享的默认缓存包装模型"""
+    return CachedChatModel(llm, get_default_cache(), force=force)
@@ -0,0 +1,436 @@
+"""
+LangChain 记忆策略基准：成本、时延与事实召回
+
+04-memory-conversation.py 的 demo_different_memory_comparison 只在 10 轮对话后比较一次 token 数，
+文末的选型指南也是凭经验写的。本模块重放很长的脚本化对话（对话中随机埋入若干条用户事实），
+对每种记忆策略逐轮测量：
+1. prompt tokens：系统提示 + 记忆给出的历史 + 本轮输入（tiktoken 计数）
+2. 附加时延：每轮 load_memory_variables + save_context 的耗时，摘要和嵌入调用都算在内
+3. 峰值内存：单独重放一遍，用 tracemalloc 记录峰值
+4. 事实召回：在第 N 轮询问每条已埋入的事实，记忆给出的上下文里仍包含答案的比例
+
+参与对比的策略与 TokenBudgetMemory 一样实现 ConversationBufferMemory 的接口
+（save_context / load_memory_variables），可以直接替换进示例：
+    Buffer       完整历史
+    Window       最近 k 轮
+    TokenBudget  token_budget_memory.TokenBudgetMemory
+    Summary      预算内的最近原文 + 更早内容的滚动摘要（ConversationSummaryBufferMemory 的做法）
+    Vector       每轮对话向量化，按本轮输入检索 top-k（VectorStoreRetrieverMemory 的做法）
+
+有 OPENAI_API_KEY 时摘要和嵌入使用真实模型（每种策略会重放两遍，调用次数也翻倍）；
+否则摘要退化为抽取式（只保留用户的自述句），嵌入退化为离线的字符哈希嵌入，结果只适合相对比较。
+
+运行 `python memory_benchmark.py --turns 200 --facts 12`。
+"""
+
+import argparse
+import math
+import os
+import random
+import re
+import time
+import tracemalloc
+import zlib
+from collections import deque
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from token_budget_memory import MESSAGE_OVERHEAD, TokenBudgetMemory, get_token_counter
+from tracing import percentile
+
+SYSTEM_PROMPT = "你是一个乐于助人的中文助手，请结合下面的对话历史回答用户的问题。"
+
+
+# ========== 脚本化对话 ==========
+
+# (陈述模板, 提问, 取值函数)
+FACTS = [
+    ("对了，我的会员卡号是 {v}，之后办业务可能要用。", "我的会员卡号是多少？",
+     lambda r: str(r.randrange(10 ** 7, 10 ** 8))),
+    ("我女儿叫{v}，今年刚上小学。", "我女儿叫什么名字？",
+     lambda r: r.choice(["林小满", "周一诺", "陈可可", "王朵朵"])),
+    ("我对{v}过敏，推荐餐厅的时候注意一下。", "我对什么食物过敏？",
+     lambda r: r.choice(["花生", "芒果", "海鲜", "菠萝"])),
+    ("下个月我要去{v}出差一周。", "我下个月去哪里出差？",
+     lambda r: r.choice(["乌鲁木齐", "哈尔滨", "厦门", "昆明"])),
+    ("我的工位在 {v}，找我可以直接过来。", "我的工位在哪里？",
+     lambda r: f"{r.randint(3, 29)} 层 {r.randint(1, 60)} 号"),
+    ("我家的猫叫{v}。", "我家的猫叫什么？",
+     lambda r: r.choice(["年糕", "橘子", "煤球", "豆包"])),
+    ("我平时用 {v} 写代码。", "我平时用什么编辑器？",
+     lambda r: r.choice(["Neovim", "Emacs", "Zed", "Sublime Text"])),
+    ("这次的预算上限是 {v} 元，别超了。", "我的预算上限是多少？",
+     lambda r: f"{r.randrange(3000, 20000, 500):,}"),
+    ("我的航班号是 {v}。", "我的航班号是多少？",
+     lambda r: f"{r.choice(['CA', 'MU', 'CZ', 'HU'])}{r.randint(1000, 9999)}"),
+    ("我住在{v}附近。", "我住在哪里附近？",
+     lambda r: r.choice(["望京", "陆家嘴", "西溪湿地", "春熙路"])),
+    ("我的车牌号是 {v}。", "我的车牌号是多少？",
+     lambda r: f"{r.choice('京沪浙川粤')}{r.choice('ABCDE')}·{r.randint(10000, 99999)}"),
+    ("我的生日是 {v}。", "我的生日是哪天？",
+     lambda r: f"{r.randint(1, 12)} 月 {r.randint(1, 28)} 日"),
+]
+
+TOPICS = ["装饰器", "生成器", "上下文管理器", "元类", "协程", "类型注解", "数据类", "描述符",
+          "异常处理", "包管理", "单元测试", "日志", "并发", "缓存", "序列化", "正则表达式",
+          "虚拟环境", "性能分析", "数据库连接池", "命令行参数解析"]
+
+QUESTIONS = ["请介绍一下 Python 的{t}", "我在项目里用到了{t}，有什么需要注意的？",
+             "{t}和别的做法相比有什么优缺点？", "能举个{t}的例子吗？", "我总是搞不清{t}，能再讲讲吗？"]
+
+SENTENCES = ["先明确使用场景，再决定具体的实现方式。", "要特别注意边界条件和异常情况。",
+             "标准库里已经有现成的工具，优先使用它们。", "写法上保持简单，便于后来的人维护。",
+             "可以先写一个最小的例子验证想法。", "性能问题要先测量，再决定是否优化。",
+             "团队里最好约定统一的风格。", "出了问题时，日志和单元测试能帮你快速定位。",
+             "这部分在官方文档里有详细说明。", "不同版本之间的行为可能略有差别。"]
+
+
+def planting_turns(turns: int) -> range:
+    """可以埋事实的轮次：每轮最多一条，分布在前 90%，最后几轮不埋，召回才有「隔了多久」的含义"""
+    return range(1, max(2, int(turns * 0.9)))
+
+
+class Conversation:
+    """
+    一段脚本化对话：普通问答中随机埋入若干条用户事实
+
+    Args:
+        turns: 总轮数
+        facts: 埋入的事实条数（不超过 len(FACTS)，也不超过 len(planting_turns(turns))）
+        seed: 随机种子，相同种子生成相同对话
+    """
+
+    def __init__(self, turns: int, facts: int, seed: int):
+        rng = random.Random(seed)
+        planted = dict(zip(sorted(rng.sample(planting_turns(turns), facts)),
+                           rng.sample(FACTS, facts)))
+        self.turns = []
+        self.facts = []  # (轮次, 提问, 答案)
+        for turn in range(1, turns + 1):
+            if turn in planted:
+                template, question, value = planted[turn]
+                answer = value(rng)
+                self.turns.append((template.format(v=answer), "好的，我记下了。"))
+                self.facts.append((turn, question, answer))
+                continue
+            topic = rng.choice(TOPICS)
+            reply = f"关于{topic}："
+            target = rng.randint(60, 400)
+            while len(reply) < target:
+                reply += rng.choice(SENTENCES)
+            self.turns.append((rng.choice(QUESTIONS).format(t=topic), reply))
+
+
+# ========== 记忆策略 ==========
+
+def _format(turns) -> str:
+    return "\n".join(f"Human: {human}\nAI: {ai}" for human, ai in turns)
+
+
+class BufferMemory:
+    """完整保留全部历史（ConversationBufferMemory）"""
+
+    memory_key = "history"
+
+    def __init__(self):
+        self.turns = []
+        self.extra_calls = 0  # 记忆本身产生的模型 / 嵌入调用次数
+
+    def save_context(self, inputs: dict, outputs: dict):
+        self.turns.append((next(iter(inputs.values())), next(iter(outputs.values()))))
+
+    def load_memory_variables(self, inputs: dict | None = None) -> dict:
+        return {self.memory_key: _format(self.turns)}
+
+    def clear(self):
+        self.turns.clear()
+
+
+class WindowMemory(BufferMemory):
+    """只保留最近 k 轮（ConversationBufferWindowMemory）"""
+
+    def __init__(self, k: int = 5):
+        super().__init__()
+        self.turns = deque(maxlen=k)
+
+
+class LLMSummarizer:
+    """用聊天模型把旧对话滚动并入摘要"""
+
+    def __init__(self, llm, max_chars: int = 600):
+        self.llm = llm
+        self.max_chars = max_chars
+
+    def __call__(self, summary: str, turns: list) -> str:
+        prompt = (
+            f"逐步总结对话，把新的对话内容并入已有摘要，返回新的摘要，不超过 {self.max_chars} 字。\n"
+            "必须保留用户提到的具体事实（姓名、数字、日期、地点、偏好），可以省略技术问答的细节。\n\n"
+            f"已有摘要：\n{summary or '（无）'}\n\n新的对话：\n{_format(turns)}\n\n新的摘要："
+        )
+        return self.llm.invoke(prompt).content.strip()
+
+
+class ExtractiveSummarizer:
+    """
+    离线摘要：只保留用户的自述句（含「我」），超出 max_tokens 时丢弃最旧的句子
+
+    比模型摘要更偏向保留事实，也会被「我在项目里用到了…」这类句子挤占，召回只作参考。
+    """
+
+    _SPLIT = re.compile(r"(?<=[。！？])")
+
+    def __init__(self, token_counter, max_tokens: int = 300):
+        self.token_counter = token_counter
+        self.max_tokens = max_tokens
+
+    def __call__(self, summary: str, turns: list) -> str:
+        lines = deque(summary.splitlines() if summary else ())
+        for human, _ in turns:
+            lines.extend(f"用户说：{s}" for s in self._SPLIT.split(human) if "我" in s)
+        tokens = [self.token_counter(line) for line in lines]
+        total = sum(tokens)
+        while total > self.max_tokens and lines:
+            lines.popleft()
+            total -= tokens.pop(0)
+        return "\n".join(lines)
+
+
+class SummaryBufferMemory(BufferMemory):
+    """
+    预算内保留最近原文，溢出的旧轮次并入滚动摘要（ConversationSummaryBufferMemory）
+
+    超出预算时一次裁到预算的一半再摘要，把摘要调用摊到多轮，而不是每轮都调一次。
+
+    Args:
+        summarizer: (旧摘要, [(human, ai), ...]) -> 新摘要
+        max_tokens: 最近原文的 token 上限
+        token_counter: text -> token 数
+    """
+
+    def __init__(self, summarizer, max_tokens: int = 1000, token_counter=None):
+        super().__init__()
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter or get_token_counter()
+        self.turns = deque()  # (human, ai, tokens)
+        self.total_tokens = 0
+        self.summary = ""
+
+    def save_context(self, inputs: dict, outputs: dict):
+        human, ai = next(iter(inputs.values())), next(iter(outputs.values()))
+        tokens = self.token_counter(human) + self.token_counter(ai) + 2 * MESSAGE_OVERHEAD
+        self.turns.append((human, ai, tokens))
+        self.total_tokens += tokens
+        if self.total_tokens <= self.max_tokens:
+            return
+        folded = []
+        while self.total_tokens > self.max_tokens // 2 and len(self.turns) > 1:
+            human, ai, tokens = self.turns.popleft()
+            self.total_tokens -= tokens
+            folded.append((human, ai))
+        self.summary = self.summarizer(self.summary, folded)
+        self.extra_calls += 1
+
+    def load_memory_variables(self, inputs: dict | None = None) -> dict:
+        recent = _format((human, ai) for human, ai, _ in self.turns)
+        if not self.summary:
+            return {self.memory_key: recent}
+        return {self.memory_key: f"System: 之前对话的摘要：\n{self.summary}\n{recent}"}
+
+    def clear(self):
+        self.turns.clear()
+        self.total_tokens = 0
+        self.summary = ""
+
+
+class HashingEmbeddings(Embeddings):
+    """离线嵌入：中文按单字和相邻二字、英文按词做特征哈希，只有字面相似度，没有语义泛化"""
+
+    _LATIN = re.compile(r"[a-z0-9]+")
+    _CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+
+    def __init__(self, dims: int = 256):
+        self.dims = dims
+
+    def _embed(self, text: str) -> list:
+        text = text.lower()
+        features = self._LATIN.findall(text)
+        for run in self._CJK.findall(text):
+            features.extend(run)
+            features.extend(run[i:i + 2] for i in range(len(run) - 1))
+        vector = [0.0] * self.dims
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dims] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+class VectorMemory(BufferMemory):
+    """每轮对话写入向量库，按本轮输入检索最相关的 k 轮（VectorStoreRetrieverMemory）"""
+
+    def __init__(self, embeddings, k: int = 4):
+        super().__init__()
+        self.store = InMemoryVectorStore(embeddings)
+        self.k = k
+        self.count = 0
+
+    def save_context(self, inputs: dict, outputs: dict):
+        human, ai = next(iter(inputs.values())), next(iter(outputs.values()))
+        self.store.add_texts([_format([(human, ai)])], metadatas=[{"turn": self.count}])
+        self.count += 1
+        self.extra_calls += 1
+
+    def load_memory_variables(self, inputs: dict | None = None) -> dict:
+        query = next(iter((inputs or {}).values()), "")
+        if not self.count or not query:
+            return {self.memory_key: ""}
+        docs = self.store.similarity_search(query, k=self.k)
+        self.extra_calls += 1
+        # 按原对话顺序拼接
+        docs.sort(key=lambda doc: doc.metadata["turn"])
+        return {self.memory_key: "\n".join(doc.page_content for doc in docs)}
+
+    def clear(self):
+        self.store = InMemoryVectorStore(self.store.embedding)
+        self.count = 0
+
+
+def build_strategies(args, count_tokens) -> dict:
+    """策略名 -> 创建新记忆实例的工厂；有 API key 时摘要和嵌入走真实模型"""
+    if os.getenv("OPENAI_API_KEY"):
+        from langchain_openai import OpenAIEmbeddings
+
+        from http_pool import get_chat_model
+
+        summarizer = LLMSummarizer(get_chat_model(args.summary_model, temperature=0))
+        embeddings = OpenAIEmbeddings(model=args.embedding_model)
+    else:
+        summarizer = ExtractiveSummarizer(count_tokens, max_tokens=args.budget // 3)
+        embeddings = HashingEmbeddings()
+
+    return {
+        "Buffer": BufferMemory,
+        f"Window (k={args.window})": lambda: WindowMemory(k=args.window),
+        f"TokenBudget ({args.budget})": lambda: TokenBudgetMemory(
+            max_tokens=args.budget, token_counter=count_tokens),
+        f"Summary ({args.budget})": lambda: SummaryBufferMemory(
+            summarizer, max_tokens=args.budget, token_counter=count_tokens),
+        f"Vector (k={args.top_k})": lambda: VectorMemory(embeddings, k=args.top_k),
+    }
+
+
+# ========== 重放与统计 ==========
+
+def replay(factory, conversation: Conversation, count_tokens, checkpoints: list) -> dict:
+    """
+    逐轮重放一段对话，返回每轮 prompt tokens、附加时延，以及各检查轮次的召回命中
+
+    真实应用在 load 与 save 之间调用模型，那部分与记忆策略无关，这里不模拟。
+    """
+    memory = factory()
+    fixed = count_tokens(SYSTEM_PROMPT) + 2 * MESSAGE_OVERHEAD
+    prompt_tokens, latencies, hits = [], [], {}
+    probe_calls = 0
+    for turn, (human, ai) in enumerate(conversation.turns, 1):
+        started = time.perf_counter()
+        history = memory.load_memory_variables({"input": human})[memory.memory_key]
+        memory.save_context({"input": human}, {"output": ai})
+        latencies.append(time.perf_counter() - started)
+        prompt_tokens.append(fixed + count_tokens(history) + count_tokens(human) + MESSAGE_OVERHEAD)
+
+        if turn in checkpoints:
+            planted = [(q, a) for t, q, a in conversation.facts if t <= turn]
+            before = getattr(memory, "extra_calls", 0)
+            found = sum(a in memory.load_memory_variables({"input": q})[memory.memory_key] for q, a in planted)
+            probe_calls += getattr(memory, "extra_calls", 0) - before
+            hits[turn] = (found, len(planted))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "latencies": latencies,
+        "hits": hits,
+        # 召回提问产生的检索不算在对话成本里
+        "extra_calls": getattr(memory, "extra_calls", 0) - probe_calls,
+    }
+
+
+def peak_memory(factory, conversation: Conversation) -> int:
+    """只做 load + save 的一遍重放，返回 tracemalloc 记录的峰值增量（字节）"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    memory = factory()
+    for human, ai in conversation.turns:
+        memory.load_memory_variables({"input": human})
+        memory.save_context({"input": human}, {"output": ai})
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return peak
+
+
+def run(args):
+    count_tokens = get_token_counter("gpt-4o")
+    checkpoints = sorted({min(max(t, 1), args.turns) for t in (args.at or [args.turns // 4, args.turns // 2, args.turns])})
+    conversations = [Conversation(args.turns, args.facts, seed) for seed in range(args.conversations)]
+    strategies = build_strategies(args, count_tokens)
+
+    print("=" * 60)
+    print(f"记忆策略基准：{args.conversations} 段对话 × {args.turns} 轮，每段埋入 {args.facts} 条事实")
+    print(f"摘要 / 嵌入：{'真实模型' if os.getenv('OPENAI_API_KEY') else '离线（抽取式摘要 + 字符哈希嵌入）'}")
+    print("=" * 60)
+
+    recall_header = "".join(f"{f'召回@{t}':>9}" for t in checkpoints)
+    print(f"{'策略':<20}{'tokens/轮':>10}{f'第{args.turns}轮':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'峰值 KB':>9}{'额外调用/轮':>10}{recall_header}")
+    print("-" * (76 + 9 * len(checkpoints)))
+
+    for name, factory in strategies.items():
+        results = [replay(factory, c, count_tokens, checkpoints) for c in conversations]
+        peak = max(peak_memory(factory, c) for c in conversations)
+
+        tokens = [t for r in results for t in r["prompt_tokens"]]
+        last = sum(r["prompt_tokens"][-1] for r in results) / len(results)
+        latencies = [t for r in results for t in r["latencies"]]
+        extra = sum(r["extra_calls"] for r in results) / (args.turns * len(results))
+        recall = ""
+        for t in checkpoints:
+            found = sum(r["hits"][t][0] for r in results)
+            planted = sum(r["hits"][t][1] for r in results)
+            recall += f"{found / planted:>9.0%}" if planted else f"{'-':>9}"
+        print(f"{name:<20}{sum(tokens) / len(tokens):>10,.0f}{last:>9,.0f}"
+              f"{percentile(latencies, 50) * 1000:>9.2f}{percentile(latencies, 95) * 1000:>9.2f}"
+              f"{peak / 1024:>9,.0f}{extra:>10.2f}{recall}")
+
+    print("\n召回@N：第 N 轮时已埋入的事实里，记忆给出的上下文仍包含答案的比例")
+    print("额外调用/轮：记忆自身产生的摘要 / 嵌入调用，按轮平均")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆策略基准：prompt tokens、附加时延、峰值内存、事实召回")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--facts", type=int, default=12, choices=range(1, len(FACTS) + 1), metavar=f"1..{len(FACTS)}")
+    parser.add_argument("--conversations", type=int, default=3)
+    parser.add_argument("--at", type=int, nargs="*", help="计算召回的轮次，默认 N/4、N/2、N")
+    parser.add_argument("--window", type=int, default=5)
+    parser.add_argument("--budget", type=int, default=1000, help="TokenBudget 与 Summary 的 token 预算")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--summary-model", default="gpt-4o-mini")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    args = parser.parse_args()
+    needed = 1
+    while len(planting_turns(needed)) < args.facts:
+        needed += 1
+    if args.turns < needed:
+        parser.error(f"--facts {args.facts} 需要 {args.facts} 个可埋事实的轮次（前 90%，每轮一条），"
+                     f"--turns 至少为 {needed}")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+LangChain 多后端模型池：时延感知路由 + 对冲请求
+
+每个示例都写死了一个模型，一个慢后端就决定了整体的尾延迟。
+ModelPool 本身是一个 BaseChatModel，凡是示例里传 model 的地方都能直接替换：
+1. 为每个后端维护滚动时延窗口，路由到最快的健康后端
+2. 连续失败的后端进入冷却期，期间不参与路由
+3. 对冲请求（hedged request）：首选后端超过自身 p95 还没返回时，
+   向次优后端再发一份，先返回者胜出，另一份被取消
+4. stream / astream 同样对冲，在第一个 chunk 上竞速，开始输出后固定在胜出的后端上
+
+用法：
+    pool = ModelPool(
+        backends=[get_chat_model("gpt-4o"), get_chat_model("claude-sonnet-4-5-20250929")],
+        names=["gpt-4o", "claude"],
+    )
+    agent = create_agent(model=pool, tools=[...])
+
+运行 `python model_pool.py` 用模拟后端对比单后端、路由、路由 + 对冲的 p99。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from tracing import percentile
+
+# 同步调用的对冲在线程中进行；线程无法被取消，输掉的请求会在后台自然结束
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model-pool")
+
+
+class BackendStats:
+    """单个后端的滚动时延和健康状态"""
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.wins = 0
+        self.lock = threading.Lock()
+
+    def record(self, elapsed: float, ok: bool, failure_threshold: int, cooldown: float):
+        with self.lock:
+            self.calls += 1
+            if ok:
+                self.latencies.append(elapsed)
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= failure_threshold:
+                self.cooldown_until = time.monotonic() + cooldown
+
+    def record_censored(self, elapsed: float):
+        """被取消的对冲输家：记录已等待的时间作为下界，让慢后端的统计如实变差"""
+        with self.lock:
+            self.latencies.append(elapsed)
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def percentile(self, p: float) -> float | None:
+        with self.lock:
+            if not self.latencies:
+                return None
+            values = list(self.latencies)
+        return percentile(values, p)
+
+
+class ModelPool(BaseChatModel):
+    """
+    多后端模型池
+
+    Args:
+        backends: 后端模型列表
+        names: 后端名称（用于统计输出）
+        hedge: 是否启用对冲请求
+        min_samples: 样本数达到该值后才用 p95 作为对冲阈值
+        default_hedge_delay: 样本不足时的对冲阈值（秒）
+
+    异步调用（ainvoke / astream）会取消输掉的请求；同步 invoke 的输家在线程里无法取消，
+    仍会跑完并计费一整次请求，只是统计上按胜者返回时已等待的时间记录；
+    同步 stream 的输家在吐出第一个 chunk 后被关闭，不会把整个回答生成完。
+    """
+
+    backends: list
+    names: list | None = None
+    hedge: bool = True
+    min_samples: int = 20
+    default_hedge_delay: float = 2.0
+    window: int = 200
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+    # bind_tools 产生的副本与原池共享同一份统计
+    stats: list = Field(default_factory=list)
+    counters: dict = Field(default_factory=lambda: {"requests": 0, "hedged": 0, "hedge_wins": 0})
+
+    def model_post_init(self, __context):
+        if not self.stats:
+            names = self.names or [f"backend-{i}" for i in range(len(self.backends))]
+            self.stats.extend(BackendStats(name, self.window) for name in names)
+
+    @property
+    def _llm_type(self) -> str:
+        return "model-pool"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={
+            "backends": [backend.bind_tools(tools, **kwargs) for backend in self.backends]
+        })
+
+    # ---------- 路由 ----------
+
+    def _ranked(self) -> list:
+        """健康后端按 p50 从快到慢排序；样本不足的后端优先探测"""
+        indexes = [i for i, s in enumerate(self.stats) if s.healthy()] or list(range(len(self.backends)))
+
+        def score(i):
+            p50 = self.stats[i].percentile(50)
+            return -1.0 if p50 is None or len(self.stats[i].latencies) < 3 else p50
+
+        return sorted(indexes, key=score)
+
+    def _hedge_delay(self, index: int) -> float:
+        stats = self.stats[index]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return stats.percentile(95)
+
+    def _result(self, index: int, message: AIMessage) -> ChatResult:
+        self.stats[index].wins += 1
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"backend": self.stats[index].name},
+        )
+
+    # ---------- 同步 ----------
+
+    def _call(self, index: int, messages, stop, kwargs, abandoned: threading.Event) -> AIMessage:
+        started = time.monotonic()
+        try:
+            message = self.backends[index].invoke(messages, stop=stop, **kwargs)
+        except Exception:
+            if not abandoned.is_set():
+                self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        # 已被放弃的输家在返回时记过一次截尾时延，这里不再重复记录
+        if not abandoned.is_set():
+            self.stats[index].record(time.monotonic() - started, True, self.failure_threshold, self.cooldown)
+        return message
+
+    def _race(self, call, messages, stop, kwargs, discard=None) -> tuple:
+        """
+        同步对冲：call(index, messages, stop, kwargs, abandoned) 在线程池中执行，返回 (胜出的后端下标, 结果)
+
+        discard 用于清理输家之后返回的结果（如关闭输家的流）。
+        """
+        self.counters["requests"] += 1
+        candidates = self._ranked()
+        primary = candidates.pop(0)
+        futures = {}  # future -> (后端下标, 开始时间, 放弃标记)
+
+        def submit(index: int):
+            abandoned = threading.Event()
+            future = _executor.submit(call, index, messages, stop, kwargs, abandoned)
+            futures[future] = (index, time.monotonic(), abandoned)
+
+        submit(primary)
+        timeout = self._hedge_delay(primary) if self.hedge and candidates else None
+        last_error = None
+
+        while futures:
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            timeout = None
+            if not done:
+                # 首选后端超过 p95：对冲到次优后端
+                self.counters["hedged"] += 1
+                submit(candidates.pop(0))
+                continue
+            for future in done:
+                index, _, _ = futures.pop(future)
+                if future.exception() is None:
+                    if index != primary:
+                        self.counters["hedge_wins"] += 1
+                    self._abandon(futures, discard)
+                    return index, future.result()
+                last_error = future.exception()
+            if not futures and candidates:
+                # 全部失败：故障转移到下一个后端
+                submit(candidates.pop(0))
+
+        raise last_error
+
+    def _abandon(self, futures: dict, discard=None):
+        """同步输家无法取消：与异步路径一样，把已等待的时间作为截尾时延记下"""
+        for future, (index, started, abandoned) in futures.items():
+            if not future.done():
+                abandoned.set()
+                self.stats[index].record_censored(time.monotonic() - started)
+            if discard is not None:
+                # 在输家线程返回时执行；已经完成的 future 会立即执行
+                future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        index, message = self._race(self._call, messages, stop, kwargs)
+        return self._result(index, message)
+
+    # ---------- 流式 ----------
+    # 在第一个 chunk 上竞速：首选后端超过对冲阈值还没吐出第一个 chunk，就向次优后端再发一份，
+    # 先吐出第一个 chunk 的后端胜出并继续输出，其余的流被关闭；开始输出后不再切换后端。
+    # 对冲阈值仍是整次调用的 p95，对第一个 chunk 来说偏保守；胜者按整个流的耗时记录时延。
+
+    def _open(self, index: int, messages, stop, kwargs, abandoned: threading.Event) -> tuple:
+        """开始流式调用并取出第一个 chunk，返回 (流, 第一个 chunk 或 None, 开始时间)"""
+        started = time.monotonic()
+        stream = self.backends[index].stream(messages, stop=stop, **kwargs)
+        try:
+            first = next(stream, None)
+        except Exception:
+            if not abandoned.is_set():
+                self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        return stream, first, started
+
+    def _chunk(self, index: int, chunk, first: bool, run_manager) -> ChatGenerationChunk:
+        generation = ChatGenerationChunk(
+            message=chunk, generation_info={"backend": self.stats[index].name} if first else None
+        )
+        if run_manager:
+            run_manager.on_llm_new_token(generation.text, chunk=generation)
+        return generation
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        index, (stream, first, started) = self._race(
+            self._open, messages, stop, kwargs, discard=lambda opened: opened[0].close()
+        )
+        self.stats[index].wins += 1
+        try:
+            if first is not None:
+                yield self._chunk(index, first, True, run_manager)
+            for chunk in stream:
+                yield self._chunk(index, chunk, False, run_manager)
+        except Exception:
+            self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        finally:
+            stream.close()
+        self.stats[index].record(time.monotonic() - started, True, self.failure_threshold, self.cooldown)
+
+    # ---------- 异步 ----------
+
+    async def _acall(self, index: int, messages, stop, kwargs) -> AIMessage:
+        started = time.monotonic()
+        try:
+            message = await self.backends[index].ainvoke(messages, stop=stop, **kwargs)
+        except asyncio.CancelledError:
+            self.stats[index].record_censored(time.monotonic() - started)
+            raise
+        except Exception:
+            self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        self.stats[index].record(time.monotonic() - started, True, self.failure_threshold, self.cooldown)
+        return message
+
+    async def _arace(self, acall, messages, stop, kwargs, discard=None) -> tuple:
+        """_race 的异步版本：输家被取消；discard 清理和胜者同时完成的输家的结果"""
+        self.counters["requests"] += 1
+        candidates = self._ranked()
+        primary = candidates.pop(0)
+        tasks = {asyncio.ensure_future(acall(primary, messages, stop, kwargs)): primary}
+        timeout = self._hedge_delay(primary) if self.hedge and candidates else None
+        last_error = None
+
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                timeout = None
+                if not done:
+                    self.counters["hedged"] += 1
+                    backup = candidates.pop(0)
+                    tasks[asyncio.ensure_future(acall(backup, messages, stop, kwargs))] = backup
+                    continue
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is None:
+                        if index != primary:
+                            self.counters["hedge_wins"] += 1
+                        return index, task.result()
+                    last_error = task.exception()
+                if not tasks and candidates:
+                    index = candidates.pop(0)
+                    tasks[asyncio.ensure_future(acall(index, messages, stop, kwargs))] = index
+        finally:
+            # 取消输家，不再为它等待或付费
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+        raise last_error
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        index, message = await self._arace(self._acall, messages, stop, kwargs)
+        return self._result(index, message)
+
+    async def _aopen(self, index: int, messages, stop, kwargs) -> tuple:
+        started = time.monotonic()
+        stream = self.backends[index].astream(messages, stop=stop, **kwargs)
+        try:
+            first = await anext(stream, None)
+        except asyncio.CancelledError:
+            self.stats[index].record_censored(time.monotonic() - started)
+            await stream.aclose()
+            raise
+        except Exception:
+            self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        return stream, first, started
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        index, (stream, first, started) = await self._arace(
+            self._aopen, messages, stop, kwargs, discard=lambda opened: opened[0].aclose()
+        )
+        self.stats[index].wins += 1
+        try:
+            if first is not None:
+                generation = self._chunk(index, first, True, None)
+                if run_manager:
+                    await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+            async for chunk in stream:
+                generation = self._chunk(index, chunk, False, None)
+                if run_manager:
+                    await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+        except Exception:
+            self.stats[index].record(time.monotonic() - started, False, self.failure_threshold, self.cooldown)
+            raise
+        finally:
+            await stream.aclose()
+        self.stats[index].record(time.monotonic() - started, True, self.failure_threshold, self.cooldown)
+
+    def report(self) -> list:
+        return [
+            {
+                "name": s.name,
+                "calls": s.calls,
+                "wins": s.wins,
+                "p50": s.percentile(50),
+                "p95": s.percentile(95),
+                "healthy": s.healthy(),
+            }
+            for s in self.stats
+        ]
+
+
+# ========== 模拟 ==========
+
+class SimulatedChatModel(BaseChatModel):
+    """模拟后端：对数正态的基础时延 + 一定概率的长尾抖动"""
+
+    median: float = 0.05
+    tail_probability: float = 0.05
+    tail_latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated"
+
+    def _latency(self) -> float:
+        latency = random.lognormvariate(0, 0.3) * self.median
+        if random.random() < self.tail_probability:
+            latency += self.tail_latency
+        return latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok"))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok"))])
+
+
+async def _measure(model, requests: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.monotonic()
+            await model.ainvoke("hi")
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return sorted(latencies)
+
+
+def _fmt(latencies: list) -> str:
+    def p(q):
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] * 1000
+    return f"p50 {p(50):6.1f}ms  p95 {p(95):6.1f}ms  p99 {p(99):6.1f}ms"
+
+
+def simulate(requests: int = 1000, concurrency: int = 20):
+    def backends():
+        return [
+            SimulatedChatModel(median=0.05, tail_probability=0.05),
+            SimulatedChatModel(median=0.06, tail_probability=0.05),
+            SimulatedChatModel(median=0.15, tail_probability=0.02),
+        ]
+
+    print("=" * 60)
+    print(f"模拟 {requests} 次请求，并发 {concurrency}")
+    print("=" * 60)
+
+    single = backends()[0]
+    print(f"{'单后端':<12}{_fmt(asyncio.run(_measure(single, requests, concurrency)))}")
+
+    routed = ModelPool(backends=backends(), names=["fast", "fast-2", "slow"], hedge=False)
+    print(f"{'时延路由':<12}{_fmt(asyncio.run(_measure(routed, requests, concurrency)))}")
+
+    hedged = ModelPool(backends=backends(), names=["fast", "fast-2", "slow"], hedge=True)
+    print(f"{'路由 + 对冲':<12}{_fmt(asyncio.run(_measure(hedged, requests, concurrency)))}")
+    print(f"\n对冲次数: {hedged.counters['hedged']}，对冲胜出: {hedged.counters['hedge_wins']}")
+    for row in hedged.report():
+        print(f"  {row['name']:<8} 调用 {row['calls']:5d}  胜出 {row['wins']:5d}  p50 {row['p50'] * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    simulate()
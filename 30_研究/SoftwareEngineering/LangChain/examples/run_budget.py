@@ -0,0 +1,207 @@
+"""
+LangChain 运行时延预算
+
+ModelCallLimitMiddleware 只限制步数，不限制时间。本模块为 create_agent 创建的代理补上时间维度：
+1. 整次运行的墙钟预算（wall-clock budget）
+2. 单次工具调用 / 模型调用的超时
+3. 预算耗尽时优雅停止，返回目前为止最好的部分答案
+4. 每一步结束时报告预算消耗
+
+超时后 Python 线程无法被强制终止，被放弃的运行由 BudgetCallbackHandler 在下一次模型 / 工具调用开始时
+抛出 BudgetExceeded 自行停下，不会在后台继续消耗 token 和工具调用；
+正在进行的那一次调用仍要等它自己结束（由模型超时和 with_timeout 限定）。
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain.agents.middleware.model_call_limit import ModelCallLimitExceededError
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tools import StructuredTool
+
+# 同时执行的运行数上限；没有空闲名额时在预算内等待，等不到直接返回，不在线程池里排队
+RUN_WORKERS = 4
+
+# 整次运行和工具调用分开两个线程池，避免运行占满线程后工具无线程可用
+_run_executor = ThreadPoolExecutor(max_workers=RUN_WORKERS, thread_name_prefix="budget-run")
+_run_slots = threading.BoundedSemaphore(RUN_WORKERS)
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="budget-tool")
+
+
+class BudgetExceeded(Exception):
+    """预算耗尽或运行已被放弃，由 BudgetCallbackHandler 在下一步开始时抛出"""
+
+
+class RunBudget:
+    """一次运行的墙钟预算"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.seconds - self.elapsed())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    记录每一步（模型调用 / 工具调用）的耗时和预算消耗
+
+    工具输出会被保留下来，预算耗尽时用于拼出部分答案。
+    预算耗尽或 stop() 之后，下一次模型 / 工具调用开始时抛出 BudgetExceeded，让运行自己停下。
+    """
+
+    # 回调中的异常默认只记日志，这里要让它中断运行
+    raise_error = True
+
+    def __init__(self, budget: RunBudget, report: bool = True):
+        self.budget = budget
+        self.report = report
+        self.steps = []
+        self.observations = []
+        self._starts = {}
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """放弃运行：之后不再记录结果，下一步开始时抛出 BudgetExceeded"""
+        self._stopped.set()
+
+    def _start(self, run_id: uuid.UUID, kind: str, name: str):
+        if self._stopped.is_set() or self.budget.expired:
+            raise BudgetExceeded(f"运行预算 {self.budget.seconds:.0f}s 已用完，跳过 {kind}:{name}")
+        self._starts[run_id] = (kind, name, time.monotonic())
+
+    def _end(self, run_id: uuid.UUID):
+        if run_id not in self._starts or self._stopped.is_set():
+            return
+        kind, name, started = self._starts.pop(run_id)
+        step = {
+            "kind": kind,
+            "name": name,
+            "elapsed": time.monotonic() - started,
+            "used": self.budget.elapsed(),
+            "remaining": self.budget.remaining(),
+        }
+        self.steps.append(step)
+        if self.report:
+            print(
+                f"[预算] {kind}:{name} 耗时 {step['elapsed']:.2f}s，"
+                f"已用 {step['used']:.2f}s / {self.budget.seconds:.0f}s，"
+                f"剩余 {step['remaining']:.2f}s"
+            )
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm", (serialized or {}).get("name", "chat_model"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm", (serialized or {}).get("name", "llm"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        if not self._stopped.is_set():
+            self.observations.append(str(getattr(output, "content", output)))
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+def with_timeout(tool, seconds: float, budget: RunBudget | None = None):
+    """
+    为工具加上超时
+
+    超时后返回一段提示文本而不是抛异常，代理可以继续基于已有信息作答。
+    注意：Python 线程无法被强制终止，超时的调用会在后台自然结束。
+
+    Args:
+        tool: 原始工具
+        seconds: 单次调用超时（秒）
+        budget: 可选的运行预算，实际超时取两者较小值
+    """
+
+    def run(**kwargs):
+        timeout = seconds if budget is None else min(seconds, budget.remaining())
+        future = _tool_executor.submit(tool.invoke, kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return f"工具 {tool.name} 超时（>{timeout:.1f}s），请基于已有信息回答"
+
+    return StructuredTool.from_function(
+        func=run,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+    )
+
+
+def best_partial_answer(observations: list) -> str:
+    """预算耗尽时，用已完成的工具结果拼出部分答案"""
+    if not observations:
+        return "抱歉，在时间预算内没能得到结果，请稍后重试。"
+    collected = "\n".join(f"- {obs}" for obs in observations)
+    return f"（已达到时间预算，以下为目前获得的部分结果）\n{collected}"
+
+
+def _output_text(result: dict) -> str:
+    """取代理最后一条消息的文本"""
+    content = result["messages"][-1].content if result.get("messages") else ""
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content)
+
+
+def run_with_budget(
+    agent, inputs: dict, budget: RunBudget, report: bool = True, callbacks: list | None = None
+) -> dict:
+    """
+    在墙钟预算内执行 create_agent 创建的代理
+
+    handler 在每一步开始时检查预算，但挂住的单次调用仍会拖住整次运行，
+    因此这里再用线程等待做一层硬截止；截止后调用 handler.stop()，后台的运行在下一步开始时退出。
+    步数上限用 ModelCallLimitMiddleware(exit_behavior="error")，触达时同样返回部分答案。
+
+    callbacks 随调用配置传入，会被子步骤（模型、工具）继承。
+
+    Returns:
+        {"output": 回答, "partial": 是否为部分答案, "steps": 每步预算消耗}
+    """
+    handler = BudgetCallbackHandler(budget, report=report)
+    if not _run_slots.acquire(timeout=budget.remaining()):
+        return {"output": best_partial_answer([]), "partial": True, "steps": []}
+    try:
+        future = _run_executor.submit(agent.invoke, inputs, {"callbacks": [handler, *(callbacks or [])]})
+    except BaseException:
+        _run_slots.release()
+        raise
+    # 名额在运行真正结束时才归还，被放弃但还没退出的运行也占着名额
+    future.add_done_callback(lambda _: _run_slots.release())
+
+    try:
+        output = _output_text(future.result(timeout=budget.remaining()))
+        partial = False
+    except (FutureTimeoutError, BudgetExceeded, ModelCallLimitExceededError):
+        handler.stop()
+        partial = True
+
+    if partial:
+        output = best_partial_answer(list(handler.observations))
+
+    return {"output": output, "partial": partial, "steps": list(handler.steps)}
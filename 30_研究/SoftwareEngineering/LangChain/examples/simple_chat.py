@@ -5,18 +5,21 @@ LangChain 简单对话示例
 适用于简单的问答场景。
 """
 
-from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
 
+from http_pool import get_chat_model
+from llm_cache import cached
+
 def simple_chat():
     """简单对话示例"""
     
-    # 初始化 LLM
+    # 初始化 LLM（复用进程级实例：共享连接池、限流和重试）
     # temperature: 0=确定性回答，1=更有创意
-    llm = ChatOpenAI(
-        model="gpt-4o",
+    # cached()：temperature=0 或 LLM_CACHE_FORCE=1 时命中磁盘缓存
+    llm = cached(get_chat_model(
+        "gpt-4o",
         temperature=0.7
-    )
+    ))
     
     # 构建消息列表
     messages = [
@@ -34,7 +37,7 @@ def simple_chat():
 def multi_turn_chat():
     """多轮对话示例"""
     
-    llm = ChatOpenAI(model="gpt-4o")
+    llm = cached(get_chat_model("gpt-4o"))
     
     # 维护对话历史
     messages = [
@@ -60,10 +63,10 @@ def multi_turn_chat():
 def streaming_chat():
     """流式输出示例 - 实时显示响应"""
     
-    llm = ChatOpenAI(
-        model="gpt-4o",
+    llm = cached(get_chat_model(
+        "gpt-4o",
         streaming=True  # 启用流式传输
-    )
+    ))  # 缓存命中时回放 chunk
     
     print("💬 对话示例 3：流式输出")
     print("你: 写一首关于 AI 的短诗")
@@ -91,6 +94,7 @@ def main():
     print("=" * 60)
     print("提示：要运行这些示例，需要设置 OPENAI_API_KEY 环境变量")
     print("export OPENAI_API_KEY='your-api-key'")
+    print("开发/回归时设置 LLM_CACHE_FORCE=1 可复用磁盘缓存的响应")
     print("=" * 60)
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+LangChain 异步流式 REPL
+
+为各示例的交互模式提供统一的 asyncio 对话循环：
+1. 通过 astream_events 实时输出 token 和工具调用事件，长回答立即开始渲染
+2. Ctrl-C 只取消当前这一轮生成，不会退出会话
+3. 每轮结束显示首 token 延迟和总耗时
+
+取消生成时会关闭底层的流式 HTTP 连接，服务端随之停止生成，
+被放弃的请求不会继续消耗 token。
+"""
+
+import asyncio
+import signal
+import time
+
+
+def default_build_input(user_input: str) -> dict:
+    """create_agent 风格的输入：{"messages": [...]}"""
+    return {"messages": [{"role": "user", "content": user_input}]}
+
+
+def _chunk_text(chunk) -> str:
+    """提取流式 chunk 中的文本（兼容 str 和 content block 列表）"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return ""
+
+
+def _final_text(output) -> str:
+    """从最终输出中取出回答文本，避免直接打印整个响应字典"""
+    if isinstance(output, dict):
+        if "output" in output:  # AgentExecutor
+            return str(output["output"])
+        if output.get("messages"):  # create_agent / LangGraph
+            return _chunk_text(output["messages"][-1])
+    return _chunk_text(output)
+
+
+def _preview(value, limit: int = 80) -> str:
+    text = _chunk_text(value) or str(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+async def stream_turn(runnable, inputs: dict, config: dict | None = None) -> dict:
+    """
+    流式执行一轮对话
+
+    Args:
+        runnable: Agent、AgentExecutor 或任意 Runnable
+        inputs: 本轮输入
+        config: 透传给 astream_events 的配置（如 thread_id、callbacks）
+
+    Returns:
+        本轮统计：首 token 延迟、总耗时、输出 token 片段数
+    """
+    start = time.perf_counter()
+    first_token = None
+    chunks = 0
+    final_output = None
+
+    async for event in runnable.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+
+        if kind == "on_chat_model_stream":
+            text = _chunk_text(event["data"]["chunk"])
+            if text:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                chunks += 1
+                print(text, end="", flush=True)
+        elif kind == "on_tool_start":
+            print(f"\n🔧 调用工具 {event['name']}: {_preview(event['data'].get('input'))}", flush=True)
+        elif kind == "on_tool_end":
+            print(f"✅ {event['name']} 返回: {_preview(event['data'].get('output'))}", flush=True)
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # 顶层链结束：模型未以流式返回时，在这里补打印最终回答
+            final_output = event["data"].get("output")
+
+    if chunks == 0 and final_output is not None:
+        first_token = time.perf_counter() - start
+        print(_final_text(final_output), end="", flush=True)
+
+    return {
+        "first_token": first_token,
+        "total": time.perf_counter() - start,
+        "chunks": chunks,
+    }
+
+
+async def run_repl(
+    runnable,
+    build_input=default_build_input,
+    prompt: str = "\n用户: ",
+    reply_prefix: str = "代理: ",
+    config: dict | None = None,
+    exit_words: tuple = ("exit",),
+):
+    """
+    异步交互循环
+
+    Args:
+        runnable: 要对话的 Agent / Runnable
+        build_input: 把用户输入转换为 runnable 的输入
+        prompt: 输入提示符
+        reply_prefix: 回答前缀
+        config: 每轮透传的配置
+        exit_words: 退出命令
+    """
+    loop = asyncio.get_running_loop()
+    current: asyncio.Task | None = None
+
+    def on_sigint():
+        # 正在生成：取消这一轮；空闲时只提示如何退出
+        if current is not None and not current.done():
+            current.cancel()
+        else:
+            print(f"\n(输入 '{exit_words[0]}' 退出)", flush=True)
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_sigint)
+        can_cancel = True
+    except (NotImplementedError, RuntimeError):
+        # Windows 的事件循环不支持 add_signal_handler
+        can_cancel = False
+
+    try:
+        while True:
+            try:
+                user_input = await loop.run_in_executor(None, input, prompt)
+            except EOFError:
+                print()
+                break
+
+            user_input = user_input.strip()
+            if user_input.lower() in exit_words:
+                print("再见！")
+                break
+            if not user_input:
+                continue
+
+            print(reply_prefix, end="", flush=True)
+            current = asyncio.create_task(
+                stream_turn(runnable, build_input(user_input), config)
+            )
+            try:
+                stats = await current
+            except asyncio.CancelledError:
+                # 只有本轮被取消时才吞掉；外层取消照常向上传播
+                if not current.cancelled():
+                    raise
+                print("\n⛔ 已取消本轮生成", flush=True)
+                continue
+            except Exception as e:
+                print(f"\n错误: {e}")
+                continue
+            finally:
+                current = None
+
+            first = stats["first_token"]
+            first_text = f"{first:.2f}s" if first is not None else "-"
+            print(f"\n⏱  首 token {first_text} · 总耗时 {stats['total']:.2f}s")
+    finally:
+        if can_cancel:
+            loop.remove_signal_handler(signal.SIGINT)
+
+
+def start_repl(runnable, **kwargs):
+    """同步入口：在普通 main() 中直接调用"""
+    asyncio.run(run_repl(runnable, **kwargs))
@@ -0,0 +1,120 @@
+"""
+LangChain 按 token 预算裁剪的对话记忆
+
+len(history) // 4 对中文误差很大（一个汉字往往就是一个 token），
+ConversationBufferWindowMemory(k=...) 又是按轮数而不是按成本裁剪。
+TokenBudgetMemory：
+1. 使用模型自己的分词器（tiktoken）计数，没有 tiktoken 时退化为按字符类型估算
+2. 每条消息的 token 数在写入时算好并缓存，之后不再重复分词
+3. 超出预算时从最旧的一轮开始整轮丢弃，追加和裁剪都是均摊 O(1)
+
+接口与 ConversationBufferMemory 保持一致：save_context / load_memory_variables / clear。
+"""
+
+import re
+from collections import deque
+from functools import lru_cache
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+# 每条消息的格式开销（角色标记等），与 OpenAI 的计数方式一致
+MESSAGE_OVERHEAD = 4
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def _estimate_tokens(text: str) -> int:
+    """没有分词器时的估算：中日文字符按 1 token，其余按 4 字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str = "gpt-4o"):
+    """
+    返回 text -> token 数 的计数函数
+
+    Args:
+        model: 模型名称，用于选择对应的分词器
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return _estimate_tokens
+
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 首次使用需要下载词表，离线环境下退化为估算
+        return _estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class TokenBudgetMemory:
+    """
+    按 token 预算保留最近对话的记忆
+
+    Args:
+        max_tokens: 历史允许占用的 token 上限
+        token_counter: text -> token 数，默认使用 gpt-4o 的分词器
+        memory_key: load_memory_variables 返回的键
+        return_messages: True 返回消息列表，False 返回拼接好的字符串
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        token_counter=None,
+        memory_key: str = "history",
+        return_messages: bool = False,
+        human_prefix: str = "Human",
+        ai_prefix: str = "AI",
+    ):
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter or get_token_counter()
+        self.memory_key = memory_key
+        self.return_messages = return_messages
+        self.human_prefix = human_prefix
+        self.ai_prefix = ai_prefix
+        self._turns = deque()  # (HumanMessage, AIMessage, tokens)
+        self.total_tokens = 0
+
+    @property
+    def memory_variables(self) -> list:
+        return [self.memory_key]
+
+    def _count(self, message) -> int:
+        return self.token_counter(message.content) + MESSAGE_OVERHEAD
+
+    def save_context(self, inputs: dict, outputs: dict):
+        """追加一轮对话：只为新消息分词，然后从旧到新裁剪到预算内"""
+        human = HumanMessage(content=next(iter(inputs.values())))
+        ai = AIMessage(content=next(iter(outputs.values())))
+        tokens = self._count(human) + self._count(ai)
+
+        self._turns.append((human, ai, tokens))
+        self.total_tokens += tokens
+
+        # 至少保留最新一轮，即使它本身超过预算
+        while self.total_tokens > self.max_tokens and len(self._turns) > 1:
+            _, _, dropped = self._turns.popleft()
+            self.total_tokens -= dropped
+
+    def messages(self) -> list:
+        return [m for human, ai, _ in self._turns for m in (human, ai)]
+
+    def load_memory_variables(self, inputs: dict | None = None) -> dict:
+        if self.return_messages:
+            return {self.memory_key: self.messages()}
+        lines = []
+        for human, ai, _ in self._turns:
+            lines.append(f"{self.human_prefix}: {human.content}")
+            lines.append(f"{self.ai_prefix}: {ai.content}")
+        return {self.memory_key: "\n".join(lines)}
+
+    def clear(self):
+        self._turns.clear()
+        self.total_tokens = 0
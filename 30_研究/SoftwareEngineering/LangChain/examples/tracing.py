@@ -0,0 +1,221 @@
+"""
+LangChain 结构化逐步追踪
+
+verbose=True 只能往 stdout 打印文本，看不出时间花在哪里。
+本模块提供：
+1. JsonlTracer：记录每次 LLM 调用、工具调用、检索的起止时间、token 数和载荷大小
+2. JsonlSink：带缓冲的 JSONL 写入，攒够一批再落盘，开销很小
+3. 汇总命令行：按步骤类型输出 p50/p95/p99
+
+用法：
+    python tracing.py agent_trace.jsonl
+"""
+
+import atexit
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class JsonlSink:
+    """带缓冲的 JSONL 写入器（线程安全）"""
+
+    def __init__(self, path: str, buffer_size: int = 256):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        atexit.register(self.close)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer and not self._file.closed:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._file.flush()
+            self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if not self._file.closed:
+                self._file.close()
+
+
+def _size(payload) -> int:
+    """载荷大小（序列化后的字符数）"""
+    if payload is None:
+        return 0
+    if isinstance(payload, str):
+        return len(payload)
+    return len(json.dumps(payload, ensure_ascii=False, default=str))
+
+
+def _token_usage(response) -> dict:
+    """从 LLMResult 中取出 token 用量（兼容 llm_output 和 usage_metadata）"""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+        }
+
+    totals = {"input_tokens": 0, "output_tokens": 0}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                totals["input_tokens"] += metadata.get("input_tokens", 0)
+                totals["output_tokens"] += metadata.get("output_tokens", 0)
+    return totals
+
+
+class JsonlTracer(BaseCallbackHandler):
+    """
+    逐步追踪回调
+
+    每个步骤结束时写一条记录：
+        {"type": "llm|tool|retriever", "name", "run_id", "parent_run_id",
+         "start", "end", "duration", "input_size", "output_size",
+         "input_tokens", "output_tokens", "error"}
+    """
+
+    def __init__(self, sink: JsonlSink):
+        self.sink = sink
+        self._open = {}
+
+    def _start(self, step_type: str, serialized, payload, run_id, parent_run_id):
+        self._open[run_id] = {
+            "type": step_type,
+            "name": (serialized or {}).get("name", step_type),
+            "run_id": str(run_id),
+            "parent_run_id": str(parent_run_id) if parent_run_id else None,
+            "start": time.time(),
+            "input_size": _size(payload),
+        }
+
+    def _end(self, run_id, output=None, error=None, **extra):
+        record = self._open.pop(run_id, None)
+        if record is None:
+            return
+        record["end"] = time.time()
+        record["duration"] = record["end"] - record["start"]
+        record["output_size"] = _size(output)
+        record["error"] = repr(error) if error else None
+        record.update(extra)
+        self.sink.write(record)
+
+    # ---------- LLM ----------
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start("llm", serialized, prompts, run_id, parent_run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        payload = [[m.content for m in batch] for batch in messages]
+        self._start("llm", serialized, payload, run_id, parent_run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        texts = [g.text for generations in response.generations for g in generations]
+        self._end(run_id, texts, **_token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # ---------- 工具 ----------
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start("tool", serialized, input_str, run_id, parent_run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, str(getattr(output, "content", output)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # ---------- 检索 ----------
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start("retriever", serialized, query, run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, [doc.page_content for doc in documents])
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+# ========== 汇总 ==========
+
+def percentile(values: list, p: float) -> float:
+    """最近秩百分位数；values 为空时返回 0"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(path: str) -> dict:
+    """按步骤类型汇总一次运行的耗时分布和 token 数"""
+    durations = defaultdict(list)
+    tokens = defaultdict(int)
+    errors = defaultdict(int)
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            step_type = record["type"]
+            durations[step_type].append(record["duration"])
+            tokens[step_type] += record.get("input_tokens", 0) + record.get("output_tokens", 0)
+            errors[step_type] += 1 if record.get("error") else 0
+
+    summary = {}
+    for step_type, values in durations.items():
+        values.sort()
+        summary[step_type] = {
+            "count": len(values),
+            "total": sum(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "tokens": tokens[step_type],
+            "errors": errors[step_type],
+        }
+    return summary
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("用法: python tracing.py <trace.jsonl>")
+        sys.exit(1)
+
+    summary = summarize(sys.argv[1])
+    print(f"{'类型':<10}{'次数':>6}{'总耗时':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'tokens':>9}{'错误':>6}")
+    print("-" * 68)
+    for step_type, s in sorted(summary.items(), key=lambda kv: -kv[1]["total"]):
+        print(
+            f"{step_type:<10}{s['count']:>6}{s['total']:>9.2f}s"
+            f"{s['p50']:>8.3f}s{s['p95']:>8.3f}s{s['p99']:>8.3f}s"
+            f"{s['tokens']:>9}{s['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
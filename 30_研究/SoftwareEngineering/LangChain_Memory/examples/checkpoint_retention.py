@@ -0,0 +1,161 @@
+"""
+检查点保留策略与后台压缩
+LangGraph 每个 super-step 都会写一个检查点（一轮对话通常 2~3 个），默认永久保留：
+MemorySaver 全部放在进程内存里，SQLite 文件也只增不减。
+
+RetentionPolicy 决定每个线程保留哪些检查点，Compactor 在后台定期执行：
+- SqliteDeltaSaver.compact(policy)：删除过期检查点，先把仍被引用的增量物化为完整快照
+- prune_memory_saver(saver, policy)：对 MemorySaver 做同样的裁剪
+
+各策略对「时间旅行」（get_state_history / 从旧检查点 fork、重放）的影响：
+
+| 策略 | 保留内容 | 时间旅行 |
+|------|----------|----------|
+| 默认（不裁剪） | 全部检查点 | 任意历史步骤都可查看、fork、重放 |
+| keep_last=N | 每个线程最近 N 个检查点 | 只能回到最近 N 个 super-step（约 N/2~N/3 轮对话） |
+| max_age=秒数 | 最近这段时间内的检查点 | 只能回到时间窗口内；长时间不活跃的线程只剩最新一个 |
+| keep_last=1 | 只有最新检查点 | 没有历史，只能继续对话；中断（interrupt）恢复不受影响 |
+
+无论哪种策略，每个线程最新的检查点（连同它的 pending writes）总会保留，
+所以继续对话和从中断恢复都不受影响；被保留的最旧检查点不再有父检查点。
+"""
+
+import threading
+import time
+from datetime import datetime
+
+
+class RetentionPolicy:
+    """
+    检查点保留策略
+
+    Args:
+        keep_last: 每个线程（每个 checkpoint_ns）最多保留的检查点数
+        max_age: 检查点最长保留秒数
+    """
+
+    def __init__(self, keep_last: int | None = None, max_age: float | None = None):
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last 至少为 1：最新检查点总会保留")
+        self.keep_last = keep_last
+        self.max_age = max_age
+
+    def __repr__(self):
+        return f"RetentionPolicy(keep_last={self.keep_last}, max_age={self.max_age})"
+
+    def expired(self, checkpoints: list, now: float | None = None) -> list:
+        """
+        从一个线程的检查点中选出要删除的
+
+        Args:
+            checkpoints: [(checkpoint_id, created_at)]，按新到旧排序
+        """
+        now = time.time() if now is None else now
+        expired = []
+        for index, (checkpoint_id, created_at) in enumerate(checkpoints):
+            if index == 0:
+                continue
+            if self.keep_last is not None and index >= self.keep_last:
+                expired.append(checkpoint_id)
+            elif self.max_age is not None and created_at is not None and now - created_at > self.max_age:
+                expired.append(checkpoint_id)
+        return expired
+
+
+def _created_at(checkpoint: dict) -> float | None:
+    try:
+        return datetime.fromisoformat(checkpoint["ts"]).timestamp()
+    except (KeyError, ValueError):
+        return None
+
+
+def memory_saver_bytes(saver) -> int:
+    """MemorySaver 中已序列化数据的总字节数（近似其内存占用）"""
+    total = 0
+    for namespaces in saver.storage.values():
+        for checkpoints in namespaces.values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                total += len(checkpoint[1]) + len(metadata[1])
+    for value in saver.blobs.values():
+        total += len(value[1])
+    for writes in saver.writes.values():
+        for _, _, value, _ in writes.values():
+            total += len(value[1])
+    return total
+
+
+def prune_memory_saver(saver, policy: RetentionPolicy, now: float | None = None) -> dict:
+    """
+    按策略裁剪 MemorySaver
+
+    MemorySaver 的每个通道版本都是完整值，没有增量链，直接删除即可；
+    只删除不再被任何保留检查点引用的通道版本。
+    MemorySaver 内部没有锁，后台裁剪与图的执行并发时只能尽力而为。
+    """
+    before = memory_saver_bytes(saver)
+    deleted = 0
+    for thread_id, namespaces in list(saver.storage.items()):
+        for ns, checkpoints in namespaces.items():
+            rows = []
+            for checkpoint_id in sorted(list(checkpoints), reverse=True):
+                rows.append((checkpoint_id, _created_at(saver.serde.loads_typed(checkpoints[checkpoint_id][0]))))
+            expired = set(policy.expired(rows, now))
+            if not expired:
+                continue
+            for checkpoint_id in expired:
+                del checkpoints[checkpoint_id]
+                saver.writes.pop((thread_id, ns, checkpoint_id), None)
+            deleted += len(expired)
+
+            referenced = set()
+            for checkpoint_id, (checkpoint, metadata, parent_id) in list(checkpoints.items()):
+                for channel, version in saver.serde.loads_typed(checkpoint)["channel_versions"].items():
+                    referenced.add((channel, version))
+                if parent_id in expired:
+                    checkpoints[checkpoint_id] = (checkpoint, metadata, None)
+            for key in [k for k in list(saver.blobs) if k[0] == thread_id and k[1] == ns]:
+                if (key[2], key[3]) not in referenced:
+                    del saver.blobs[key]
+
+    after = memory_saver_bytes(saver)
+    return {"checkpoints_deleted": deleted, "bytes_before": before, "bytes_after": after}
+
+
+class Compactor:
+    """
+    后台定期按策略压缩检查点
+
+    Args:
+        saver: SqliteDeltaSaver 或 MemorySaver
+        policy: 保留策略
+        interval: 两次压缩之间的秒数
+    """
+
+    def __init__(self, saver, policy: RetentionPolicy, interval: float = 60.0):
+        self.saver = saver
+        self.policy = policy
+        self.interval = interval
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="checkpoint-compactor", daemon=True)
+
+    def run_once(self) -> dict:
+        if hasattr(self.saver, "compact"):
+            self.last_result = self.saver.compact(self.policy)
+        else:
+            self.last_result = prune_memory_saver(self.saver, self.policy)
+        return self.last_result
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[压缩] 失败: {e}")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,337 @@
+"""
+LangGraph 记忆图的并发压测
+short_term_memory_demo.py（chatbot ⇄ ToolNode）和 memory_management_advanced.py（先摘要再聊天）
+的图在很多并发会话下表现如何：吞吐、每轮时延、检查点占了多少时间、每个线程常驻多少内存。
+
+压测方式：
+1. N 个模拟用户（工作线程）并发驱动 M 个 thread_id，每个用户轮流和自己名下的几个会话对话，
+   同一个 thread_id 同一时刻只有一个请求（与真实会话一致）
+2. 模型换成 FakeLatencyModel：固定时延（可加抖动）、回复长度可调；
+   消息中带"天气"时返回 search_weather 工具调用，走一遍 ToolNode
+3. checkpointer 外面包一层 TimedCheckpointer，累计 get_tuple / put / put_writes 的耗时
+4. 每组 (图, N) 在独立的子进程里运行，常驻内存取运行前后 RSS 之差（--tracemalloc 改为统计 Python 堆）
+
+运行 `python load_test.py --users 1 4 16 --latency 0.02` 查看两张图在不同并发下的表现。
+"""
+
+import argparse
+import gc
+import os
+import queue as queue_module
+import random
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+from pydantic import PrivateAttr
+
+from tiered_checkpointer import percentile
+
+CITIES = ["北京", "上海", "杭州", "成都", "深圳", "西安"]
+TOPICS = ["Python 的装饰器", "周末去哪里玩", "怎么做红烧肉", "推荐几本小说", "如何准备面试", "学习英语的方法"]
+
+
+class FakeLatencyModel(BaseChatModel):
+    """
+    固定时延的假聊天模型
+
+    Args:
+        latency: 每次调用的秒数（time.sleep，与等待网络一样释放 GIL）
+        jitter: 时延的随机浮动比例，0.2 表示 ±20%
+        reply_chars: 回复的字数，决定历史增长的速度（以及何时触发摘要）
+        tool_keyword: 最后一条用户消息含有该词时返回 search_weather 工具调用；None 表示从不调用工具
+    """
+
+    latency: float = 0.05
+    jitter: float = 0.0
+    reply_chars: int = 120
+    tool_keyword: str | None = "天气"
+    _calls: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-latency"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._lock:
+            self._calls += 1
+        time.sleep(self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+        last = messages[-1]
+        if self.tool_keyword and isinstance(last, HumanMessage) and self.tool_keyword in last.content:
+            city = next((c for c in CITIES if c in last.content), "北京")
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": "search_weather", "args": {"location": city}, "id": f"call_{uuid.uuid4().hex}"}],
+            )
+        else:
+            sentence = "好的，这是根据我们之前的对话给出的回答。"
+            message = AIMessage(content=(sentence * (self.reply_chars // len(sentence) + 1))[:self.reply_chars])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class TimedCheckpointer(BaseCheckpointSaver):
+    """累计被包装的 checkpointer 在读写上花的时间（所有线程合计）"""
+
+    def __init__(self, inner):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self._lock = threading.Lock()
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _timed(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds += elapsed
+                self.calls += 1
+
+    def reset(self):
+        with self._lock:
+            self.seconds = 0.0
+            self.calls = 0
+
+    def get_tuple(self, config):
+        return self._timed(self.inner.get_tuple, config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        return iter(self._timed(
+            lambda: list(self.inner.list(config, filter=filter, before=before, limit=limit))
+        ))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._timed(self.inner.put, config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        return self._timed(self.inner.put_writes, config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str):
+        return self._timed(self.inner.delete_thread, thread_id)
+
+    async def aget_tuple(self, config):
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current, channel=None):
+        return self.inner.get_next_version(current, channel)
+
+
+# ========== 被测的图与 checkpointer ==========
+
+def _short_term_graph(model, summary_model, checkpointer):
+    import short_term_memory_demo
+    return short_term_memory_demo.build_graph(model, checkpointer)
+
+
+def _summarize_graph(model, summary_model, checkpointer):
+    import memory_management_advanced
+    return memory_management_advanced.build_graph(
+        background=False, checkpointer=checkpointer, model=model, summary_model=summary_model
+    )
+
+
+# 名称 -> (构建函数, 是否发送会触发工具调用的消息)
+GRAPHS = {
+    "short_term": (_short_term_graph, True),
+    "summarize": (_summarize_graph, False),
+}
+
+
+def _make_checkpointer(kind: str, path: str):
+    from sqlite_checkpointer import SqliteDeltaSaver
+    from tiered_checkpointer import TieredCheckpointSaver
+
+    if kind == "memory":
+        return MemorySaver()
+    if kind == "sqlite":
+        return SqliteDeltaSaver(path)
+    return TieredCheckpointSaver(SqliteDeltaSaver(path), max_threads=1000)
+
+
+def _memory_bytes(use_tracemalloc: bool) -> int:
+    gc.collect()
+    if use_tracemalloc:
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # 非 Linux：只能拿到峰值 RSS
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# ========== 压测 ==========
+
+def run(graph_name: str, checkpointer_kind: str, users: int, threads: int, turns: int,
+        latency: float, jitter: float, reply_chars: int, use_tracemalloc: bool = False) -> dict:
+    """
+    N=users 个工作线程共同完成 threads 个会话 × 每个 turns 轮，返回统计结果
+
+    用户 u 负责 thread_id 为 t{u}、t{u+N}、… 的会话，轮流给它们发消息。
+    """
+    build, with_tools = GRAPHS[graph_name]
+    with tempfile.TemporaryDirectory() as tmp:
+        model = FakeLatencyModel(latency=latency, jitter=jitter, reply_chars=reply_chars,
+                                 tool_keyword="天气" if with_tools else None)
+        summary_model = FakeLatencyModel(latency=latency, jitter=jitter, reply_chars=60, tool_keyword=None)
+        checkpointer = TimedCheckpointer(_make_checkpointer(checkpointer_kind, os.path.join(tmp, "load.sqlite")))
+        graph = build(model, summary_model, checkpointer)
+
+        # 预热：第一次调用会触发各种延迟导入和编译
+        graph.invoke({"messages": [HumanMessage(content="你好")]}, {"configurable": {"thread_id": "warmup"}})
+        checkpointer.reset()
+        model_calls = model.calls
+        if use_tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+        memory_before = _memory_bytes(use_tracemalloc)
+
+        def user(u: int) -> list:
+            rng = random.Random(u)
+            own = [f"t{t}" for t in range(u, threads, users)]
+            latencies = []
+            for turn in range(turns):
+                for thread_id in own:
+                    if with_tools and turn % 3 == 2:
+                        text = f"查询一下{rng.choice(CITIES)}的天气"
+                    else:
+                        text = f"第 {turn} 轮：想聊聊{rng.choice(TOPICS)}"
+                    started = time.perf_counter()
+                    graph.invoke({"messages": [HumanMessage(content=text)]}, {"configurable": {"thread_id": thread_id}})
+                    latencies.append(time.perf_counter() - started)
+            return latencies
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            latencies = [latency for part in pool.map(user, range(users)) for latency in part]
+        elapsed = time.perf_counter() - started
+        memory = _memory_bytes(use_tracemalloc) - memory_before
+        if hasattr(checkpointer.inner, "close"):
+            checkpointer.inner.close()
+
+    return {
+        "users": users,
+        "threads": threads,
+        "turns": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "checkpointer_share": checkpointer.seconds / sum(latencies),
+        "memory_per_thread": memory / threads,
+        "model_calls_per_turn": (model.calls - model_calls) / len(latencies),
+        "summaries": summary_model.calls,
+    }
+
+
+def _child(queue, *args):
+    """子进程入口：结果或异常的回溯都放回队列，父进程不会空等"""
+    try:
+        queue.put(("ok", run(*args)))
+    except BaseException:
+        queue.put(("error", traceback.format_exc()))
+
+
+def _collect(process, queue, poll: float = 1.0) -> dict:
+    """
+    等待子进程的结果
+
+    子进程在执行 _child 之前就失败（例如导入模块出错）时不会往队列里放任何东西，
+    因此按 poll 秒轮询，进程已退出且队列为空时报告 exitcode，而不是一直阻塞。
+    """
+    while True:
+        try:
+            status, payload = queue.get(timeout=poll)
+            break
+        except queue_module.Empty:
+            if process.is_alive():
+                continue
+            # 进程可能刚放入结果就退出，再取一次
+            try:
+                status, payload = queue.get(timeout=poll)
+                break
+            except queue_module.Empty:
+                raise SystemExit(f"压测子进程异常退出（exitcode={process.exitcode}），没有返回结果") from None
+    process.join()
+    if status == "error":
+        raise SystemExit(f"压测子进程出错：\n{payload}")
+    return payload
+
+
+def main():
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="LangGraph 记忆图并发压测")
+    parser.add_argument("--graph", nargs="+", choices=list(GRAPHS), default=list(GRAPHS))
+    parser.add_argument("--checkpointer", choices=["memory", "sqlite", "tiered"], default="tiered")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="并发用户数 N，可给多个")
+    parser.add_argument("--threads", type=int, default=32, help="会话（thread_id）总数 M")
+    parser.add_argument("--turns", type=int, default=20, help="每个会话的轮数")
+    parser.add_argument("--latency", type=float, default=0.02, help="每次模型调用的秒数")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--reply-chars", type=int, default=400, help="回复字数；默认值下摘要图约十轮后开始摘要")
+    parser.add_argument("--tracemalloc", action="store_true", help="内存改为统计 Python 堆（更准，但拖慢吞吐）")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    for graph_name in args.graph:
+        print("=" * 60)
+        print(f"{graph_name}：{args.threads} 个会话 × {args.turns} 轮，模型时延 {args.latency * 1000:.0f}ms"
+              f"（±{args.jitter:.0%}），checkpointer={args.checkpointer}")
+        print("=" * 60)
+        print(f"{'用户数':<6}{'轮/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'检查点占比':>10}"
+              f"{'每会话内存':>11}{'模型调用/轮':>11}{'摘要次数':>8}")
+        for users in args.users:
+            # 每组在新进程里跑：RSS 不受上一组影响
+            queue = ctx.Queue()
+            process = ctx.Process(target=_child, args=(
+                queue, graph_name, args.checkpointer, min(users, args.threads), args.threads, args.turns,
+                args.latency, args.jitter, args.reply_chars, args.tracemalloc,
+            ))
+            process.start()
+            r = _collect(process, queue)
+            print(f"{r['users']:<6}{r['throughput']:>8.1f}{r['p50'] * 1000:>7.1f}ms{r['p95'] * 1000:>7.1f}ms"
+                  f"{r['p99'] * 1000:>7.1f}ms{r['checkpointer_share']:>12.1%}"
+                  f"{r['memory_per_thread'] / 1024:>11.1f}KB{r['model_calls_per_turn']:>13.2f}{r['summaries']:>10}")
+
+
+if __name__ == "__main__":
+    main()
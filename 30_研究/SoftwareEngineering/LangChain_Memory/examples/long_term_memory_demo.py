@@ -3,19 +3,63 @@
 展示如何使用 Store 实现跨会话的长期记忆
 """
 
+import os
+import uuid
 from typing import Any
 from langchain.tools import tool, ToolRuntime
 from langchain.agents import create_agent
+from langchain.agents.middleware import after_agent
 from langchain_openai import ChatOpenAI
-from langgraph.store.memory import InMemoryStore
+from langgraph.types import Command
 
-# 初始化长期记忆存储
-# 生产环境应使用 PostgresStore 等持久化实现
-store = InMemoryStore()
+from profile_prefetch import ProfilePrefetchMiddleware, UserContext, profile_changed
+from sharded_store import ShardedStore
+from sqlite_store import QuotaPolicy, SqliteStore
+from vector_index import HashingEmbedder
+from write_behind_store import WriteBehindStore
+
+
+def build_store(path: str = "long_term_memory.sqlite"):
+    """
+    初始化长期记忆存储
+    持久化到 SQLite，进程重启后用户信息仍在；多实例部署应使用 PostgresStore 等共享存储。
+    同一台机器上起多个 worker 进程时设置 STORE_SHARDS=N：按 user_id 分到 N 个文件（见 sharded_store.py），
+    写不同用户的进程不再排队等同一把文件锁。
+    写回缓冲（STORE_WRITE_BEHIND=0 关闭）：同一轮内的多次更新在内存中合并，
+    轮结束时由后台线程写入 SQLite；本轮后续的读取能看到尚未落盘的修改。
+    向量索引只索引记忆的 text 字段；HashingEmbedder 离线可用，
+    生产环境可换成 "openai:text-embedding-3-small"（dims=1536）等嵌入模型。
+    向量矩阵常驻每个 worker 的内存，其他进程写过同一个文件后，下一次语义检索会重新载入该文件的向量；
+    分片后只有写同一分片的 worker 之间会触发重新载入。
+    容量控制：remember 写入的记忆 90 天未被读取即过期（读取时续期），资料和偏好不过期；
+    每个用户的记忆最多 500 条 / 1 MB，超出时淘汰最久未读的记忆（depth=3：配额按 ("users", user_id, "memories")
+    计算，偏好等其他命名空间各自计数，不会被记忆挤掉）。后台每 10 分钟清理一次过期条目。
+    """
+    options = {
+        "index": {"dims": 256, "embed": HashingEmbedder(256), "fields": ["text"]},
+        "ttl": {("users", "*", "memories"): 90 * 86400},
+        "quota": QuotaPolicy(max_items=500, max_bytes=1024 * 1024, depth=3),
+    }
+    shards = int(os.getenv("STORE_SHARDS", "0"))
+    if shards:
+        store = ShardedStore(path.removesuffix(".sqlite") + "_shards", shards=shards, **options)
+    else:
+        store = SqliteStore(path, **options)
+    store.start_sweeper(interval=600)
+    if os.getenv("STORE_WRITE_BEHIND", "1") == "1":
+        store = WriteBehindStore(store, interval=1.0)
+    return store
+
+
+@after_agent
+def flush_store(state, runtime):
+    """每轮结束时触发异步刷写"""
+    if isinstance(runtime.store, WriteBehindStore):
+        runtime.store.end_turn()
 
 # 从长期记忆中读取用户信息
 @tool
-def get_user_info(user_id: str, runtime: ToolRuntime) -> str:
+def get_user_info(user_id: str, runtime: ToolRuntime[UserContext]) -> str:
     """
     从长期记忆中查询用户信息
     
@@ -37,8 +81,8 @@ def save_user_info(
     name: str, 
     age: int, 
     email: str,
-    runtime: ToolRuntime
-) -> str:
+    runtime: ToolRuntime[UserContext]
+) -> Command:
     """
     保存用户信息到长期记忆
     
@@ -55,7 +99,8 @@ def save_user_info(
         "email": email
     }
     store.put(("users",), user_id, user_info)
-    return f"成功保存用户 {user_id} 的信息"
+    # 让系统提示中预取的资料失效，下次调用模型前重新读取
+    return profile_changed(runtime, f"成功保存用户 {user_id} 的信息")
 
 # 更新用户偏好
 @tool
@@ -63,8 +108,8 @@ def update_user_preference(
     user_id: str,
     preference_key: str,
     preference_value: Any,
-    runtime: ToolRuntime
-) -> str:
+    runtime: ToolRuntime[UserContext]
+) -> Command:
     """
     更新用户偏好设置
     
@@ -75,20 +120,13 @@ def update_user_preference(
     """
     store = runtime.store
     
-    # 获取现有偏好
-    existing = store.get(("users", user_id, "preferences"), "settings")
-    preferences = existing.value if existing else {}
-    
-    # 更新偏好
-    preferences[preference_key] = preference_value
-    
-    # 保存回存储
-    store.put(("users", user_id, "preferences"), "settings", preferences)
-    return f"已更新用户 {user_id} 的偏好: {preference_key} = {preference_value}"
+    # 原子地只改这一项：一次往返，并发更新同一用户的其他偏好也不会被覆盖
+    store.patch(("users", user_id, "preferences"), "settings", {preference_key: preference_value})
+    return profile_changed(runtime, f"已更新用户 {user_id} 的偏好: {preference_key} = {preference_value}")
 
 # 获取用户偏好
 @tool
-def get_user_preferences(user_id: str, runtime: ToolRuntime) -> str:
+def get_user_preferences(user_id: str, runtime: ToolRuntime[UserContext]) -> str:
     """
     获取用户的所有偏好设置
     
@@ -103,25 +141,65 @@ def get_user_preferences(user_id: str, runtime: ToolRuntime) -> str:
         return f"用户 {user_id} 的偏好设置:\n{pref_list}"
     return f"用户 {user_id} 暂无偏好设置"
 
-# 创建智能体
-tools = [get_user_info, save_user_info, update_user_preference, get_user_preferences]
-model = ChatOpenAI(model="gpt-4o-mini")
+# 记录一条自由文本记忆（写入时向量化）
+@tool
+def remember(user_id: str, content: str, runtime: ToolRuntime[UserContext]) -> str:
+    """
+    把关于用户的一条事实记入长期记忆
 
-agent = create_agent(
-    model=model,
-    tools=tools,
-    store=store
-)
+    Args:
+        user_id: 用户唯一标识
+        content: 要记住的内容
+    """
+    runtime.store.put(("users", user_id, "memories"), uuid.uuid4().hex, {"text": content})
+    return f"已记住：{content}"
+
+# 按语义检索相关记忆
+@tool
+def recall_memories(user_id: str, query: str, runtime: ToolRuntime[UserContext]) -> str:
+    """
+    按语义检索与问题相关的用户记忆
+
+    Args:
+        user_id: 用户唯一标识
+        query: 要回忆的内容
+    """
+    items = runtime.store.search(("users", user_id, "memories"), query=query, limit=5)
+    if not items:
+        return f"用户 {user_id} 暂无相关记忆"
+    return "\n".join(f"- {item.value['text']}（相关度 {item.score:.2f}）" for item in items)
+
+tools = [get_user_info, save_user_info, update_user_preference, get_user_preferences, remember, recall_memories]
+
+
+# 创建智能体
+def build_agent(model=None, store=None, prefetch: bool = True):
+    """
+    Args:
+        model: 聊天模型，默认 gpt-4o-mini
+        store: 长期记忆存储，默认 build_store()
+        prefetch: 会话开始时预取用户资料与偏好并注入系统提示
+    """
+    middleware = [ProfilePrefetchMiddleware()] if prefetch else []
+    return create_agent(
+        model=model or ChatOpenAI(model="gpt-4o-mini"),
+        tools=tools,
+        store=store if store is not None else build_store(),
+        context_schema=UserContext,
+        middleware=[*middleware, flush_store]
+    )
 
 # 模拟多会话场景
 if __name__ == "__main__":
+    agent = build_agent()
+
     print("=== 会话 1: 创建用户 ===")
     result1 = agent.invoke({
         "messages": [{
             "role": "user", 
             "content": "请保存以下用户信息：用户ID: user001, 姓名: 李四, 年龄: 28, 邮箱: lisi@example.com"
         }]
-    })
+    }, context=UserContext(user_id="user001"))
     print("AI:", result1["messages"][-1].content)
     
     print("\n=== 会话 2: 设置偏好（模拟新会话）===")
@@ -130,7 +208,7 @@ if __name__ == "__main__":
             "role": "user", 
             "content": "为用户 user001 设置语言偏好为中文，主题偏好为深色模式"
         }]
-    })
+    }, context=UserContext(user_id="user001"))
     print("AI:", result2["messages"][-1].content)
     
     print("\n=== 会话 3: 查询信息（模拟新会话）===")
@@ -139,7 +217,7 @@ if __name__ == "__main__":
             "role": "user", 
             "content": "获取用户 user001 的完整信息和偏好设置"
         }]
-    })
+    }, context=UserContext(user_id="user001"))
     print("AI:", result3["messages"][-1].content)
     
     print("\n=== 会话 4: 新用户 ===")
@@ -148,5 +226,20 @@ if __name__ == "__main__":
             "role": "user", 
             "content": "查询用户 user002 的信息"
         }]
-    })
-    print("AI:", result4["messages"][-1].content)
\ No newline at end of file
+    }, context=UserContext(user_id="user002"))
+    print("AI:", result4["messages"][-1].content)
+
+    print("\n=== 会话 5: 记住与回忆 ===")
+    agent.invoke({
+        "messages": [{
+            "role": "user",
+            "content": "请记住：用户 user001 周末喜欢去杭州爬山，对咖啡因过敏"
+        }]
+    }, context=UserContext(user_id="user001"))
+    result5 = agent.invoke({
+        "messages": [{
+            "role": "user",
+            "content": "给用户 user001 推荐一个周末活动，并注意他的饮食禁忌"
+        }]
+    }, context=UserContext(user_id="user001"))
+    print("AI:", result5["messages"][-1].content)
\ No newline at end of file
@@ -1,55 +1,167 @@
 """
 记忆管理高级示例 - 对话摘要和窗口管理
 展示如何处理长对话上下文，避免 token 超限
+
+两种摘要方式：
+- 同步（--inline）：摘要节点在 chatbot 之前执行，超过阈值的那一轮要等两次 LLM 调用
+- 后台（默认）：回复先返回，摘要在后台生成后再合并进线程状态，每轮时延保持平稳
+
+摘要和滑动窗口都通过 RemoveMessage 真正删除旧消息，检查点中的线程状态保持有界。
+运行 `python memory_management_advanced.py --check` 用假模型跑上千轮验证这一点。
+
+依赖 LangChain/examples 中的 llm_cache、token_budget_memory，运行前要把该目录加入 PYTHONPATH（见 README）。
 """
 
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, MessagesState, START
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, RemoveMessage
 from typing import Literal
 
-# 创建 LLM
-model = ChatOpenAI(model="gpt-4o-mini")
+# 复用 LangChain 快速开始示例中的工具模块（需要 PYTHONPATH 包含 LangChain/examples）
+from llm_cache import cached
+from token_budget_memory import MESSAGE_OVERHEAD, get_token_counter
+from sqlite_checkpointer import SqliteDeltaSaver
+
+# 默认的 LLM 在第一次用到时才创建，导入本模块（如 load_test.py 传入假模型）不需要 API Key
+model = None
+summary_model = None
+
+def default_models() -> tuple:
+    """返回 (聊天模型, 摘要模型)"""
+    global model, summary_model
+    if model is None:
+        model = ChatOpenAI(model="gpt-4o-mini")
+        # 摘要用确定性模型：同样的历史总是得到同样的摘要，可走磁盘缓存
+        summary_model = cached(ChatOpenAI(model="gpt-4o-mini", temperature=0))
+    return model, summary_model
 
 # 系统提示词
 SYSTEM_PROMPT = """你是一个有用的助手。保持对对话上下文的理解，
 如果之前的对话内容太长，你会收到一个总结。请基于可用信息回答用户问题。"""
 
-def summarize_messages(state: MessagesState) -> MessagesState:
+# 摘要后保留的最近消息数
+KEEP_RECENT = 4
+
+# 历史（摘要 + 未摘要消息）允许占用的 token 预算
+# gpt-4o-mini 的上下文窗口是 128k，这里只给历史留一小部分，控制每轮成本
+HISTORY_TOKEN_BUDGET = 3000
+
+
+class TokenCountCache:
     """
-    当消息历史过长时，进行摘要
-    保留最近的几条消息，将更早的消息总结为一条
+    按消息 id 缓存 token 数的侧表（有界 LRU）
+    
+    每条消息只在第一次被看到时分词，之后的检查只是查表求和，
+    因此每轮的分词成本是 O(新消息数) 而不是 O(全部历史)。
     """
-    messages = state["messages"]
     
-    # 如果消息少于 6 条，不需要摘要
-    if len(messages) < 6:
-        return state
+    def __init__(self, counter, max_entries: int = 100_000):
+        self.counter = counter
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
     
-    # 保留最近 4 条消息
-    recent_messages = messages[-4:]
+    def _lookup(self, key, text: str) -> int:
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        tokens = self.counter(text) + MESSAGE_OVERHEAD
+        with self._lock:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
     
-    # 将之前的消息总结为一条
-    messages_to_summarize = messages[:-4]
-    summary_prompt = f"""将以下对话总结为 2-3 句话的摘要，保留关键信息：
+    def count(self, message) -> int:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if message.id is None:
+            return self.counter(content) + MESSAGE_OVERHEAD
+        return self._lookup(message.id, content)
     
-{messages_to_summarize}"""
+    def count_summary(self, state: dict) -> int:
+        """摘要只有两三句话，直接用摘要文本作为缓存键，不同线程、不同版本的摘要互不混淆"""
+        summary = state.get("summary")
+        if not summary:
+            return 0
+        return self._lookup(("summary", summary), summary)
+
+token_counts = TokenCountCache(get_token_counter("gpt-4o-mini"))
+
+
+class SummaryState(MessagesState):
+    """
+    消息历史 + 滚动摘要
     
-    summary = model.invoke([
+    并入 summary 的消息会被 RemoveMessage 删除，messages 中留下的都是尚未摘要的消息，
+    之后每次摘要只处理其中新过期的部分。
+    """
+    summary: str
+
+# 消息角色的紧凑名称
+ROLE_NAMES = {"human": "用户", "ai": "AI", "tool": "工具", "system": "系统"}
+
+def format_messages_compact(messages: list) -> str:
+    """紧凑的 角色: 内容 序列化，代替直接插入消息对象的 repr"""
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if content.strip():
+            lines.append(f"{ROLE_NAMES.get(message.type, message.type)}: {content.strip()}")
+    return "\n".join(lines)
+
+def expired_messages(state: SummaryState) -> list:
+    """需要并入摘要的消息：除最近 KEEP_RECENT 条以外的消息（已摘要的消息都已删除）"""
+    messages = state["messages"]
+    return messages[:-KEEP_RECENT] if len(messages) > KEEP_RECENT else []
+
+def fold_summary(previous: str, new_messages: list, llm=None) -> str:
+    """
+    滚动摘要：只把新过期的消息并入已有摘要
+    
+    输入 = 已有摘要（长度有上限）+ 新增消息，每次摘要的成本不随对话长度增长
+    llm 默认为 default_models() 中的摘要模型
+    """
+    summary_prompt = f"""已有摘要：
+{previous or "（无）"}
+
+新增对话：
+{format_messages_compact(new_messages)}
+
+请把新增对话合并进已有摘要，输出 2-3 句话的新摘要，保留关键信息。"""
+    
+    summary = (llm or default_models()[1]).invoke([
         SystemMessage(content="你是一个对话摘要助手。"),
         HumanMessage(content=summary_prompt)
     ])
+    return summary.content
+
+def summarize_messages(state: SummaryState, llm=None) -> dict:
+    """
+    当消息历史过长时，进行摘要（同步路径）
+    把新过期的消息并入滚动摘要，并真正删除已摘要的消息
     
-    # 创建新的消息列表：摘要 + 最近消息
-    new_messages = [
-        SystemMessage(content=f"对话摘要: {summary.content}"),
-        *recent_messages
-    ]
+    MessagesState 的 add_messages reducer 只会追加或按 id 合并，
+    返回「替换后的列表」并不能删掉旧消息，必须返回 RemoveMessage。
+    """
+    to_fold = expired_messages(state)
+    if not to_fold:
+        return {}
     
-    return {"messages": new_messages}
+    return {
+        "summary": fold_summary(state.get("summary", ""), to_fold, llm),
+        "messages": [RemoveMessage(id=m.id) for m in to_fold]
+    }
 
-def sliding_window(state: MessagesState, window_size: int = 10) -> MessagesState:
+def sliding_window(state: MessagesState, window_size: int = 10) -> dict:
     """
     滑动窗口：只保留最近的 N 条消息
     
@@ -59,70 +171,224 @@ def sliding_window(state: MessagesState, window_size: int = 10) -> MessagesState
     messages = state["messages"]
     
     if len(messages) <= window_size:
-        return state
-    
-    # 只保留最近的消息
-    recent_messages = messages[-window_size:]
-    
-    # 标记旧消息为待删除（可选，用于调试）
-    removed_count = len(messages) - window_size
+        return {}
     
+    # 对窗口外的旧消息发出删除，检查点中的状态随之真正变小
     return {
-        "messages": recent_messages,
-        "metadata": {
-            "removed_messages": removed_count,
-            "window_size": window_size
-        }
+        "messages": [RemoveMessage(id=m.id) for m in messages[:-window_size]]
     }
 
-def should_summarize(state: MessagesState) -> Literal["summarize", "continue"]:
+def history_tokens(state: SummaryState) -> int:
+    """当前会发送给模型的历史 token 数：摘要 + 尚未并入摘要的消息"""
+    return token_counts.count_summary(state) + sum(
+        token_counts.count(m) for m in state["messages"]
+    )
+
+def should_summarize(state: SummaryState) -> Literal["summarize", "continue"]:
     """
     决定是否需要摘要
-    """
-    messages = state["messages"]
     
-    # 简单启发式：消息数量或总 token 数
-    if len(messages) > 10:
+    按 token 数而不是消息条数：十句寒暄不会触发，三篇长文档一定会触发
+    """
+    if history_tokens(state) > HISTORY_TOKEN_BUDGET and expired_messages(state):
         return "summarize"
     
     return "continue"
 
-def chatbot(state: MessagesState):
+def chatbot(state: SummaryState, llm=None):
     """
-    聊天节点
+    聊天节点，llm 默认为 default_models() 中的聊天模型
     """
-    messages = [SystemMessage(content=SYSTEM_PROMPT)] + state["messages"]
-    response = model.invoke(messages)
+    messages = [SystemMessage(content=SYSTEM_PROMPT)]
+    if state.get("summary"):
+        messages.append(SystemMessage(content=f"对话摘要: {state['summary']}"))
+    # 已并入摘要的消息不再重复发送
+    response = (llm or default_models()[0]).invoke(messages + state["messages"])
     return {"messages": [response]}
 
-# 构建图
-builder = StateGraph(MessagesState)
-
-# 添加节点
-builder.add_node("summarize", summarize_messages)
-builder.add_node("chatbot", chatbot)
-
-# 添加条件边
-builder.add_conditional_edges(
-    START,
-    should_summarize,
-    {
-        "summarize": "summarize",
-        "continue": "chatbot"
-    }
-)
+def build_graph(background: bool = True, checkpointer=None, window_size: int | None = None,
+                model=None, summary_model=None):
+    """
+    构建对话图
+    
+    Args:
+        background: True 时图中只有 chatbot，摘要交给 BackgroundSummarizer；
+                    False 时在 chatbot 之前同步执行摘要节点
+        checkpointer: 检查点存储，默认 MemorySaver
+        window_size: 设置后改用滑动窗口（不做摘要），只保留最近 N 条消息
+        model: 聊天模型，默认 gpt-4o-mini
+        summary_model: 同步摘要用的模型，默认带磁盘缓存的 gpt-4o-mini
+    """
+    builder = StateGraph(SummaryState)
+    builder.add_node("chatbot", partial(chatbot, llm=model))
+    
+    if window_size:
+        builder.add_node("trim", partial(sliding_window, window_size=window_size))
+        builder.add_edge(START, "trim")
+        builder.add_edge("trim", "chatbot")
+    elif background:
+        builder.add_edge(START, "chatbot")
+    else:
+        builder.add_node("summarize", partial(summarize_messages, llm=summary_model))
+        # 添加条件边
+        builder.add_conditional_edges(
+            START,
+            should_summarize,
+            {
+                "summarize": "summarize",
+                "continue": "chatbot"
+            }
+        )
+        builder.add_edge("summarize", "chatbot")
+    
+    return builder.compile(checkpointer=checkpointer or MemorySaver())
 
-builder.add_edge("summarize", "chatbot")
+class BackgroundSummarizer:
+    """
+    把摘要移出请求关键路径
+    
+    - chat() 只执行 chatbot，回复返回后再提交后台摘要任务
+    - 摘要的 LLM 调用不持有线程锁；只有最后合并状态时才加锁，
+      因此新消息可以在摘要进行中照常处理
+    - 合并时只删除「本次被摘要的消息」（按 id），摘要期间新到的消息原样保留
+    - 同一线程同时只有一个摘要任务；进行中又有新消息时，完成后再检查一次
+    - 线程锁按 thread_id 的哈希分成 lock_stripes 组，摘要任务结束即移除记录，
+      长期运行的服务见过再多会话，占用也不随之增长
+    """
+    
+    def __init__(self, graph, max_workers: int = 4, summary_model=None, lock_stripes: int = 64):
+        self.graph = graph
+        self.summary_model = summary_model
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarizer")
+        # 不同会话落到同一组时只是互相串行，锁之间没有嵌套，不会死锁
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._pending = {}
+        self._dirty = set()
+        self._guard = threading.Lock()
+    
+    def _thread_lock(self, thread_id) -> threading.Lock:
+        return self._locks[hash(thread_id) % len(self._locks)]
+    
+    def chat(self, message: str, config: dict) -> dict:
+        thread_id = config["configurable"]["thread_id"]
+        with self._thread_lock(thread_id):
+            result = self.graph.invoke({"messages": [HumanMessage(content=message)]}, config)
+        self.schedule(config)
+        return result
+    
+    def schedule(self, config: dict):
+        thread_id = config["configurable"]["thread_id"]
+        with self._guard:
+            pending = self._pending.get(thread_id)
+            if pending is not None and not pending.done():
+                self._dirty.add(thread_id)
+                return
+            self._pending[thread_id] = self.executor.submit(self._run, config)
+    
+    def _run(self, config: dict):
+        thread_id = config["configurable"]["thread_id"]
+        try:
+            self._summarize(config)
+        finally:
+            with self._guard:
+                rerun = thread_id in self._dirty
+                self._dirty.discard(thread_id)
+                if rerun:
+                    self._pending[thread_id] = self.executor.submit(self._run, config)
+                else:
+                    # 本任务还没结束，schedule() 不会在此期间替换它，弹出的就是自己
+                    self._pending.pop(thread_id, None)
+    
+    def _summarize(self, config: dict):
+        state = self.graph.get_state(config).values
+        if should_summarize(state) == "continue":
+            return
+        
+        # 慢的 LLM 调用：不持锁，只折叠新过期的消息
+        to_fold = expired_messages(state)
+        if not to_fold:
+            return
+        summary = fold_summary(state.get("summary", ""), to_fold, self.summary_model)
+        
+        # 快速合并：加锁后更新摘要，并按 id 删除已摘要的消息
+        thread_id = config["configurable"]["thread_id"]
+        with self._thread_lock(thread_id):
+            current_ids = {m.id for m in self.graph.get_state(config).values["messages"]}
+            removals = [RemoveMessage(id=m.id) for m in to_fold if m.id in current_ids]
+            self.graph.update_state(config, {
+                "summary": summary,
+                "messages": removals
+            })
+    
+    def wait(self, config: dict):
+        """等待该线程的后台摘要完成（演示和测试用）"""
+        thread_id = config["configurable"]["thread_id"]
+        while True:
+            with self._guard:
+                pending = self._pending.get(thread_id)
+            if pending is None or pending.done():
+                return
+            pending.result()
+    
+    def close(self):
+        """等待已提交的摘要完成并释放线程池"""
+        self.executor.shutdown(wait=True)
 
-# 编译图
-checkpointer = MemorySaver()
-graph = builder.compile(checkpointer=checkpointer)
+def check_bounded_state(turns: int = 2000):
+    """
+    自检：上千轮对话后，检查点中的消息数必须保持有界
+    
+    使用假模型，不需要 API Key。运行：python memory_management_advanced.py --check
+    """
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    
+    chat = FakeListChatModel(responses=["好的，我明白了。"])
+    summarizer_model = FakeListChatModel(responses=["用户在学习 Python。"])
+    
+    # 每条消息至少 MESSAGE_OVERHEAD + 1 个 token，未摘要部分不可能超过这个条数
+    summary_bound = HISTORY_TOKEN_BUDGET // (MESSAGE_OVERHEAD + 1) + KEEP_RECENT + 2
+    window_size = 10
+    
+    cases = [
+        ("同步摘要", build_graph(background=False, model=chat, summary_model=summarizer_model), summary_bound),
+        ("后台摘要", build_graph(background=True, model=chat), summary_bound),
+        ("滑动窗口", build_graph(window_size=window_size, model=chat), window_size + 1),
+    ]
+    for name, case_graph, bound in cases:
+        config = {"configurable": {"thread_id": f"check_{name}"}}
+        # 只有后台摘要需要线程池
+        background = BackgroundSummarizer(case_graph, summary_model=summarizer_model) if name == "后台摘要" else None
+        peak = 0
+        for i in range(turns):
+            if background is not None:
+                background.chat(f"第 {i} 轮消息", config)
+                background.wait(config)
+            else:
+                case_graph.invoke({"messages": [HumanMessage(content=f"第 {i} 轮消息")]}, config)
+            size = len(case_graph.get_state(config).values["messages"])
+            peak = max(peak, size)
+        if background is not None:
+            background.close()
+        
+        assert peak <= bound, f"{name}: 检查点消息数 {peak} 超过上限 {bound}"
+        print(f"✅ {name}: {turns} 轮后消息数 {size}，峰值 {peak}（上限 {bound}）")
 
 # 演示使用
 if __name__ == "__main__":
+    if "--check" in sys.argv:
+        check_bounded_state()
+        sys.exit(0)
+    
+    # 检查点持久化到 SQLite，摘要删除旧消息后每轮只写入增量
+    checkpointer = SqliteDeltaSaver("memory_management.sqlite")
+    # --inline：摘要在请求路径上同步执行；默认：后台摘要
+    inline = "--inline" in sys.argv
+    graph = build_graph(background=not inline, checkpointer=checkpointer)
+    summarizer = None if inline else BackgroundSummarizer(graph)
+    
     config = {"configurable": {"thread_id": "memory_management_demo"}}
     
-    print("=== 模拟长对话 ===\n")
+    print(f"=== 模拟长对话（{'同步' if inline else '后台'}摘要）===\n")
     
     # 模拟一系列对话
     conversations = [
@@ -141,13 +407,25 @@ if __name__ == "__main__":
     
     for i, message in enumerate(conversations, 1):
         print(f"用户 ({i}): {message}")
-        result = graph.invoke(
-            {"messages": [HumanMessage(content=message)]},
-            config
-        )
+        started = time.perf_counter()
+        if inline:
+            result = graph.invoke(
+                {"messages": [HumanMessage(content=message)]},
+                config
+            )
+        else:
+            result = summarizer.chat(message, config)
+        elapsed = time.perf_counter() - started
         ai_response = result["messages"][-1].content
         print(f"AI: {ai_response[:100]}...\n")  # 只显示前100字符
         
-        # 显示当前消息数量
+        # 显示当前消息数量和本轮时延
         current_messages = len(result["messages"])
-        print(f"[系统] 当前消息数: {current_messages}\n")
\ No newline at end of file
+        print(f"[系统] 当前消息数: {current_messages}，本轮耗时: {elapsed:.2f}s\n")
+    
+    if not inline:
+        summarizer.wait(config)
+        state = graph.get_state(config).values
+        print(f"[系统] 最终消息数: {len(state['messages'])}")
+        print(f"[系统] 对话摘要: {state.get('summary', '')}")
+        summarizer.close()
@@ -0,0 +1,231 @@
+"""
+会话开始时预取用户资料
+long_term_memory_demo.py 的每个会话里，模型往往先调用 get_user_info、再调用 get_user_preferences，
+多花两次模型往返只是为了拿到本可以提前加载的信息。
+
+ProfilePrefetchMiddleware：
+1. before_model：按 context 中的 user_id，用一次 batch 读取资料和偏好；
+   状态里已有该用户未过期（max_age 秒内）的资料时跳过，带 checkpointer 时同一 thread 不重复读取
+2. 渲染成几行紧凑文本存进状态，之后每次调用模型时附加到系统提示末尾
+3. 常见情况下模型不再需要调用查询工具
+4. 更新资料或偏好的工具返回 profile_changed(...) 生成的 Command，清掉状态里的资料，
+   下一次调用模型前重新读取；其他进程写入的修改最多 max_age 秒后生效
+
+用法：
+    agent = create_agent(
+        model=..., tools=[...], store=store,
+        context_schema=UserContext,
+        middleware=[ProfilePrefetchMiddleware()],
+    )
+    agent.invoke({"messages": [...]}, context=UserContext(user_id="user001"))
+
+运行 `python profile_prefetch.py` 用脚本化的模型对比有无预取时每个会话的工具调用次数与耗时。
+"""
+
+import time
+from dataclasses import dataclass
+from typing import NotRequired
+
+from langchain.agents.middleware import AgentMiddleware, AgentState
+from langchain_core.messages import SystemMessage, ToolMessage
+from langgraph.store.base import GetOp
+from langgraph.types import Command
+
+# 系统提示中资料段落的标记
+PROFILE_MARKER = "[用户资料]"
+
+
+@dataclass
+class UserContext:
+    """一次会话的运行时上下文"""
+    user_id: str
+
+
+class ProfileState(AgentState):
+    user_profile: NotRequired[str | None]
+    profile_user_id: NotRequired[str]
+    profile_loaded_at: NotRequired[float]
+
+
+def _user_id(runtime) -> str | None:
+    context = runtime.context
+    if isinstance(context, dict):
+        return context.get("user_id")
+    return getattr(context, "user_id", None)
+
+
+def _profile_ops(user_id: str) -> list:
+    return [GetOp(("users",), user_id), GetOp(("users", user_id, "preferences"), "settings")]
+
+
+def render_profile(user_id: str, info, preferences) -> str:
+    """渲染成紧凑文本：只列出有值的字段"""
+    lines = [f"{PROFILE_MARKER} 当前用户 {user_id}（已从长期记忆加载，无需再调用 get_user_info / get_user_preferences）"]
+    if info and info.value:
+        lines.append("资料：" + "，".join(f"{k}={v}" for k, v in info.value.items()))
+    else:
+        lines.append("资料：暂无")
+    if preferences and preferences.value:
+        lines.append("偏好：" + "，".join(f"{k}={v}" for k, v in preferences.value.items()))
+    else:
+        lines.append("偏好：暂无")
+    return "\n".join(lines)
+
+
+def profile_changed(runtime, content: str) -> Command:
+    """
+    写了资料或偏好的工具用它作为返回值：回复 content，并让状态中的资料失效
+
+    未启用 ProfilePrefetchMiddleware 时状态里没有 user_profile，这项更新会被忽略。
+    """
+    return Command(update={
+        "messages": [ToolMessage(content=content, tool_call_id=runtime.tool_call_id)],
+        "user_profile": None,
+    })
+
+
+class ProfilePrefetchMiddleware(AgentMiddleware):
+    """
+    会话开始时一次批量读取用户资料与偏好，并注入系统提示
+
+    Args:
+        max_age: 状态中的资料最多沿用的秒数，用来接收其他进程写入的修改
+    """
+
+    state_schema = ProfileState
+
+    def __init__(self, max_age: float = 300.0):
+        super().__init__()
+        self.max_age = max_age
+
+    def _should_fetch(self, state, runtime) -> str | None:
+        """before_model 每次调用模型前都会运行；资料在、属于该用户且未过期就不再读取"""
+        user_id = _user_id(runtime)
+        if not user_id or runtime.store is None:
+            return None
+        if (
+            state.get("user_profile")
+            and state.get("profile_user_id") == user_id
+            and time.time() - state.get("profile_loaded_at", 0) < self.max_age
+        ):
+            return None
+        return user_id
+
+    @staticmethod
+    def _loaded(user_id: str, info, preferences) -> dict:
+        return {
+            "user_profile": render_profile(user_id, info, preferences),
+            "profile_user_id": user_id,
+            "profile_loaded_at": time.time(),
+        }
+
+    def before_model(self, state, runtime):
+        user_id = self._should_fetch(state, runtime)
+        if user_id is None:
+            return None
+        return self._loaded(user_id, *runtime.store.batch(_profile_ops(user_id)))
+
+    async def abefore_model(self, state, runtime):
+        user_id = self._should_fetch(state, runtime)
+        if user_id is None:
+            return None
+        return self._loaded(user_id, *await runtime.store.abatch(_profile_ops(user_id)))
+
+    @staticmethod
+    def _inject(request):
+        profile = request.state.get("user_profile")
+        if not profile:
+            return request
+        base = request.system_message.content if request.system_message else ""
+        content = f"{base}\n\n{profile}" if base else profile
+        return request.override(system_message=SystemMessage(content=content))
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._inject(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._inject(request))
+
+
+# ========== 测量 ==========
+
+def measure(sessions: int = 20, model_latency: float = 0.05):
+    """
+    用脚本化的模型模拟真实模型的行为：系统提示里没有用户资料时，
+    先调用 get_user_info、再调用 get_user_preferences，然后回答；有资料时直接回答。
+    每次模型调用固定耗时 model_latency 秒。
+    """
+    import os
+    import tempfile
+
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    import long_term_memory_demo as demo
+    from sqlite_store import SqliteStore
+
+    class ScriptedModel(BaseChatModel):
+        calls: int = 0
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted"
+
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            self.calls += 1
+            time.sleep(model_latency)
+            system = messages[0].content if isinstance(messages[0], SystemMessage) else ""
+            called = {m.name for m in messages if isinstance(m, ToolMessage)}
+            user_id = next(m.content for m in messages if m.type == "human").split()[-1]
+            message = AIMessage(content="好的，已为您查询。")
+            if PROFILE_MARKER not in system:
+                for tool_name in ("get_user_info", "get_user_preferences"):
+                    if tool_name not in called:
+                        message = AIMessage(
+                            content="",
+                            tool_calls=[{"name": tool_name, "args": {"user_id": user_id}, "id": f"call_{tool_name}"}],
+                        )
+                        break
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    print("=" * 60)
+    print(f"{sessions} 个会话，每次模型调用 {model_latency * 1000:.0f}ms")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteStore(os.path.join(tmp, "profiles.sqlite"))
+        for i in range(sessions):
+            user_id = f"user{i:03d}"
+            store.put(("users",), user_id, {"name": f"用户{i}", "age": 20 + i, "email": f"{user_id}@example.com"})
+            store.put(("users", user_id, "preferences"), "settings", {"language": "中文", "theme": "dark"})
+
+        results = {}
+        for name, prefetch in (("无预取", False), ("会话开始预取", True)):
+            model = ScriptedModel()
+            agent = demo.build_agent(model, store, prefetch=prefetch)
+            tool_calls = 0
+            started = time.perf_counter()
+            for i in range(sessions):
+                user_id = f"user{i:03d}"
+                result = agent.invoke(
+                    {"messages": [{"role": "user", "content": f"根据我的偏好推荐一下设置 {user_id}"}]},
+                    context=demo.UserContext(user_id=user_id),
+                )
+                tool_calls += sum(1 for m in result["messages"] if isinstance(m, ToolMessage))
+            elapsed = time.perf_counter() - started
+            results[name] = (model.calls / sessions, tool_calls / sessions, elapsed / sessions)
+            print(f"{name:<10} 每会话 模型调用 {model.calls / sessions:.1f} 次  "
+                  f"工具调用 {tool_calls / sessions:.1f} 次  耗时 {elapsed / sessions * 1000:.0f}ms")
+        store.close()
+
+    (calls_a, tools_a, time_a), (calls_b, tools_b, time_b) = results.values()
+    print(f"\n每会话节省 {tools_a - tools_b:.1f} 次工具调用、{calls_a - calls_b:.1f} 次模型往返、"
+          f"{(time_a - time_b) * 1000:.0f}ms（{1 - time_b / time_a:.0%}）")
+
+
+if __name__ == "__main__":
+    measure()
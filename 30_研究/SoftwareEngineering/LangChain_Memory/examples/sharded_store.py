@@ -0,0 +1,413 @@
+"""
+按 user_id 分片的 Store：多进程 worker 共享长期记忆
+long_term_memory_demo.py 的智能体跑在很多 worker 进程里时，所有进程写同一个 SQLite 文件，
+同一时刻只有一个写事务，其余进程在文件锁上排队。
+
+ShardedStore 把数据分到目录下的 N 个 SqliteStore 文件：
+1. 路由：按 user_id 的一致性哈希（每个分片 64 个虚拟节点）选分片；
+   ("users", user_id, ...) 与 ("users",) 下以 user_id 为 key 的资料落在同一分片，
+   同一用户的配额、TTL、语义检索都在一个分片内完成
+2. 每个进程各自打开全部分片，只有写同一分片的进程才会互相等待
+3. 跨分片 batch：按分片拆成子 batch 并发执行；不限定用户的 search / list_namespaces
+   发到所有分片后合并、排序、分页。跨分片的写入不在同一个事务里
+4. 分片数记录在目录下的 shards.json；改变分片数用 rebalance（离线，先停掉 worker），
+   一致性哈希下从 N 个加到 N+1 个只需移动约 1/(N+1) 的条目，取模分片则要移动约 N/(N+1)
+
+用法：
+    store = ShardedStore("memory_shards", shards=8, index={...}, ttl={...}, quota=QuotaPolicy(...))
+    agent = create_agent(model=..., tools=[...], store=store)
+
+运行 `python sharded_store.py bench --workers 1 2 4 8` 用多进程对比单文件与分片的吞吐，
+`python sharded_store.py rebalance memory_shards --shards 12` 调整分片数。
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    ListNamespacesOp,
+    PutOp,
+    SearchOp,
+    validate_op_namespace,
+)
+
+from sqlite_store import SqliteStore, _join, _split
+
+MANIFEST = "shards.json"
+_ITEM_FIELDS = "prefix, key, value, created_at, updated_at, ttl, expires_at, last_read, size"
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _user_of(namespace: tuple, key: str) -> str:
+    """("users", user_id, ...) 取 user_id；只有一段的命名空间（如 ("users",)）以 key 为 user_id"""
+    return namespace[1] if len(namespace) >= 2 else key
+
+
+def shard_path(directory: str, shard: int) -> str:
+    return os.path.join(directory, f"shard-{shard:03d}.sqlite")
+
+
+def _read_manifest(directory: str) -> dict | None:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(directory: str, manifest: dict):
+    # 先写临时文件再替换，其他进程不会读到写了一半的清单
+    path = os.path.join(directory, MANIFEST)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+class HashRing:
+    """一致性哈希环：每个分片在环上占 vnodes 个点，user_id 归顺时针方向的第一个点所属的分片"""
+
+    def __init__(self, shards: int, vnodes: int = 64):
+        self.shards = shards
+        points = sorted((_hash(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def route(self, user_id: str) -> int:
+        i = bisect.bisect(self._points, _hash(user_id))
+        return self._owners[i % len(self._points)]
+
+
+class ShardedStore(BaseStore):
+    """
+    按 user_id 分片的 Store
+
+    Args:
+        directory: 分片文件所在目录
+        shards: 分片数；目录已存在时必须与 shards.json 一致（或不传）
+        vnodes: 每个分片的虚拟节点数，只在新建目录时生效
+        **options: 传给每个 SqliteStore 的参数（index、ttl、quota、clock）
+    """
+
+    supports_ttl = True
+
+    def __init__(self, directory: str, shards: int | None = None, vnodes: int = 64, **options):
+        os.makedirs(directory, exist_ok=True)
+        manifest = _read_manifest(directory)
+        if manifest is None:
+            manifest = {"shards": shards or 4, "vnodes": vnodes}
+            _write_manifest(directory, manifest)
+        elif shards is not None and shards != manifest["shards"]:
+            raise ValueError(
+                f"{directory} 按 {manifest['shards']} 个分片组织，改为 {shards} 个请先运行 "
+                f"`python sharded_store.py rebalance {directory} --shards {shards}`"
+            )
+        self.directory = directory
+        self.ring = HashRing(manifest["shards"], manifest["vnodes"])
+        self.shards = [SqliteStore(shard_path(directory, s), **options) for s in range(manifest["shards"])]
+        self._pool = (
+            ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="store-shard")
+            if len(self.shards) > 1 else None
+        )
+
+    def shard_for(self, user_id: str) -> SqliteStore:
+        return self.shards[self.ring.route(user_id)]
+
+    def _route(self, op) -> int | None:
+        """op 所在的分片；要发到所有分片时返回 None"""
+        if isinstance(op, (GetOp, PutOp)):
+            return self.ring.route(_user_of(op.namespace, op.key))
+        if isinstance(op, SearchOp) and len(op.namespace_prefix) >= 2:
+            return self.ring.route(op.namespace_prefix[1])
+        return None
+
+    def _run(self, calls: dict) -> dict:
+        """{分片: 无参函数}，涉及多个分片时并发执行（SQLite 调用期间释放 GIL）"""
+        if len(calls) == 1 or self._pool is None:
+            return {shard: fn() for shard, fn in calls.items()}
+        futures = {shard: self._pool.submit(fn) for shard, fn in calls.items()}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    # ---------- batch ----------
+
+    def batch(self, ops) -> list:
+        ops = list(ops)
+        for op in ops:
+            validate_op_namespace(op)
+        routed = defaultdict(list)   # 分片 -> [(下标, op)]
+        fanout = set()
+        for i, op in enumerate(ops):
+            shard = self._route(op)
+            if shard is None:
+                fanout.add(i)
+                # 每个分片都要返回前 offset + limit 条，合并后再分页
+                op = op._replace(offset=0, limit=op.offset + op.limit)
+                for s in range(len(self.shards)):
+                    routed[s].append((i, op))
+            else:
+                routed[shard].append((i, op))
+
+        outputs = self._run({
+            shard: (lambda shard=shard, entries=entries: self.shards[shard].batch([op for _, op in entries]))
+            for shard, entries in routed.items()
+        })
+        results = [None] * len(ops)
+        parts = defaultdict(list)
+        for shard, entries in routed.items():
+            for (i, _), result in zip(entries, outputs[shard]):
+                if i in fanout:
+                    parts[i].append(result)
+                else:
+                    results[i] = result
+        for i in fanout:
+            results[i] = self._merge(ops[i], parts[i])
+        return results
+
+    async def abatch(self, ops) -> list:
+        return await asyncio.to_thread(self.batch, list(ops))
+
+    @staticmethod
+    def _merge(op, parts: list) -> list:
+        """合并各分片的结果，排序规则与单个 SqliteStore 相同"""
+        if isinstance(op, SearchOp):
+            items = [item for part in parts for item in part]
+            if op.query and any(item.score is not None for item in items):
+                items.sort(key=lambda item: -item.score)
+            else:
+                items.sort(key=lambda item: (_join(item.namespace), item.key))
+            return items[op.offset:op.offset + op.limit]
+        namespaces = {ns for part in parts for ns in part}
+        namespaces = sorted(namespaces) if op.max_depth is not None else sorted(namespaces, key=_join)
+        return namespaces[op.offset:op.offset + op.limit]
+
+    # ---------- 便捷方法 ----------
+
+    def patch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()) -> dict:
+        """见 SqliteStore.patch"""
+        return self.shard_for(_user_of(namespace, key)).patch(namespace, key, updates, remove)
+
+    async def apatch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()) -> dict:
+        return await asyncio.to_thread(self.patch, namespace, key, updates, remove)
+
+    def patch_many(self, patches: list) -> list:
+        """按分片分组，每个分片一个事务"""
+        routed = defaultdict(list)
+        for i, (namespace, key, updates, remove) in enumerate(patches):
+            routed[self.ring.route(_user_of(namespace, key))].append((i, (namespace, key, updates, remove)))
+        outputs = self._run({
+            shard: (lambda shard=shard, entries=entries: self.shards[shard].patch_many([p for _, p in entries]))
+            for shard, entries in routed.items()
+        })
+        values = [None] * len(patches)
+        for shard, entries in routed.items():
+            for (i, _), value in zip(entries, outputs[shard]):
+                values[i] = value
+        return values
+
+    def sweep(self) -> int:
+        return sum(shard.sweep() for shard in self.shards)
+
+    def start_sweeper(self, interval: float = 60.0):
+        for shard in self.shards:
+            shard.start_sweeper(interval)
+
+    def metrics(self) -> dict:
+        """各分片 metrics() 之和，另附每个分片的条目数（看分布是否均匀）"""
+        per_shard = [shard.metrics() for shard in self.shards]
+        totals = {k: sum(m[k] for m in per_shard) for k in per_shard[0]}
+        return {**totals, "shards": len(self.shards), "items_per_shard": [m["items"] for m in per_shard]}
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+# ========== 调整分片数 ==========
+
+def rebalance(directory: str, shards: int) -> dict:
+    """
+    把目录调整为 shards 个分片，只移动归属发生变化的条目（连同向量），最后更新 shards.json
+
+    离线执行：worker 要先停掉，之后重新打开（各进程内存中的向量索引需要重新载入）。
+    每批移动在源分片上一个事务内完成，先写目标再删源；中途中断后重新运行即可，已移动的条目不会重复。
+    """
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        raise ValueError(f"{directory} 下没有 {MANIFEST}")
+    ring = HashRing(shards, manifest["vnodes"])
+    # 中断过的调整可能在旧分片数之外留下文件，一并扫描
+    existing = max(manifest["shards"], shards)
+    while os.path.exists(shard_path(directory, existing)):
+        existing += 1
+    for s in range(shards):
+        SqliteStore(shard_path(directory, s)).close()   # 建表 / 迁移
+
+    # 先为所有分片算好去向，再移动：移入的条目不会在扫描后面的分片时被重复统计
+    plan = {}
+    total = moved = modulo_moved = 0
+    for source in range(existing):
+        path = shard_path(directory, source)
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path)
+        destinations = plan[source] = defaultdict(list)
+        for prefix, key in conn.execute("SELECT prefix, key FROM items"):
+            total += 1
+            user_id = _user_of(_split(prefix), key)
+            target = ring.route(user_id)
+            if target != source:
+                destinations[target].append((prefix, key))
+            checksum = zlib.crc32(user_id.encode("utf-8"))
+            modulo_moved += checksum % manifest["shards"] != checksum % shards
+        conn.close()
+
+    for source, destinations in plan.items():
+        path = shard_path(directory, source)
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("CREATE TEMP TABLE moving (prefix TEXT, key TEXT, PRIMARY KEY (prefix, key))")
+        for target, pairs in destinations.items():
+            conn.execute("ATTACH DATABASE ? AS dest", (shard_path(directory, target),))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM moving")
+                conn.executemany("INSERT INTO moving (prefix, key) VALUES (?, ?)", pairs)
+                conn.execute(
+                    f"INSERT OR REPLACE INTO dest.items ({_ITEM_FIELDS}) "
+                    f"SELECT {_ITEM_FIELDS} FROM moving JOIN main.items USING (prefix, key)"
+                )
+                conn.executemany("DELETE FROM dest.vectors WHERE prefix = ? AND key = ?", pairs)
+                conn.execute(
+                    "INSERT INTO dest.vectors (prefix, key, seq, embedding) "
+                    "SELECT prefix, key, seq, embedding FROM moving JOIN main.vectors USING (prefix, key)"
+                )
+                conn.execute("INSERT OR IGNORE INTO dest.namespaces (prefix) SELECT DISTINCT prefix FROM moving")
+                conn.executemany("DELETE FROM main.items WHERE prefix = ? AND key = ?", pairs)
+                conn.executemany("DELETE FROM main.vectors WHERE prefix = ? AND key = ?", pairs)
+                conn.execute(
+                    "DELETE FROM main.namespaces WHERE prefix IN (SELECT prefix FROM moving) "
+                    "AND NOT EXISTS (SELECT 1 FROM main.items WHERE items.prefix = namespaces.prefix)"
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("DETACH DATABASE dest")
+            moved += len(pairs)
+        conn.close()
+        if source >= shards:
+            # 多出来的分片已经搬空
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    _write_manifest(directory, {**manifest, "shards": shards})
+    return {"items": total, "moved": moved, "modulo_moved": modulo_moved}
+
+
+# ========== 多进程基准 ==========
+
+def _worker(directory: str, shards: int, ops: int, users: int, seed: int, ready, start, results):
+    import random
+
+    store = ShardedStore(directory, shards=shards)
+    rng = random.Random(seed)
+    ready.put(seed)
+    start.wait()
+    started = time.time()
+    for n in range(ops):
+        # 一轮对话对 Store 的典型访问：读资料、改一项偏好、记一条记忆
+        user_id = f"user{rng.randrange(users):06d}"
+        store.get(("users",), user_id)
+        store.patch(("users", user_id, "preferences"), "settings", {"turn": n})
+        store.put(("users", user_id, "memories"), f"m{seed}_{n}", {"text": f"第 {n} 轮提到的事实"})
+    results.put((started, time.time(), ops * 3))
+    store.close()
+
+
+def bench(directory: str, workers: list, shards: int, ops: int, users: int):
+    """
+    每个 worker 是一个独立进程，各自打开 Store，执行 ops 轮（每轮 3 次操作）；
+    对比所有进程共用一个文件（1 个分片）与 shards 个分片时的总吞吐
+    """
+    import multiprocessing
+    import shutil
+
+    ctx = multiprocessing.get_context("spawn")
+    print("=" * 60)
+    print(f"多进程吞吐：每个 worker {ops} 轮 × 3 次操作，{users:,} 个用户；CPU 核数 {os.cpu_count()}")
+    print("=" * 60)
+    if os.cpu_count() < max(workers):
+        print(f"注意：CPU 核数少于 worker 数，超过 {os.cpu_count()} 个 worker 后吞吐受 CPU 限制")
+    print(f"{'worker 数':<10}{'单文件 ops/s':>14}{'扩展效率':>10}{f'{shards} 分片 ops/s':>16}{'扩展效率':>10}")
+
+    baseline = None
+    for count in workers:
+        rates = []
+        for layout in (1, shards):
+            path = os.path.join(directory, f"w{count}_s{layout}")
+            shutil.rmtree(path, ignore_errors=True)
+            ShardedStore(path, shards=layout).close()
+            ready, start, results = ctx.Queue(), ctx.Event(), ctx.Queue()
+            processes = [
+                ctx.Process(target=_worker, args=(path, layout, ops, users, seed, ready, start, results))
+                for seed in range(count)
+            ]
+            for p in processes:
+                p.start()
+            # 等所有进程导入完毕、打开 Store 后再同时开始
+            for _ in processes:
+                ready.get()
+            start.set()
+            spans = [results.get() for _ in processes]
+            for p in processes:
+                p.join()
+            elapsed = max(end for _, end, _ in spans) - min(begin for begin, _, _ in spans)
+            rates.append(sum(n for _, _, n in spans) / elapsed)
+            shutil.rmtree(path, ignore_errors=True)
+        if baseline is None:
+            baseline = [rate / count for rate in rates]
+        # 扩展效率：相对于 1 个 worker 吞吐 × worker 数（线性扩展）的比例
+        print(f"{count:<10}{rates[0]:>14,.0f}{rates[0] / (baseline[0] * count):>10.0%}"
+              f"{rates[1]:>16,.0f}{rates[1] / (baseline[1] * count):>10.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按 user_id 分片的 Store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="多进程吞吐基准")
+    bench_parser.add_argument("--dir", default="shard_bench")
+    bench_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    bench_parser.add_argument("--shards", type=int, default=8)
+    bench_parser.add_argument("--ops", type=int, default=2000)
+    bench_parser.add_argument("--users", type=int, default=100_000)
+    rebalance_parser = sub.add_parser("rebalance", help="调整分片数（先停掉所有 worker）")
+    rebalance_parser.add_argument("directory")
+    rebalance_parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    if args.command == "bench":
+        bench(args.dir, args.workers, args.shards, args.ops, args.users)
+    else:
+        report = rebalance(args.directory, args.shards)
+        share = report["moved"] / report["items"] if report["items"] else 0.0
+        modulo = report["modulo_moved"] / report["items"] if report["items"] else 0.0
+        print(f"共 {report['items']:,} 条，移动 {report['moved']:,} 条（{share:.1%}）；取模分片需要移动 {modulo:.1%}")
+
+
+if __name__ == "__main__":
+    main()
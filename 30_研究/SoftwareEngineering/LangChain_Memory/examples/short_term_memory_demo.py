@@ -1,9 +1,14 @@
 """
 短期记忆示例 - 对话历史管理
 展示如何使用 checkpointer 实现多轮对话记忆
+检查点保存在 SQLite 文件中，重新运行脚本时各线程的对话会接着之前的继续
 """
 
-from langgraph.checkpoint.memory import MemorySaver
+import os
+
+from checkpoint_retention import Compactor, RetentionPolicy
+from sqlite_checkpointer import SqliteDeltaSaver
+from tiered_checkpointer import TieredCheckpointSaver
 from langgraph.graph import StateGraph, MessagesState, START
 from langgraph.prebuilt import ToolNode
 from langchain_openai import ChatOpenAI
@@ -19,14 +24,6 @@ def search_weather(location: str) -> str:
 tools = [search_weather]
 tool_node = ToolNode(tools)
 
-# 创建 LLM
-model = ChatOpenAI(model="gpt-4o-mini").bind_tools(tools)
-
-# 定义聊天节点
-def chatbot(state: MessagesState):
-    """聊天机器人节点"""
-    return {"messages": [model.invoke(state["messages"])]}
-
 # 决定下一步
 def should_continue(state: MessagesState):
     """决定是继续工具调用还是结束"""
@@ -36,21 +33,46 @@ def should_continue(state: MessagesState):
         return "tools"
     return "__end__"
 
+def build_checkpointer(path: str = "short_term_memory.sqlite"):
+    """
+    添加 checkpointer 实现短期记忆
+    SqliteDeltaSaver：持久化到文件，每轮只写入新增的消息（MemorySaver 重启即丢失）
+    TieredCheckpointSaver：最近活跃的线程常驻内存，切回空闲线程时才从磁盘懒加载
+    """
+    return TieredCheckpointSaver(SqliteDeltaSaver(path), max_threads=1000)
+
 # 构建图
-builder = StateGraph(MessagesState)
-builder.add_node("chatbot", chatbot)
-builder.add_node("tools", tool_node)
+def build_graph(model=None, checkpointer=None):
+    """
+    Args:
+        model: 聊天模型，默认 gpt-4o-mini（会绑定工具）
+        checkpointer: 检查点存储，默认 build_checkpointer()
+    """
+    llm = (model or ChatOpenAI(model="gpt-4o-mini")).bind_tools(tools)
+
+    # 定义聊天节点
+    def chatbot(state: MessagesState):
+        """聊天机器人节点"""
+        return {"messages": [llm.invoke(state["messages"])]}
 
-builder.add_edge(START, "chatbot")
-builder.add_conditional_edges("chatbot", should_continue, {"tools": "tools", "__end__": "__end__"})
-builder.add_edge("tools", "chatbot")
+    builder = StateGraph(MessagesState)
+    builder.add_node("chatbot", chatbot)
+    builder.add_node("tools", tool_node)
 
-# 添加 checkpointer 实现短期记忆
-checkpointer = MemorySaver()
-graph = builder.compile(checkpointer=checkpointer)
+    builder.add_edge(START, "chatbot")
+    builder.add_conditional_edges("chatbot", should_continue, {"tools": "tools", "__end__": "__end__"})
+    builder.add_edge("tools", "chatbot")
+    return builder.compile(checkpointer=checkpointer if checkpointer is not None else build_checkpointer())
 
 # 使用示例
 if __name__ == "__main__":
+    checkpointer = build_checkpointer()
+    graph = build_graph(checkpointer=checkpointer)
+
+    # 保留策略：每个线程只保留最近 N 个检查点（时间旅行只能回到这些步骤），后台定期压缩
+    retention = RetentionPolicy(keep_last=int(os.getenv("CHECKPOINT_KEEP_LAST", "20")))
+    compactor = Compactor(checkpointer, retention, interval=300).start()
+
     # 配置 thread_id - 这是短期记忆的关键
     config = {"configurable": {"thread_id": "conversation_1"}}
     
@@ -93,4 +115,17 @@ if __name__ == "__main__":
         {"messages": [{"role": "user", "content": "我们之前聊了什么？"}]},
         config
     )
-    print("AI:", result5["messages"][-1].content)
\ No newline at end of file
+    print("AI:", result5["messages"][-1].content)
+    
+    # 热线程缓存的命中率和冷线程恢复延迟
+    metrics = checkpointer.metrics()
+    print("\n=== 检查点缓存 ===")
+    print(f"命中率: {metrics['hit_rate']:.0%}，常驻线程: {metrics['resident_threads']}，"
+          f"冷恢复 p50: {metrics['resume_p50_ms']:.2f}ms")
+    
+    # 立即按保留策略压缩一次，查看节省的空间
+    result = compactor.run_once()
+    print(f"\n=== 检查点压缩（{retention}）===")
+    print(f"删除检查点: {result['checkpoints_deleted']}，"
+          f"数据 {result['bytes_before']} B → {result['bytes_after']} B，"
+          f"文件 {result['file_before']} B → {result['file_after']} B")
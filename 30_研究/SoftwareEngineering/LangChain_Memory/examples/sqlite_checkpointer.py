@@ -0,0 +1,770 @@
+"""
+SQLite 增量检查点（checkpointer）
+MemorySaver 进程重启就丢失全部线程，而且每一步都保存完整状态快照。
+
+SqliteDeltaSaver 可以直接替换 builder.compile(checkpointer=...)：
+1. 检查点持久化到 SQLite 文件（WAL 模式），重启后按 thread_id 继续对话
+2. 消息通道按「相对父检查点的增量」保存：只写新增的消息和被删除消息的 id，
+   每一轮的写入量是 O(新消息数)，而不是 O(历史长度)
+3. 增量链每隔 snapshot_every 步写一次完整快照，读取时最多回放这么多条增量
+4. 批量提交：每 commit_every 次写入或 commit_interval 秒提交一次事务，
+   后台线程在空闲时也按 commit_interval 提交，flush() / close() / 进程退出时提交剩余部分。
+   持久性窗口：进程崩溃最多丢失最近 commit_interval 秒（且不超过 commit_every 次）的写入；
+   未提交的写事务最多持有 SQLite 写锁 commit_interval 秒
+5. 较大的序列化数据用 zlib（安装了 zstandard 时可选 zstd）压缩后再写入
+6. compact(policy) 按 checkpoint_retention.RetentionPolicy 删除过期检查点，
+   删除前把仍被引用的增量物化为完整快照
+
+用法：
+    checkpointer = SqliteDeltaSaver("checkpoints.sqlite")
+    graph = builder.compile(checkpointer=checkpointer)
+
+运行 `python sqlite_checkpointer.py` 对比完整快照和增量检查点每轮写入的字节数，
+`python sqlite_checkpointer.py compact` 演示保留策略和压缩带来的节省。
+"""
+
+import atexit
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    created_at REAL,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    kind TEXT NOT NULL,            -- full / delta / empty
+    type TEXT,
+    data BLOB,
+    base_version TEXT,             -- delta 所基于的版本
+    depth INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+# 通道在该版本没有值（与「值为 None」区分：触发边的通道值本身就是 None）
+_MISSING = object()
+
+
+def _compress(type_: str, data: bytes, method: str | None, min_bytes: int) -> tuple:
+    """压缩后的数据在类型后加上 +zlib / +zstd 标记，读取时据此解压"""
+    if method is None or len(data) < min_bytes:
+        return type_, data
+    if method == "zstd":
+        return f"{type_}+zstd", zstandard.ZstdCompressor(level=3).compress(data)
+    return f"{type_}+zlib", zlib.compress(data, 6)
+
+
+def _decompress(type_: str, data: bytes) -> tuple:
+    if type_ is None:
+        return type_, data
+    if type_.endswith("+zlib"):
+        return type_[:-5], zlib.decompress(data)
+    if type_.endswith("+zstd"):
+        if zstandard is None:
+            raise RuntimeError("该检查点用 zstd 压缩，需要安装 zstandard：pip install zstandard")
+        return type_[:-5], zstandard.ZstdDecompressor().decompress(data)
+    return type_, data
+
+
+def _diff_messages(base: list, new: list):
+    """
+    计算 new 相对 base 的增量：(删除的 id 列表, 追加的消息列表)
+
+    add_messages 只会按 id 删除、在末尾追加、或原位替换同 id 的消息。
+    前两种可以表示为增量；原位替换或消息没有 id 时返回 None，由调用方写完整快照。
+    """
+    if any(getattr(m, "id", None) is None for m in base) or any(getattr(m, "id", None) is None for m in new):
+        return None
+    new_ids = {m.id for m in new}
+    removed = [m.id for m in base if m.id not in new_ids]
+    kept = [m for m in base if m.id in new_ids]
+    if len(kept) > len(new):
+        return None
+    for old, current in zip(kept, new):
+        if old is not current and old != current:
+            return None
+    return removed, new[len(kept):]
+
+
+def _apply_delta(base: list, delta: dict) -> list:
+    removed = set(delta["removed"])
+    return [m for m in base if m.id not in removed] + list(delta["added"])
+
+
+class SqliteDeltaSaver(BaseCheckpointSaver):
+    """
+    基于 SQLite 的增量检查点
+
+    Args:
+        path: 数据库文件路径
+        delta_channels: 按增量保存的通道（值为带 id 的消息列表）
+        snapshot_every: 增量链长度达到该值时写一次完整快照
+        commit_every: 累计多少次写入后提交一次事务
+        commit_interval: 距上次提交超过该秒数时提交（空闲时由后台线程提交；None 关闭后台线程）
+        cache_threads: 内存中保留最近状态（用于计算增量）的线程数
+        compression: "zlib"、"zstd"（需要 zstandard）或 None
+        compress_min_bytes: 小于该字节数的数据不压缩
+    """
+
+    def __init__(
+        self,
+        path: str = "checkpoints.sqlite",
+        delta_channels: tuple = ("messages",),
+        snapshot_every: int = 50,
+        commit_every: int = 32,
+        commit_interval: float = 1.0,
+        cache_threads: int = 1024,
+        compression: str | None = "zlib",
+        compress_min_bytes: int = 256,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.delta_channels = set(delta_channels)
+        self.snapshot_every = snapshot_every
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.cache_threads = cache_threads
+        if compression == "zstd" and zstandard is None:
+            compression = "zlib"
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # 只对新建的数据库生效：压缩后可以用 incremental_vacuum 归还空闲页
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(checkpoints)")}
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE checkpoints ADD COLUMN created_at REAL")
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        # (thread_id, ns, channel) -> (version, value, depth)，最近写入或读取的通道值
+        self._values = OrderedDict()
+        self.stats = {"puts": 0, "full": 0, "delta": 0, "bytes_raw": 0, "bytes_written": 0, "commits": 0}
+        self._stop = threading.Event()
+        self._committer = None
+        if commit_interval:
+            self._committer = threading.Thread(target=self._commit_loop, name="checkpoint-commit", daemon=True)
+            self._committer.start()
+        atexit.register(self.close)
+
+    # ---------- 事务 ----------
+
+    def _maybe_commit_locked(self):
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if self._pending:
+            self._conn.commit()
+            self.stats["commits"] += 1
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def _commit_loop(self):
+        """最后一轮写入之后线程就空闲了，不能等下一次写入才检查 commit_interval"""
+        while not self._stop.wait(self.commit_interval / 2):
+            with self._lock:
+                if (self._conn is not None and self._pending
+                        and time.monotonic() - self._last_commit >= self.commit_interval):
+                    self._commit_locked()
+
+    def flush(self):
+        """提交所有尚未提交的写入"""
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        self._stop.set()
+        if self._committer is not None and self._committer is not threading.current_thread():
+            self._committer.join()
+        with self._lock:
+            if self._conn is None:
+                return
+            self._commit_locked()
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ---------- 序列化 ----------
+
+    def _dumps(self, value) -> tuple:
+        type_, data = self.serde.dumps_typed(value)
+        self.stats["bytes_raw"] += len(data)
+        type_, data = _compress(type_, data, self.compression, self.compress_min_bytes)
+        self.stats["bytes_written"] += len(data)
+        return type_, data
+
+    def _loads(self, type_: str, data: bytes):
+        return self.serde.loads_typed(_decompress(type_, data))
+
+    # ---------- 通道值 ----------
+
+    def _remember(self, key: tuple, version: str, value, depth: int):
+        self._values[key] = (version, value, depth)
+        self._values.move_to_end(key)
+        # 按线程数限制：每个线程通常只有一个增量通道
+        while len(self._values) > self.cache_threads * max(1, len(self.delta_channels)):
+            self._values.popitem(last=False)
+
+    def _load_channel(self, thread_id: str, ns: str, channel: str, version: str):
+        """
+        读取某个通道在指定版本的值；不存在或为空时返回 (_MISSING, 0)
+
+        增量版本沿 base_version 回溯到最近的完整快照（或内存中已有的版本），再依次回放。
+        """
+        key = (thread_id, ns, channel)
+        cached = self._values.get(key)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        deltas = []
+        current = version
+        base = None
+        while True:
+            if cached and cached[0] == current:
+                base = list(cached[1])
+                break
+            row = self._conn.execute(
+                "SELECT kind, type, data, base_version, depth FROM blobs "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, ns, channel, current),
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                if not deltas:
+                    return _MISSING, 0
+                # 增量只会基于列表写入；链条断了说明基准被误删，回放到空列表会静默截断历史
+                raise RuntimeError(
+                    f"检查点数据损坏：线程 {thread_id} 通道 {channel} 版本 {version} 的增量链"
+                    f"在版本 {current} 处{'缺失' if row is None else '指向空值'}，无法还原"
+                )
+            kind, type_, data, base_version, depth = row
+            if kind == "full":
+                base = self._loads(type_, data)
+                break
+            deltas.append(self._loads(type_, data))
+            current = base_version
+
+        value = base
+        for delta in reversed(deltas):
+            value = _apply_delta(value, delta)
+        depth = len(deltas) + (cached[2] if cached and cached[0] == current else 0)
+        if channel in self.delta_channels:
+            self._remember(key, version, value, depth)
+        return value, depth
+
+    def prime(self, config, checkpoint):
+        """
+        把调用方已持有的检查点通道值放入增量缓存
+
+        上层缓存（TieredCheckpointSaver）命中时不会经过 get_tuple，
+        预先放入后，下一次 put 不必回读增量链就能计算增量。
+        """
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            for channel in self.delta_channels:
+                version = checkpoint["channel_versions"].get(channel)
+                value = checkpoint["channel_values"].get(channel)
+                if version is None or not isinstance(value, list):
+                    continue
+                key = (thread_id, ns, channel)
+                cached = self._values.get(key)
+                if cached and cached[0] == str(version):
+                    self._values.move_to_end(key)
+                    continue
+                row = self._conn.execute(
+                    "SELECT depth FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (thread_id, ns, channel, str(version)),
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, str(version), list(value), row[0])
+
+    def _write_blob(self, thread_id: str, ns: str, channel: str, version: str, value, base_version):
+        key = (thread_id, ns, channel)
+        if channel in self.delta_channels and isinstance(value, list):
+            delta = None
+            depth = 0
+            if base_version is not None:
+                base, base_depth = self._load_channel(thread_id, ns, channel, base_version)
+                if isinstance(base, list) and base_depth + 1 < self.snapshot_every:
+                    diff = _diff_messages(base, value)
+                    if diff is not None:
+                        delta = {"removed": diff[0], "added": diff[1]}
+                        depth = base_depth + 1
+            if delta is not None:
+                type_, data = self._dumps(delta)
+                row = (thread_id, ns, channel, version, "delta", type_, data, base_version, depth)
+                self.stats["delta"] += 1
+            else:
+                type_, data = self._dumps(value)
+                row = (thread_id, ns, channel, version, "full", type_, data, None, 0)
+                self.stats["full"] += 1
+            self._remember(key, version, list(value), depth)
+        else:
+            type_, data = self._dumps(value)
+            row = (thread_id, ns, channel, version, "full", type_, data, None, 0)
+
+        self._conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _channel_values(self, thread_id: str, ns: str, versions: dict) -> dict:
+        values = {}
+        for channel, version in versions.items():
+            value, _ = self._load_channel(thread_id, ns, channel, str(version))
+            if value is not _MISSING:
+                values[channel] = value
+        return values
+
+    def _parent_versions(self, thread_id: str, ns: str, parent_id) -> dict:
+        if not parent_id:
+            return {}
+        row = self._conn.execute(
+            "SELECT type, checkpoint FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, ns, parent_id),
+        ).fetchone()
+        if row is None:
+            return {}
+        return self._loads(*row)["channel_versions"]
+
+    # ---------- BaseCheckpointSaver 接口 ----------
+
+    def _tuple(self, thread_id: str, ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        checkpoint = self._loads(type_, checkpoint)
+        writes = self._conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, ns, checkpoint_id),
+        ).fetchall()
+        writes.sort(key=lambda w: writes_sort_key(w[5], w[0], w[1]))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._channel_values(thread_id, ns, checkpoint["channel_versions"]),
+            },
+            metadata=self._loads(metadata_type, metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[
+                (task_id, channel, self._loads(t, v))
+                for task_id, _, channel, t, v, _ in writes
+            ],
+        )
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, ns),
+                ).fetchone()
+            return self._tuple(thread_id, ns, row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for thread_id, ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            with self._lock:
+                item = self._tuple(thread_id, ns, row)
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+
+        with self._lock:
+            parent_versions = self._parent_versions(thread_id, ns, parent_id) if new_versions else {}
+            for channel, version in new_versions.items():
+                version = str(version)
+                if channel not in values:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, kind) "
+                        "VALUES (?, ?, ?, ?, 'empty')",
+                        (thread_id, ns, channel, version),
+                    )
+                    continue
+                base_version = parent_versions.get(channel)
+                self._write_blob(
+                    thread_id, ns, channel, version, values[channel],
+                    str(base_version) if base_version is not None else None,
+                )
+
+            type_, data = self._dumps(c)
+            metadata_type, metadata_data = self._dumps(get_checkpoint_metadata(config, metadata))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, "
+                "parent_checkpoint_id, created_at, type, checkpoint, metadata_type, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, ns, checkpoint["id"], parent_id, time.time(),
+                 type_, data, metadata_type, metadata_data),
+            )
+            self.stats["puts"] += 1
+            self._maybe_commit_locked()
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # 特殊通道（错误、中断等）的写入可以覆盖；普通写入重复时保留第一次
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self._dumps(value)
+            rows.append((thread_id, ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                         channel, type_, data, task_path))
+        with self._lock:
+            self._conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._maybe_commit_locked()
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            for table in ("checkpoints", "blobs", "writes"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            for key in [k for k in self._values if k[0] == thread_id]:
+                del self._values[key]
+            self._commit_locked()
+
+    # ---------- 保留策略与压缩 ----------
+
+    def storage_report(self) -> dict:
+        """各表行数、已存数据字节数、数据库文件（含 WAL）字节数"""
+        with self._lock:
+            report = {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("checkpoints", "blobs", "writes")
+            }
+            report["bytes"] = (
+                self._conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+                ).fetchone()[0]
+                + self._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()[0]
+                + self._conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+            )
+        report["file_bytes"] = sum(
+            os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)
+        )
+        return report
+
+    def compact(self, policy, now: float | None = None) -> dict:
+        """
+        按保留策略删除过期检查点（checkpoint_retention.Compactor 会在后台定期调用）
+
+        每个线程单独加锁处理，前台写入只会被短暂阻塞。
+        保留的增量如果基于将被删除的版本，先物化为完整快照，保证删除后仍能读出。
+        """
+        before = self.storage_report()
+        result = {"checkpoints_deleted": 0, "blobs_deleted": 0, "writes_deleted": 0, "materialized": 0}
+        with self._lock:
+            threads = self._conn.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints").fetchall()
+        for thread_id, ns in threads:
+            with self._lock:
+                self._compact_thread(thread_id, ns, policy, now, result)
+                self._conn.commit()
+        with self._lock:
+            self._conn.commit()
+            # execute() 只单步执行一次（只释放一页），executescript 会执行到底
+            self._conn.executescript("PRAGMA incremental_vacuum;")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        after = self.storage_report()
+        result.update(
+            bytes_before=before["bytes"], bytes_after=after["bytes"],
+            file_before=before["file_bytes"], file_after=after["file_bytes"],
+        )
+        return result
+
+    def _compact_thread(self, thread_id: str, ns: str, policy, now, result: dict):
+        rows = self._conn.execute(
+            "SELECT checkpoint_id, created_at, type, checkpoint FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+            (thread_id, ns),
+        ).fetchall()
+        expired = set(policy.expired([(r[0], r[1]) for r in rows], now))
+        if not expired:
+            return
+
+        referenced = {}
+        for checkpoint_id, _, type_, checkpoint in rows:
+            if checkpoint_id in expired:
+                continue
+            for channel, version in self._loads(type_, checkpoint)["channel_versions"].items():
+                referenced.setdefault(channel, set()).add(str(version))
+
+        # 先物化：增量链要经过被删除版本的保留版本，改写为完整快照
+        for channel, versions in referenced.items():
+            for version in versions:
+                row = self._conn.execute(
+                    "SELECT kind, base_version FROM blobs "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (thread_id, ns, channel, version),
+                ).fetchone()
+                if row is None or row[0] != "delta" or row[1] in versions:
+                    continue
+                value, _ = self._load_channel(thread_id, ns, channel, version)
+                type_, data = self._dumps(value)
+                self._conn.execute(
+                    "UPDATE blobs SET kind = 'full', type = ?, data = ?, base_version = NULL, depth = 0 "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (type_, data, thread_id, ns, channel, version),
+                )
+                self._values.pop((thread_id, ns, channel), None)
+                result["materialized"] += 1
+
+        ids = [(thread_id, ns, checkpoint_id) for checkpoint_id in expired]
+        where = "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+        result["writes_deleted"] += self._conn.executemany(f"DELETE FROM writes {where}", ids).rowcount
+        result["checkpoints_deleted"] += self._conn.executemany(f"DELETE FROM checkpoints {where}", ids).rowcount
+        # 保留的最旧检查点不再有父检查点，历史在这里截断
+        self._conn.executemany(
+            "UPDATE checkpoints SET parent_checkpoint_id = NULL "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND parent_checkpoint_id = ?",
+            ids,
+        )
+
+        stale = [
+            (thread_id, ns, channel, version)
+            for channel, version in self._conn.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?", (thread_id, ns)
+            ).fetchall()
+            if version not in referenced.get(channel, ())
+        ]
+        result["blobs_deleted"] += self._conn.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", stale
+        ).rowcount
+
+    # 异步接口直接复用同步实现（SQLite 调用很短，与 MemorySaver 的做法一致）
+
+    async def aget_tuple(self, config):
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current, channel=None) -> str:
+        # 与 MemorySaver 相同的版本格式：可按字符串排序
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+# ========== 对比演示 ==========
+
+def _demo_builder():
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langgraph.graph import START, MessagesState, StateGraph
+
+    model = FakeListChatModel(responses=["好的，这是一条长度适中的模型回复，用来模拟真实对话。"])
+
+    def chatbot(state: MessagesState):
+        return {"messages": [model.invoke(state["messages"])]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("chatbot", chatbot)
+    builder.add_edge(START, "chatbot")
+    return builder
+
+
+def _bench(turns: int = 300):
+    """用假模型跑多轮对话，对比每轮写入的字节数"""
+    import tempfile
+
+    from langchain_core.messages import HumanMessage
+
+    builder = _demo_builder()
+
+    print("=" * 60)
+    print(f"{turns} 轮对话，每轮写入字节数（前 10 轮 / 最后 10 轮的平均值）")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        # snapshot_every=1：每一步都写完整快照，相当于 MemorySaver 的保存方式
+        for name, snapshot_every in [("完整快照", 1), ("增量检查点", 50)]:
+            saver = SqliteDeltaSaver(os.path.join(tmp, f"{snapshot_every}.sqlite"), snapshot_every=snapshot_every)
+            graph = builder.compile(checkpointer=saver)
+            config = {"configurable": {"thread_id": "bench"}}
+            per_turn = []
+            started = time.perf_counter()
+            for i in range(turns):
+                before = saver.stats["bytes_written"]
+                graph.invoke({"messages": [HumanMessage(content=f"第 {i} 个问题")]}, config)
+                per_turn.append(saver.stats["bytes_written"] - before)
+            elapsed = time.perf_counter() - started
+            saver.flush()
+            size = os.path.getsize(saver.path)
+            messages = len(graph.get_state(config).values["messages"])
+            saver.close()
+            print(f"{name:<8} 开始 {sum(per_turn[:10]) / 10:8.0f} B/轮  结束 {sum(per_turn[-10:]) / 10:8.0f} B/轮  "
+                  f"文件 {size / 1024:8.1f} KB  耗时 {elapsed:.2f}s  消息数 {messages}")
+
+
+def _compact_demo(threads: int = 20, turns: int = 50, keep_last: int = 10):
+    """多线程对话后按 keep_last 压缩，对比 MemorySaver 与 SQLite 的内存 / 磁盘节省"""
+    import tempfile
+
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from checkpoint_retention import RetentionPolicy, memory_saver_bytes, prune_memory_saver
+
+    builder = _demo_builder()
+    policy = RetentionPolicy(keep_last=keep_last)
+
+    def fill(saver):
+        graph = builder.compile(checkpointer=saver)
+        for t in range(threads):
+            config = {"configurable": {"thread_id": f"user_{t}"}}
+            for i in range(turns):
+                graph.invoke({"messages": [HumanMessage(content=f"第 {i} 个问题：请详细解释一下这个概念")]}, config)
+        return graph
+
+    print("=" * 60)
+    print(f"{threads} 个线程 × {turns} 轮对话，保留策略 {policy}")
+    print("=" * 60)
+
+    memory = MemorySaver()
+    fill(memory)
+    result = prune_memory_saver(memory, policy)
+    print(f"MemorySaver      内存 {result['bytes_before'] / 1024:8.1f} KB → {result['bytes_after'] / 1024:8.1f} KB  "
+          f"删除检查点 {result['checkpoints_deleted']}")
+    assert memory_saver_bytes(memory) == result["bytes_after"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for compression in (None, "zlib", "zstd"):
+            if compression == "zstd" and zstandard is None:
+                print("（未安装 zstandard，跳过 zstd）")
+                continue
+            saver = SqliteDeltaSaver(os.path.join(tmp, f"{compression}.sqlite"), compression=compression)
+            graph = fill(saver)
+            saver.flush()
+            ratio = saver.stats["bytes_written"] / saver.stats["bytes_raw"]
+            result = saver.compact(policy)
+            config = {"configurable": {"thread_id": "user_0"}}
+            history = len(list(graph.get_state_history(config)))
+            messages = len(graph.get_state(config).values["messages"])
+            print(f"SQLite {str(compression):<6}  压缩比 {ratio:5.2f}  数据 {result['bytes_before'] / 1024:8.1f} KB → "
+                  f"{result['bytes_after'] / 1024:8.1f} KB  文件 {result['file_before'] / 1024:8.1f} KB → "
+                  f"{result['file_after'] / 1024:8.1f} KB  物化 {result['materialized']}  "
+                  f"压缩后历史 {history} 步 / 消息 {messages} 条")
+            saver.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        _compact_demo()
+    else:
+        _bench()
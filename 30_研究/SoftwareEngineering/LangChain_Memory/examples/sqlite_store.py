@@ -0,0 +1,1083 @@
+"""
+SQLite 持久化长期记忆存储（BaseStore）
+InMemoryStore 进程退出即丢失，long_term_memory_demo.py 中每个工具又各自发起 get / put。
+
+SqliteStore 可以直接替换 create_agent(store=...)：
+1. 命名空间拼成 "users.user001.preferences" 这样的前缀串，与 key 组成主键；
+   按前缀 search / list_namespaces 是主键 B 树上的一次范围扫描，不用全表遍历
+2. 另有一张命名空间表，list_namespaces 不需要对条目做 DISTINCT
+3. batch() 中的所有操作在一个事务内执行：同一命名空间的多个 get 合并为一条 IN 查询，
+   多个 put 用 executemany 一次写入（get_many / put_many 是对应的便捷方法）
+4. 语义与 InMemoryStore 一致：批内先执行读取，再按 (namespace, key) 去重后执行写入
+5. patch()：原子地设置 / 删除值中的个别字段，一条 upsert 完成，替代 get → 修改 → put；
+   后者要两次往返，并发更新同一用户时还会互相覆盖
+6. index={"dims": ..., "embed": ..., "fields": [...]}：挂上向量索引（见 vector_index.py），
+   search(namespace, query=...) 按语义相似度返回 top-k；向量矩阵常驻各进程内存，
+   检索前用 PRAGMA data_version 检查其他进程是否写过库，写过就整体重新载入
+7. 容量控制：ttl 按命名空间设置过期时间，读取时惰性过期、后台 sweeper 定期清理；
+   QuotaPolicy 限制每个用户的条目数和字节数，超出时淘汰最久未读的条目；metrics() 报告淘汰数与存储大小
+
+用法：
+    store = SqliteStore("memory_store.sqlite")
+    agent = create_agent(model=..., tools=[...], store=store)
+
+运行 `python sqlite_store.py bench --users 1000000` 在百万用户规模下测试 ops/sec，
+`python sqlite_store.py stress` 对比并发下 patch 与读-改-写的丢失更新和吞吐，
+`python sqlite_store.py retention` 模拟一个月的写入，对比有无 TTL / 配额时的存储增长。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    Item,
+    ListNamespacesOp,
+    PutOp,
+    SearchItem,
+    SearchOp,
+    ensure_embeddings,
+    get_text_at_path,
+    validate_op_namespace,
+)
+
+from vector_index import VectorIndex, decode_vectors, encode_vector
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    prefix TEXT NOT NULL,          -- 命名空间，用 "." 连接
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,           -- JSON
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    ttl REAL,                      -- 秒，NULL 表示永不过期
+    expires_at REAL,
+    last_read REAL,                -- 配额淘汰按它排序
+    size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (prefix, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS namespaces (
+    prefix TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS vectors (
+    prefix TEXT NOT NULL,
+    key TEXT NOT NULL,
+    seq INTEGER NOT NULL,          -- 同一条目的第几段文本
+    embedding BLOB NOT NULL,       -- float32
+    PRIMARY KEY (prefix, key, seq)
+) WITHOUT ROWID;
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS items_expires_at ON items (expires_at) WHERE expires_at IS NOT NULL;
+"""
+
+# 旧版本数据库缺少的列
+_ITEM_COLUMNS = {"ttl": "REAL", "expires_at": "REAL", "last_read": "REAL", "size": "INTEGER NOT NULL DEFAULT 0"}
+
+# 命名空间标签不能包含 "."；"/" 是 "." 的下一个字符，[prefix + ".", prefix + "/") 正好是所有子命名空间
+_SEP = "."
+_SEP_NEXT = "/"
+
+
+def _join(namespace: tuple) -> str:
+    return _SEP.join(namespace)
+
+
+def _split(prefix: str) -> tuple:
+    return tuple(prefix.split(_SEP)) if prefix else ()
+
+
+def _prefix_range(namespace_prefix: tuple) -> tuple:
+    """返回 (WHERE 子句, 参数)：命名空间本身及其所有子命名空间"""
+    if not namespace_prefix:
+        return "1 = 1", []
+    prefix = _join(namespace_prefix)
+    return "(prefix = ? OR (prefix > ? AND prefix < ?))", [prefix, prefix + _SEP, prefix + _SEP_NEXT]
+
+
+def _timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, timezone.utc)
+
+
+def _compare_values(item_value, filter_value) -> bool:
+    """与 InMemoryStore 相同的过滤语义：嵌套字典逐层比较，支持 $eq/$ne/$gt/$gte/$lt/$lte"""
+    if isinstance(filter_value, dict):
+        if any(k.startswith("$") for k in filter_value):
+            return all(_apply_operator(item_value, k, v) for k, v in filter_value.items())
+        if not isinstance(item_value, dict):
+            return False
+        return all(_compare_values(item_value.get(k), v) for k, v in filter_value.items())
+    if isinstance(filter_value, (list, tuple)):
+        return (
+            isinstance(item_value, (list, tuple))
+            and len(item_value) == len(filter_value)
+            and all(_compare_values(iv, fv) for iv, fv in zip(item_value, filter_value))
+        )
+    return item_value == filter_value
+
+
+def _apply_operator(value, operator: str, op_value) -> bool:
+    if operator == "$eq":
+        return value == op_value
+    if operator == "$ne":
+        return value != op_value
+    if value is None:
+        # 缺少该字段的条目不参与大小比较（InMemoryStore 在这里会抛 TypeError）
+        return False
+    if operator == "$gt":
+        return float(value) > float(op_value)
+    if operator == "$gte":
+        return float(value) >= float(op_value)
+    if operator == "$lt":
+        return float(value) < float(op_value)
+    if operator == "$lte":
+        return float(value) <= float(op_value)
+    raise ValueError(f"不支持的过滤运算符: {operator}")
+
+
+def _matches(condition, namespace: tuple) -> bool:
+    path = condition.path
+    if len(namespace) < len(path):
+        return False
+    pairs = zip(namespace, path) if condition.match_type == "prefix" else zip(reversed(namespace), reversed(path))
+    return all(p == "*" or n == p for n, p in pairs)
+
+
+def _pattern_matches(pattern: tuple, namespace: tuple) -> bool:
+    return len(namespace) >= len(pattern) and all(p == "*" or n == p for n, p in zip(namespace, pattern))
+
+
+class QuotaPolicy:
+    """
+    每个用户（命名空间的前 depth 段，如 ("users", "user001")）的配额
+
+    超出时按最近一次读取时间淘汰最久未读的条目；命名空间不足 depth 段的条目（如 ("users",) 下的资料）不计入。
+
+    Args:
+        max_items: 每个用户最多保留的条目数
+        max_bytes: 每个用户的值（JSON）总字节数上限
+        depth: 命名空间前几段决定条目属于哪个用户
+    """
+
+    def __init__(self, max_items: int | None = None, max_bytes: int | None = None, depth: int = 2):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.depth = depth
+
+    def owner(self, namespace: tuple) -> tuple | None:
+        return tuple(namespace[:self.depth]) if len(namespace) >= self.depth else None
+
+
+class SqliteStore(BaseStore):
+    """
+    基于 SQLite 的持久化 Store
+
+    Args:
+        path: 数据库文件路径
+        index: 向量索引配置，与 LangGraph 的 IndexConfig 相同：
+            dims 维度、embed 嵌入模型、fields 要索引的字段路径（默认 ["$"]，即整个值）
+        ttl: {命名空间模式: 秒数}，如 {("users", "*", "memories"): 30 * 86400}，最长的匹配模式生效；
+            put(..., ttl=分钟) 显式指定时优先（LangGraph 的约定以分钟为单位）
+        quota: 每个用户的配额
+        clock: 返回当前时间戳的函数，模拟时可替换
+    """
+
+    supports_ttl = True
+
+    def __init__(
+        self,
+        path: str = "memory_store.sqlite",
+        index: dict | None = None,
+        ttl: dict | None = None,
+        quota: QuotaPolicy | None = None,
+        clock=time.time,
+    ):
+        self.path = path
+        self._lock = threading.RLock()
+        self._closed = False
+        # isolation_level=None：事务由 batch() 显式控制
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.executescript(_INDEXES)
+
+        # 最长的模式优先匹配
+        self.ttl_rules = sorted((ttl or {}).items(), key=lambda rule: -len(rule[0]))
+        self.quota = quota
+        self.clock = clock
+        self.counters = {"expired": 0, "evicted": 0, "evicted_bytes": 0, "sweeps": 0}
+        # 配额淘汰用的读取时间先记在内存里，由 sweep() / close() 落盘，避免每次读取都写库
+        self._touched = {}
+        # 本事务中对向量的修改 [((prefix, key), [向量])]，提交后按顺序应用到内存矩阵
+        self._vector_log = []
+        # 读取时发现的过期条目和要续期的条目，由 _housekeep() 在写事务中处理
+        self._expired = []
+        self._renew = []
+        self._sweeper = None
+        self._stop = threading.Event()
+
+        self.index_config = index
+        self._vectors = None
+        if index:
+            self._embeddings = ensure_embeddings(index.get("embed"))
+            self._index_fields = index.get("fields") or ["$"]
+            self._vectors = VectorIndex(index["dims"])
+            self._data_version = None
+            with self._lock:
+                self._sync_vectors()
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        for column, declaration in _ITEM_COLUMNS.items():
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE items ADD COLUMN {column} {declaration}")
+                if column == "size":
+                    self._conn.execute("UPDATE items SET size = length(CAST(value AS BLOB))")
+
+    def _load_vectors(self):
+        rows = self._conn.execute("SELECT prefix, key, embedding FROM vectors").fetchall()
+        if rows and len(rows[0][2]) != 4 * self._vectors.dims:
+            raise ValueError(f"已有向量为 {len(rows[0][2]) // 4} 维，与 index['dims']={self._vectors.dims} 不一致")
+        vectors = VectorIndex(self._vectors.dims)
+        vectors.bulk_load([(prefix, key) for prefix, key, _ in rows], decode_vectors([row[2] for row in rows]))
+        self._vectors = vectors
+
+    def _sync_vectors(self):
+        """
+        其他进程写过库时重新载入向量矩阵
+
+        data_version 只在别的连接提交后变化，本连接自己的写入已经通过 _vector_log 应用到矩阵。
+        先读版本号再载入：两者之间又有提交时，下次检索会多载入一次，不会漏掉。
+        在事务内调用时载入的是与本次读取同一个快照。
+        多个进程频繁交替写入时，每次检索前都可能整体重新载入，此时应按用户分片（见 sharded_store.py）。
+        """
+        (version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if version != self._data_version:
+            self._load_vectors()
+            self._data_version = version
+
+    def close(self):
+        self.stop_sweeper()
+        with self._lock:
+            # 可以重复调用：包装层（WriteBehindStore）关闭时也会关闭持久层
+            if self._closed:
+                return
+            self._closed = True
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touches()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.close()
+
+    # ---------- batch ----------
+
+    def batch(self, ops) -> list:
+        ops = list(ops)
+        for op in ops:
+            validate_op_namespace(op)
+        results = [None] * len(ops)
+        puts = {}
+        for op in ops:
+            if isinstance(op, PutOp):
+                puts[(op.namespace, op.key)] = op
+            elif not isinstance(op, (GetOp, SearchOp, ListNamespacesOp)):
+                raise ValueError(f"未知的操作类型: {type(op)}")
+        puts = list(puts.values())
+        # 向量化可能要调用远程服务，放在事务之外
+        embeddings = self._embed_puts(puts)
+        queries = {
+            i: self._embeddings.embed_query(op.query)
+            for i, op in enumerate(ops) if isinstance(op, SearchOp) and op.query and self._vectors is not None
+        }
+
+        with self._lock:
+            # 纯读取的批次用延迟事务，不抢写锁；惰性过期和续期记下来，读完后另开一个短的写事务
+            self._conn.execute("BEGIN IMMEDIATE" if puts else "BEGIN")
+            try:
+                if queries:
+                    self._sync_vectors()
+                now = self.clock()
+                gets = {}
+                for i, op in enumerate(ops):
+                    if isinstance(op, GetOp):
+                        gets.setdefault(op.namespace, []).append((i, op.key, op.refresh_ttl))
+                    elif isinstance(op, SearchOp):
+                        if i in queries:
+                            results[i] = self._vector_search(op, queries[i], now)
+                        else:
+                            results[i] = self._search(op, now)
+                    elif isinstance(op, ListNamespacesOp):
+                        results[i] = self._list_namespaces(op)
+                for namespace, wanted in gets.items():
+                    found = self._get_many(
+                        namespace, [key for _, key, _ in wanted], now, any(refresh for *_, refresh in wanted)
+                    )
+                    for i, key, _ in wanted:
+                        results[i] = found.get(key)
+                if puts:
+                    self._housekeep(now)
+                    self._apply_puts(puts, now)
+                    self._write_vectors(embeddings)
+                    self._enforce_quota({op.namespace for op in puts if op.value is not None})
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._vector_log, self._expired, self._renew = [], [], []
+                raise
+            # 事务提交后再更新内存中的向量矩阵
+            self._apply_vector_log()
+            if self._expired or self._renew:
+                self._housekeep_later(now)
+        return results
+
+    async def abatch(self, ops) -> list:
+        # SQLite 调用是阻塞的，放到线程池中执行，避免卡住事件循环
+        return await asyncio.to_thread(self.batch, list(ops))
+
+    def _get_many(self, namespace: tuple, keys: list, now: float, refresh: bool) -> dict:
+        prefix = _join(namespace)
+        found, seen, expired = {}, [], []
+        # SQLite 单条语句的参数个数有上限，分块查询
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT key, value, created_at, updated_at, ttl, expires_at FROM items "
+                f"WHERE prefix = ? AND key IN ({','.join('?' * len(chunk))})",
+                [prefix, *chunk],
+            ).fetchall()
+            for key, value, created_at, updated_at, ttl, expires_at in rows:
+                if expires_at is not None and expires_at <= now:
+                    # 惰性过期：读到就删，不等 sweeper
+                    expired.append((prefix, key))
+                    continue
+                found[key] = Item(
+                    value=json.loads(value), key=key, namespace=namespace,
+                    created_at=_timestamp(created_at), updated_at=_timestamp(updated_at),
+                )
+                seen.append((prefix, key, ttl, expires_at))
+        self._expired.extend(expired)
+        self._observe(seen, now, refresh)
+        return found
+
+    def _housekeep(self, now: float):
+        """
+        在写事务中删除读取时发现的过期条目、为读到的条目续期
+
+        两步都带上条件重新判断：读和写之间其他进程可能已经重写或续期了同一条目，
+        删除只删仍然过期的，续期只往后延、不会把别人刚设的更晚的过期时间改早。
+        """
+        expired, self._expired = self._expired, []
+        renew, self._renew = self._renew, []
+        if expired:
+            still = [
+                pair for pair in expired
+                if self._conn.execute(
+                    "SELECT 1 FROM items WHERE prefix = ? AND key = ? AND expires_at <= ?", (*pair, now)
+                ).fetchone()
+            ]
+            if still:
+                self._delete_items(still)
+                self.counters["expired"] += len(still)
+        if renew:
+            self._conn.executemany(
+                "UPDATE items SET expires_at = ? WHERE prefix = ? AND key = ? AND expires_at < ?",
+                [(expires_at, prefix, key, expires_at) for expires_at, prefix, key in renew],
+            )
+
+    def _housekeep_later(self, now: float):
+        """
+        读事务提交后单独开一个 BEGIN IMMEDIATE 事务执行 _housekeep()
+
+        在延迟事务里直接写，读快照之后如果别的进程已经提交过，升级为写事务会报
+        SQLITE_BUSY_SNAPSHOT，而且等锁也没用；先拿写锁再写就没有这个问题。
+        拿不到锁（database is locked）时放弃本次清理：读取本来就跳过过期条目，
+        剩下的交给下次读取或 sweeper，读请求不因此失败。
+        """
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            self._expired, self._renew = [], []
+            return
+        try:
+            self._housekeep(now)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            self._vector_log = []
+            raise
+        self._apply_vector_log()
+
+    def _apply_puts(self, ops: list, now: float):
+        upserts = []
+        for op in ops:
+            if op.value is None:
+                continue
+            value = json.dumps(op.value, ensure_ascii=False)
+            ttl = self._ttl_seconds(op.namespace, op.ttl)
+            upserts.append((
+                _join(op.namespace), op.key, value, now, now,
+                ttl, now + ttl if ttl is not None else None, now, len(value.encode("utf-8")),
+            ))
+        deletes = [(_join(op.namespace), op.key) for op in ops if op.value is None]
+        if self._vectors is None:
+            # 未挂索引时也要删掉旧值的向量，之后带索引打开时才不会检索到过期内容
+            self._conn.executemany(
+                "DELETE FROM vectors WHERE prefix = ? AND key = ?", [(_join(op.namespace), op.key) for op in ops]
+            )
+        if upserts:
+            # 更新时保留 created_at；写入也算一次使用，刷新 last_read
+            self._conn.executemany(
+                "INSERT INTO items (prefix, key, value, created_at, updated_at, ttl, expires_at, last_read, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (prefix, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at, "
+                "ttl = excluded.ttl, expires_at = excluded.expires_at, last_read = excluded.last_read, "
+                "size = excluded.size",
+                upserts,
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO namespaces (prefix) VALUES (?)",
+                {(row[0],) for row in upserts},
+            )
+        if deletes:
+            self._delete_items(deletes)
+
+    def _delete_items(self, pairs: list):
+        """删除条目及其向量；命名空间下没有条目时一并删除命名空间"""
+        self._conn.executemany("DELETE FROM items WHERE prefix = ? AND key = ?", pairs)
+        self._conn.executemany("DELETE FROM vectors WHERE prefix = ? AND key = ?", pairs)
+        self._conn.executemany(
+            "DELETE FROM namespaces WHERE prefix = ? "
+            "AND NOT EXISTS (SELECT 1 FROM items WHERE items.prefix = namespaces.prefix)",
+            {(prefix,) for prefix, _ in pairs},
+        )
+        for pair in pairs:
+            self._touched.pop(pair, None)
+        if self._vectors is not None:
+            self._vector_log.extend((pair, []) for pair in pairs)
+
+    # ---------- 过期与配额 ----------
+
+    def _ttl_seconds(self, namespace: tuple, ttl_minutes: float | None = None) -> float | None:
+        if ttl_minutes is not None:
+            return ttl_minutes * 60
+        for pattern, seconds in self.ttl_rules:
+            if _pattern_matches(pattern, namespace):
+                return seconds
+        return None
+
+    def _observe(self, rows: list, now: float, refresh: bool):
+        """
+        记录读到的条目 [(prefix, key, ttl, expires_at)]
+
+        refresh 时续期，但只续剩余时间不到一半的，热点条目不会每次读取都写一次库。
+        """
+        if self.quota is not None:
+            for prefix, key, _, _ in rows:
+                self._touched[(prefix, key)] = now
+        if refresh:
+            renew = [(now + ttl, prefix, key) for prefix, key, ttl, expires_at in rows
+                     if ttl is not None and expires_at - now < ttl / 2]
+            self._renew.extend(renew)
+
+    def _enforce_quota(self, namespaces: set):
+        """写入后检查涉及的用户是否超出配额，超出时按最近读取时间从旧到新淘汰"""
+        if self.quota is None:
+            return
+        owners = {owner for owner in map(self.quota.owner, namespaces) if owner is not None}
+        for owner in owners:
+            where, params = _prefix_range(owner)
+            count, total = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM items WHERE {where}", params
+            ).fetchone()
+            excess_items = count - self.quota.max_items if self.quota.max_items is not None else 0
+            excess_bytes = total - self.quota.max_bytes if self.quota.max_bytes is not None else 0
+            if excess_items <= 0 and excess_bytes <= 0:
+                continue
+            rows = self._conn.execute(
+                f"SELECT prefix, key, size, last_read FROM items WHERE {where}", params
+            ).fetchall()
+            # 内存中尚未落盘的读取时间更新
+            rows.sort(key=lambda row: max(row[3] or 0.0, self._touched.get((row[0], row[1]), 0.0)))
+            victims, freed = [], 0
+            for prefix, key, size, _ in rows:
+                if excess_items <= 0 and excess_bytes <= 0:
+                    break
+                victims.append((prefix, key))
+                freed += size
+                excess_items -= 1
+                excess_bytes -= size
+            self._delete_items(victims)
+            self.counters["evicted"] += len(victims)
+            self.counters["evicted_bytes"] += freed
+
+    def _write_touches(self):
+        touched, self._touched = self._touched, {}
+        self._conn.executemany(
+            "UPDATE items SET last_read = ? WHERE prefix = ? AND key = ? AND (last_read IS NULL OR last_read < ?)",
+            [(ts, prefix, key, ts) for (prefix, key), ts in touched.items()],
+        )
+
+    def sweep(self, batch_size: int = 1000) -> int:
+        """
+        删除所有已过期的条目并落盘读取时间，返回删除的条数
+
+        每 batch_size 条一个事务，不长时间占用锁。
+        """
+        removed = 0
+        while True:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_touches()
+                    expired = self._conn.execute(
+                        "SELECT prefix, key FROM items WHERE expires_at <= ? LIMIT ?", (self.clock(), batch_size)
+                    ).fetchall()
+                    self._delete_items(expired)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    self._vector_log = []
+                    raise
+                self._apply_vector_log()
+                self.counters["expired"] += len(expired)
+            removed += len(expired)
+            if len(expired) < batch_size:
+                break
+        # 删除释放的页留给之后的写入复用；顺带截断 WAL，file_bytes 反映数据库的实际大小
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.counters["sweeps"] += 1
+        return removed
+
+    def start_sweeper(self, interval: float = 60.0):
+        """启动后台线程，每 interval 秒执行一次 sweep()"""
+        if self._sweeper is not None:
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval,), name="store-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[sweeper] 清理失败，稍后重试: {e}")
+
+    def stop_sweeper(self):
+        if self._sweeper is None:
+            return
+        self._stop.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    # ---------- 向量索引 ----------
+
+    def _embed_puts(self, puts: list) -> dict:
+        """返回 {(prefix, key): [向量]}；删除、index=False 的条目对应空列表（移除旧向量）"""
+        if self._vectors is None:
+            return {}
+        embeddings, texts, owners = {}, [], []
+        for op in puts:
+            owner = (_join(op.namespace), op.key)
+            embeddings[owner] = []
+            if op.value is None or op.index is False:
+                continue
+            fields = op.index if isinstance(op.index, list) else self._index_fields
+            for field in fields:
+                for text in get_text_at_path(op.value, field):
+                    texts.append(text)
+                    owners.append(owner)
+        if texts:
+            for owner, vector in zip(owners, self._embeddings.embed_documents(texts)):
+                embeddings[owner].append(vector)
+        return embeddings
+
+    def _write_vectors(self, embeddings: dict):
+        if not embeddings:
+            return
+        self._vector_log.extend(embeddings.items())
+        self._conn.executemany("DELETE FROM vectors WHERE prefix = ? AND key = ?", list(embeddings))
+        self._conn.executemany(
+            "INSERT INTO vectors (prefix, key, seq, embedding) VALUES (?, ?, ?, ?)",
+            [
+                (prefix, key, seq, encode_vector(vector))
+                for (prefix, key), vectors in embeddings.items()
+                for seq, vector in enumerate(vectors)
+            ],
+        )
+
+    def _apply_vector_log(self):
+        log, self._vector_log = self._vector_log, []
+        for (prefix, key), vectors in log:
+            self._vectors.add(prefix, key, vectors)
+
+    def _vector_search(self, op: SearchOp, query: list, now: float) -> list:
+        """
+        按与 query 的相似度排序，filter 与分页在排序之后应用
+
+        命名空间内的向量不多（不超过总数的 1/50）时，先用前缀索引取出候选只对它们打分；
+        否则对全部向量打分，按得分从高到低检查是否落在命名空间内。
+        判断多少时最多数到阈值为止，宽命名空间不会为计数扫描整段索引。
+        """
+        slots = None
+        prefix = _join(op.namespace_prefix)
+        if op.namespace_prefix:
+            where, params = _prefix_range(op.namespace_prefix)
+            threshold = max(1000, self._vectors.vector_count // 50)
+            (count,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM vectors WHERE {where} LIMIT ?)", [*params, threshold + 1]
+            ).fetchone()
+            if count <= threshold:
+                owners = self._conn.execute(f"SELECT DISTINCT prefix, key FROM vectors WHERE {where}", params)
+                slots = self._vectors.slots_of(owners)
+
+        wanted = op.offset + op.limit
+        matched, chunk = [], []
+        for score, (owner_prefix, key) in self._vectors.ranked(query, slots):
+            if slots is None and prefix and owner_prefix != prefix and not owner_prefix.startswith(prefix + _SEP):
+                continue
+            chunk.append((score, owner_prefix, key))
+            if len(chunk) >= max(wanted, 32):
+                matched.extend(self._load_scored(chunk, op.filter, now))
+                chunk = []
+                if len(matched) >= wanted:
+                    break
+        if chunk and len(matched) < wanted:
+            matched.extend(self._load_scored(chunk, op.filter, now))
+        matched = matched[op.offset:wanted]
+        self._observe(self._expiry_of(matched), now, op.refresh_ttl)
+        return [item for item, _ in matched]
+
+    def _load_scored(self, chunk: list, filter: dict | None, now: float) -> list:
+        """按 chunk 的顺序读出未过期的条目并应用 filter，返回 [(SearchItem, (ttl, expires_at))]"""
+        rows = {}
+        for start in range(0, len(chunk), 400):
+            part = chunk[start:start + 400]
+            # 与 VALUES 做连接才会逐个走主键查找；写成 (prefix, key) IN (VALUES ...) 会扫描全表
+            for prefix, key, value, created_at, updated_at, ttl, expires_at in self._conn.execute(
+                f"SELECT prefix, key, value, created_at, updated_at, ttl, expires_at "
+                f"FROM (VALUES {', '.join(['(?, ?)'] * len(part))}) AS wanted "
+                f"JOIN items ON items.prefix = wanted.column1 AND items.key = wanted.column2 "
+                f"WHERE items.expires_at IS NULL OR items.expires_at > ?",
+                [*(v for _, prefix, key in part for v in (prefix, key)), now],
+            ):
+                rows[(prefix, key)] = (value, created_at, updated_at, ttl, expires_at)
+        results = []
+        for score, prefix, key in chunk:
+            if (prefix, key) not in rows:
+                continue
+            value, created_at, updated_at, ttl, expires_at = rows[(prefix, key)]
+            value = json.loads(value)
+            if filter and not all(_compare_values(value.get(k), v) for k, v in filter.items()):
+                continue
+            results.append((SearchItem(
+                namespace=_split(prefix), key=key, value=value,
+                created_at=_timestamp(created_at), updated_at=_timestamp(updated_at), score=score,
+            ), (ttl, expires_at)))
+        return results
+
+    @staticmethod
+    def _expiry_of(results: list) -> list:
+        return [(_join(item.namespace), item.key, ttl, expires_at) for item, (ttl, expires_at) in results]
+
+    def reindex(self, batch_size: int = 1000) -> int:
+        """为所有已有条目重新生成向量（开启索引前写入的数据、或更换了嵌入模型时使用）"""
+        if self._vectors is None:
+            raise ValueError("未配置 index")
+        with self._lock:
+            rows = self._conn.execute("SELECT prefix, key, value FROM items").fetchall()
+        for start in range(0, len(rows), batch_size):
+            puts = [PutOp(_split(p), k, json.loads(v)) for p, k, v in rows[start:start + batch_size]]
+            embeddings = self._embed_puts(puts)
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_vectors(embeddings)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    self._vector_log = []
+                    raise
+                self._apply_vector_log()
+        return len(rows)
+
+    def _search(self, op: SearchOp, now: float) -> list:
+        """
+        按前缀范围扫描，结果按 (命名空间, key) 排序；已过期未清理的条目被跳过
+
+        没有 filter 时 offset / limit 下推到 SQL；有 filter 时在 Python 中过滤后分页。
+        未配置向量索引时 query 被忽略（与不带 index 的 InMemoryStore 一致）。
+        """
+        where, params = _prefix_range(op.namespace_prefix)
+        sql = (
+            f"SELECT prefix, key, value, created_at, updated_at, ttl, expires_at FROM items "
+            f"WHERE {where} AND (expires_at IS NULL OR expires_at > ?) ORDER BY prefix, key"
+        )
+        params.append(now)
+        if not op.filter:
+            sql += " LIMIT ? OFFSET ?"
+            params += [op.limit, op.offset]
+        results = []
+        skipped = 0
+        for prefix, key, value, created_at, updated_at, ttl, expires_at in self._conn.execute(sql, params):
+            value = json.loads(value)
+            if op.filter:
+                if not all(_compare_values(value.get(k), v) for k, v in op.filter.items()):
+                    continue
+                if skipped < op.offset:
+                    skipped += 1
+                    continue
+            results.append((SearchItem(
+                namespace=_split(prefix), key=key, value=value,
+                created_at=_timestamp(created_at), updated_at=_timestamp(updated_at),
+            ), (ttl, expires_at)))
+            if len(results) >= op.limit:
+                break
+        self._observe(self._expiry_of(results), now, op.refresh_ttl)
+        return [item for item, _ in results]
+
+    def _list_namespaces(self, op: ListNamespacesOp) -> list:
+        # 不含通配符的前缀条件可以变成范围查询，其余条件在 Python 中判断。
+        # 只剩过期条目的命名空间要等 sweep() 删除条目后才会消失
+        conditions = list(op.match_conditions or ())
+        exact = next(
+            (c for c in conditions if c.match_type == "prefix" and "*" not in c.path),
+            None,
+        )
+        where, params = _prefix_range(exact.path if exact else ())
+        namespaces = [
+            _split(prefix)
+            for (prefix,) in self._conn.execute(f"SELECT prefix FROM namespaces WHERE {where} ORDER BY prefix", params)
+        ]
+        namespaces = [ns for ns in namespaces if all(_matches(c, ns) for c in conditions)]
+        if op.max_depth is not None:
+            namespaces = sorted({ns[:op.max_depth] for ns in namespaces})
+        return namespaces[op.offset:op.offset + op.limit]
+
+    # ---------- 便捷方法 ----------
+
+    def get_many(self, keys: list) -> list:
+        """一次事务读取多个 (namespace, key)，返回对应的 Item 或 None"""
+        return self.batch([GetOp(namespace, key) for namespace, key in keys])
+
+    def put_many(self, items: list):
+        """一次事务写入多个 (namespace, key, value)；value 为 None 表示删除"""
+        self.batch([PutOp(namespace, key, value) for namespace, key, value in items])
+
+    def patch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()) -> dict:
+        """
+        原子地修改值中的个别字段，返回修改后的完整值
+
+        用 SQLite 的 json_patch（RFC 7396 merge patch）在一条 upsert 中完成：
+        条目不存在时新建；updates 中嵌套的字典逐层合并，值为 None 的字段被删除。
+
+        Args:
+            namespace: 命名空间
+            key: 条目 key
+            updates: 要设置的字段
+            remove: 要删除的字段名
+        """
+        return self.patch_many([(namespace, key, updates, remove)])[0]
+
+    def patch_many(self, patches: list) -> list:
+        """
+        一次事务执行多个 patch：[(namespace, key, updates, remove)]，返回各自修改后的值
+
+        配置了向量索引时，修改后的值要执行后才知道，向量化又可能调用远程服务，不能放在写事务里：
+        先提交合并结果，在事务外向量化，再用一个短事务写入向量。
+        写入前按 updated_at 检查条目在此期间没有被再次修改，被改过的由后来的写入负责自己的向量。
+        两次提交之间检索到的仍是旧值的向量。
+        """
+        rows = []
+        for namespace, key, updates, remove in patches:
+            validate_op_namespace(PutOp(namespace, key, {}))
+            merge = {**(updates or {}), **{field: None for field in remove}}
+            rows.append({
+                "prefix": _join(namespace), "key": key, "merge": json.dumps(merge, ensure_ascii=False),
+                "ttl": self._ttl_seconds(namespace),
+            })
+        values = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = self.clock()
+                for row in rows:
+                    # 已过期未清理的旧值视为不存在；已有条目沿用自己的 ttl 并重新计时
+                    (value,) = self._conn.execute(
+                        "INSERT INTO items (prefix, key, value, created_at, updated_at, ttl, expires_at, last_read, size) "
+                        "VALUES (:prefix, :key, json_patch('{}', :merge), :now, :now, :ttl, :now + :ttl, :now, "
+                        "length(CAST(json_patch('{}', :merge) AS BLOB))) "
+                        "ON CONFLICT (prefix, key) DO UPDATE SET "
+                        "value = json_patch(iif(items.expires_at <= :now, '{}', items.value), :merge), "
+                        "created_at = iif(items.expires_at <= :now, :now, items.created_at), "
+                        "updated_at = :now, expires_at = :now + items.ttl, last_read = :now, "
+                        "size = length(CAST(json_patch(iif(items.expires_at <= :now, '{}', items.value), :merge) AS BLOB)) "
+                        "RETURNING value",
+                        {**row, "now": now},
+                    ).fetchone()
+                    values.append(json.loads(value))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO namespaces (prefix) VALUES (?)", {(row["prefix"],) for row in rows}
+                )
+                self._enforce_quota({namespace for namespace, *_ in patches})
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._vector_log = []
+                raise
+            self._apply_vector_log()
+
+        if self._vectors is not None:
+            embeddings = self._embed_puts([
+                PutOp(namespace, key, value) for (namespace, key, _, _), value in zip(patches, values)
+            ])
+            self._write_vectors_if_unchanged(embeddings, now)
+        return values
+
+    def _write_vectors_if_unchanged(self, embeddings: dict, updated_at: float):
+        """只为 updated_at 仍是本次写入时间的条目写入向量（已被再次修改或删除的跳过）"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = {
+                    owner: vectors for owner, vectors in embeddings.items()
+                    if self._conn.execute(
+                        "SELECT 1 FROM items WHERE prefix = ? AND key = ? AND updated_at = ?", (*owner, updated_at)
+                    ).fetchone()
+                }
+                self._write_vectors(current)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._vector_log = []
+                raise
+            self._apply_vector_log()
+
+    async def apatch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()) -> dict:
+        return await asyncio.to_thread(self.patch, namespace, key, updates, remove)
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            namespaces = self._conn.execute("SELECT COUNT(*) FROM namespaces").fetchone()[0]
+        size = sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        return {"items": items, "namespaces": namespaces, "file_bytes": size}
+
+    def metrics(self) -> dict:
+        """存储大小与过期 / 淘汰计数；bytes 是值（JSON）的总字节数，file_bytes 是数据库文件大小"""
+        with self._lock:
+            items, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM items").fetchone()
+            (pending_expiry,) = self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE expires_at <= ?", (self.clock(),)
+            ).fetchone()
+            counters = dict(self.counters)
+        return {**self.stats(), "items": items, "bytes": total, "pending_expiry": pending_expiry, **counters}
+
+
+# ========== 基准测试 ==========
+
+def _rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>10,.0f} ops/s"
+
+
+def bench(path: str, users: int, ops: int, batch_size: int):
+    """
+    百万用户规模的基准：每个用户一条资料（("users",), user_id）
+    和一条偏好（("users", user_id, "preferences"), "settings"）
+    """
+    store = SqliteStore(path)
+    existing = store.stats()["items"]
+    print("=" * 60)
+    print(f"SqliteStore 基准：{users:,} 个用户，数据库 {path}")
+    print("=" * 60)
+
+    if existing < users * 2:
+        started = time.perf_counter()
+        for start in range(0, users, 10_000):
+            items = []
+            for u in range(start, min(start + 10_000, users)):
+                uid = f"user{u:07d}"
+                items.append((("users",), uid, {"name": f"用户{u}", "age": 20 + u % 50, "email": f"{uid}@example.com"}))
+                items.append((("users", uid, "preferences"), "settings", {"language": "中文", "theme": "dark"}))
+            store.put_many(items)
+        elapsed = time.perf_counter() - started
+        print(f"{'批量写入':<16}{_rate(users * 2, elapsed)}  （共 {users * 2:,} 条，{elapsed:.1f}s）")
+
+    def uid():
+        return f"user{random.randrange(users):07d}"
+
+    measurements = [
+        ("单条 get", lambda: store.get(("users",), uid())),
+        ("单条 put", lambda: store.put(("users", uid(), "preferences"), "settings", {"language": "English"})),
+        ("前缀 search", lambda: store.search(("users", uid()), limit=10)),
+        ("list_namespaces", lambda: store.list_namespaces(prefix=("users", uid()), limit=10)),
+    ]
+    for name, fn in measurements:
+        started = time.perf_counter()
+        for _ in range(ops):
+            fn()
+        print(f"{name:<16}{_rate(ops, time.perf_counter() - started)}")
+
+    rounds = max(1, ops // batch_size)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        store.get_many([(("users",), uid()) for _ in range(batch_size)])
+    print(f"{f'批量 get ×{batch_size}':<16}{_rate(rounds * batch_size, time.perf_counter() - started)}")
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        store.put_many([(("users", uid(), "preferences"), "settings", {"theme": "light"}) for _ in range(batch_size)])
+    print(f"{f'批量 put ×{batch_size}':<16}{_rate(rounds * batch_size, time.perf_counter() - started)}")
+
+    stats = store.stats()
+    print(f"\n条目 {stats['items']:,}，命名空间 {stats['namespaces']:,}，文件 {stats['file_bytes'] / 1024 / 1024:.1f} MB")
+    store.close()
+
+
+def stress(path: str, workers: int, updates: int):
+    """
+    workers 个线程共用一个 store，同时更新同一个用户的偏好，每个线程写入自己的字段；
+    结束后应当有 workers × updates 个字段
+
+    - 读-改-写：get 与 put 各自一个事务，中间可能被其他线程的写入插入
+    - 加锁读-改-写：整个 get → put 持有 store 的锁，不丢更新，但两次往返都在锁内
+    - patch：一条 upsert
+    """
+    print("=" * 60)
+    print(f"并发更新同一用户偏好：{workers} 个工作线程 × 每个 {updates} 次更新")
+    print("=" * 60)
+    namespace = ("users", "user001", "preferences")
+
+    def read_modify_write(store, field, value):
+        existing = store.get(namespace, "settings")
+        preferences = existing.value if existing else {}
+        preferences[field] = value
+        store.put(namespace, "settings", preferences)
+
+    def locked_read_modify_write(store, field, value):
+        with store._lock:
+            read_modify_write(store, field, value)
+
+    def atomic_patch(store, field, value):
+        store.patch(namespace, "settings", {field: value})
+
+    modes = (("读-改-写", read_modify_write), ("加锁读-改-写", locked_read_modify_write), ("patch", atomic_patch))
+    for name, update in modes:
+        if os.path.exists(path):
+            os.remove(path)
+        store = SqliteStore(path)
+
+        def work(w):
+            for i in range(updates):
+                update(store, f"w{w}_{i}", i)
+
+        threads = [threading.Thread(target=work, args=(w,)) for w in range(workers)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        fields = len(store.get(namespace, "settings").value)
+        expected = workers * updates
+        print(f"{name:<12}{_rate(expected, elapsed)}  保留字段 {fields:,}/{expected:,}  丢失更新 {expected - fields:,}")
+        store.close()
+
+
+def retention(path: str, users: int, days: int, writes: int, ttl_days: float, max_items: int, max_kb: int):
+    """
+    模拟 days 天的使用：每天约一半用户活跃，各自先读几条旧记忆、再写入 writes 条新记忆；
+    时钟是模拟的，每天结束时执行一次 sweep()。对比不加限制与 TTL + 配额下的存储增长
+    """
+    print("=" * 60)
+    print(f"{users} 个用户 × {days} 天，活跃用户每天写入 {writes} 条记忆；"
+          f"TTL {ttl_days:g} 天，配额 {max_items} 条 / {max_kb} KB")
+    print("=" * 60)
+    topics = ["爬山", "咖啡", "编程", "摄影", "旅行", "跑步", "读书", "烹饪", "音乐", "电影"]
+    configs = (
+        ("不限制", {}),
+        ("TTL + 配额", {
+            "ttl": {("users", "*", "memories"): ttl_days * 86400},
+            "quota": QuotaPolicy(max_items=max_items, max_bytes=max_kb * 1024),
+        }),
+    )
+    for name, options in configs:
+        if os.path.exists(path):
+            os.remove(path)
+        clock = [1_700_000_000.0]
+        store = SqliteStore(path, clock=lambda: clock[0], **options)
+        rng = random.Random(0)
+        written = {f"user{u:04d}": [] for u in range(users)}
+        print(f"\n[{name}]")
+        for day in range(days):
+            for user_id, keys in written.items():
+                clock[0] += 86400 / users
+                if rng.random() < 0.5:
+                    continue
+                namespace = ("users", user_id, "memories")
+                if keys:
+                    # 被读到的记忆在配额淘汰时会被保留
+                    store.get_many([(namespace, key) for key in rng.sample(keys, min(3, len(keys)))])
+                new = [f"d{day:03d}_{i}" for i in range(writes)]
+                store.put_many([
+                    (namespace, key, {"text": f"用户提到最近在{rng.choice(topics)}，想多了解{rng.choice(topics)}相关的内容"})
+                    for key in new
+                ])
+                keys.extend(new)
+            store.sweep()
+            if (day + 1) % 7 == 0 or day == days - 1:
+                m = store.metrics()
+                print(f"  第 {day + 1:>2} 天  条目 {m['items']:>7,}  值 {m['bytes'] / 1024:>8,.0f} KB  "
+                      f"文件 {m['file_bytes'] / 1024 / 1024:6.1f} MB")
+        m = store.metrics()
+        print(f"  过期删除 {m['expired']:,}  配额淘汰 {m['evicted']:,}（{m['evicted_bytes'] / 1024:,.0f} KB）  "
+              f"sweep {m['sweeps']} 次")
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 持久化 Store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="ops/sec 基准测试")
+    bench_parser.add_argument("--path", default="store_bench.sqlite")
+    bench_parser.add_argument("--users", type=int, default=1_000_000)
+    bench_parser.add_argument("--ops", type=int, default=20_000)
+    bench_parser.add_argument("--batch-size", type=int, default=100)
+    stress_parser = sub.add_parser("stress", help="并发更新：patch 与读-改-写对比")
+    stress_parser.add_argument("--path", default="store_stress.sqlite")
+    stress_parser.add_argument("--workers", type=int, default=8)
+    stress_parser.add_argument("--updates", type=int, default=300)
+    retention_parser = sub.add_parser("retention", help="TTL 与配额下的存储增长模拟")
+    retention_parser.add_argument("--path", default="store_retention.sqlite")
+    retention_parser.add_argument("--users", type=int, default=500)
+    retention_parser.add_argument("--days", type=int, default=30)
+    retention_parser.add_argument("--writes", type=int, default=4)
+    retention_parser.add_argument("--ttl-days", type=float, default=14)
+    retention_parser.add_argument("--max-items", type=int, default=30)
+    retention_parser.add_argument("--max-kb", type=int, default=4)
+    args = parser.parse_args()
+    if args.command == "bench":
+        bench(args.path, args.users, args.ops, args.batch_size)
+    elif args.command == "stress":
+        stress(args.path, args.workers, args.updates)
+    else:
+        retention(args.path, args.users, args.days, args.writes, args.ttl_days, args.max_items, args.max_kb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+两级检查点：内存热线程 LRU + 磁盘持久化存储
+生产环境中有海量 thread_id，绝大多数长期空闲，不可能全部常驻内存；
+而活跃线程每一轮都要先读取最新状态，每次都走磁盘又会拖慢每一轮。
+
+TieredCheckpointSaver 包装一个持久化 checkpointer（如 SqliteDeltaSaver）：
+1. 热层：按 LRU 保留最近活跃线程的最新检查点，受线程数和估算字节数双重限制
+2. 写穿透（write-through）：put 先写持久层再更新热层，put_writes 写持久层后让热层对应项失效；
+   崩溃时能丢多少取决于持久层何时提交：SqliteDeltaSaver 批量提交，最多丢失最近 commit_interval 秒
+   （且不超过 commit_every 次）已经由热层返回过的写入；sync=True 时每次写入后调用持久层的 flush()，
+   不丢数据，代价是每一步都要一次提交
+3. 懒加载：恢复一个冷线程时才从持久层读取，并放入热层
+4. 指标：命中率、常驻线程数与字节数、冷线程恢复延迟（p50 / p95）
+
+时间旅行（指定 checkpoint_id 的旧检查点）和 list() 直接走持久层。
+
+用法：
+    checkpointer = TieredCheckpointSaver(SqliteDeltaSaver("checkpoints.sqlite"), max_threads=1000)
+    graph = builder.compile(checkpointer=checkpointer)
+
+运行 `python tiered_checkpointer.py` 模拟大量线程的访问，对比只用持久层和两级缓存。
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    copy_checkpoint,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# 估算常驻内存时每条消息（对象、id、元数据等）的固定开销
+MESSAGE_OVERHEAD_BYTES = 400
+
+
+def _estimate_bytes(value) -> int:
+    """粗略估算通道值的内存占用：只看文本长度，避免为统计再序列化一遍"""
+    if isinstance(value, list):
+        return sum(_estimate_bytes(v) for v in value)
+    content = getattr(value, "content", None)
+    if content is not None:
+        return len(str(content).encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 64
+
+
+def percentile(values, p: float) -> float:
+    """最近秩百分位数；values 为空时返回 0（与 LangChain/examples/tracing.py 的同名函数一致）"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(1, math.ceil(p / 100 * len(values))) - 1]
+
+
+def _copy_tuple(saved: CheckpointTuple) -> CheckpointTuple:
+    """返回给调用方的副本：通道中的列表也复制一层，调用方修改不会污染热层"""
+    checkpoint = copy_checkpoint(saved.checkpoint)
+    checkpoint["channel_values"] = {
+        k: list(v) if isinstance(v, list) else v for k, v in checkpoint["channel_values"].items()
+    }
+    return saved._replace(checkpoint=checkpoint, pending_writes=list(saved.pending_writes or []))
+
+
+class TieredCheckpointSaver(BaseCheckpointSaver):
+    """
+    内存 LRU + 持久层的两级检查点
+
+    Args:
+        durable: 持久化 checkpointer
+        max_threads: 热层最多常驻的线程数
+        max_bytes: 热层估算字节数上限
+        sync: 每次写入后立即提交持久层（持久层需提供 flush()）
+    """
+
+    def __init__(self, durable, max_threads: int = 1000, max_bytes: int = 64 * 1024 * 1024, sync: bool = False):
+        super().__init__(serde=durable.serde)
+        self.durable = durable
+        self.sync = sync
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # (thread_id, ns) -> (CheckpointTuple, 估算字节数)
+        self._hot = OrderedDict()
+        self._resident_bytes = 0
+        self._resume_latency = deque(maxlen=1000)
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __getattr__(self, name):
+        # flush / close / compact / storage_report 等透传给持久层
+        if name == "durable":
+            raise AttributeError(name)
+        return getattr(self.durable, name)
+
+    # ---------- 热层 ----------
+
+    def _store_locked(self, key: tuple, saved: CheckpointTuple):
+        size = sum(_estimate_bytes(v) for v in saved.checkpoint["channel_values"].values())
+        old = self._hot.pop(key, None)
+        if old:
+            self._resident_bytes -= old[1]
+        self._hot[key] = (saved, size)
+        self._resident_bytes += size
+        while len(self._hot) > 1 and (len(self._hot) > self.max_threads or self._resident_bytes > self.max_bytes):
+            _, (_, evicted) = self._hot.popitem(last=False)
+            self._resident_bytes -= evicted
+            self.counters["evictions"] += 1
+
+    def _drop_locked(self, key: tuple):
+        old = self._hot.pop(key, None)
+        if old:
+            self._resident_bytes -= old[1]
+
+    # ---------- BaseCheckpointSaver 接口 ----------
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        key = (thread_id, ns)
+        checkpoint_id = get_checkpoint_id(config)
+
+        with self._lock:
+            cached = self._hot.get(key)
+            if cached and checkpoint_id in (None, cached[0].config["configurable"]["checkpoint_id"]):
+                self._hot.move_to_end(key)
+                self.counters["hits"] += 1
+                saved = _copy_tuple(cached[0])
+            else:
+                saved = None
+        if saved is not None:
+            # 让持久层知道当前状态，之后的 put 可以直接计算增量
+            if prime := getattr(self.durable, "prime", None):
+                prime(saved.config, saved.checkpoint)
+            return saved
+        if checkpoint_id:
+            # 指定了旧检查点（时间旅行）：不进入热层
+            return self.durable.get_tuple(config)
+
+        started = time.perf_counter()
+        saved = self.durable.get_tuple(config)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.counters["misses"] += 1
+            self._resume_latency.append(elapsed)
+            if saved is not None:
+                self._store_locked(key, saved)
+        return _copy_tuple(saved) if saved is not None else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        return self.durable.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = self.durable.put(config, checkpoint, metadata, new_versions)
+        if self.sync:
+            self.durable.flush()
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        saved = CheckpointTuple(
+            config=next_config,
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=get_checkpoint_metadata(config, metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[],
+        )
+        with self._lock:
+            self._store_locked((thread_id, ns), _copy_tuple(saved))
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        self.durable.put_writes(config, writes, task_id, task_path)
+        if self.sync:
+            self.durable.flush()
+        # pending writes 的去重规则以持久层为准：直接让热层的这一项失效。
+        # 正常执行中紧接着的 put 会重新写入热层；只有中断或出错后的恢复才会回源读取一次。
+        key = (config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""))
+        with self._lock:
+            cached = self._hot.get(key)
+            if cached and cached[0].config["configurable"]["checkpoint_id"] == config["configurable"]["checkpoint_id"]:
+                self._drop_locked(key)
+
+    def delete_thread(self, thread_id: str):
+        self.durable.delete_thread(thread_id)
+        with self._lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                self._drop_locked(key)
+
+    async def aget_tuple(self, config):
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current, channel=None):
+        return self.durable.get_next_version(current, channel)
+
+    # ---------- 指标 ----------
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            latencies = list(self._resume_latency)
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "resident_threads": len(self._hot),
+                "resident_bytes": self._resident_bytes,
+                "resume_p50_ms": percentile(latencies, 50) * 1000,
+                "resume_p95_ms": percentile(latencies, 95) * 1000,
+            }
+
+
+# ========== 模拟 ==========
+
+def simulate(threads: int = 300, history_turns: int = 10, turns: int = 2000, hot_threads: int = 50, max_threads: int = 100):
+    """
+    大量线程、少数热点的访问模式：80% 的轮次落在 hot_threads 个线程上
+
+    对比只用 SqliteDeltaSaver 和加上热层后每轮的时延。
+    """
+    import os
+    import random
+    import tempfile
+
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.messages import HumanMessage
+    from langgraph.graph import START, MessagesState, StateGraph
+
+    from sqlite_checkpointer import SqliteDeltaSaver
+
+    model = FakeListChatModel(responses=["好的，这是一条长度适中的模型回复，用来模拟真实对话。"])
+
+    def chatbot(state: MessagesState):
+        return {"messages": [model.invoke(state["messages"])]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("chatbot", chatbot)
+    builder.add_edge(START, "chatbot")
+
+    def pick():
+        if random.random() < 0.8:
+            return random.randrange(hot_threads)
+        return random.randrange(threads)
+
+    print("=" * 60)
+    print(f"{threads} 个线程（每个已有 {history_turns} 轮历史），{turns} 轮访问，"
+          f"80% 落在 {hot_threads} 个热点线程；热层上限 {max_threads} 个线程")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "threads.sqlite")
+        durable = SqliteDeltaSaver(path)
+        graph = builder.compile(checkpointer=durable)
+        for t in range(threads):
+            for i in range(history_turns):
+                graph.invoke({"messages": [HumanMessage(content=f"历史问题 {i}")]}, {"configurable": {"thread_id": f"t{t}"}})
+        durable.close()
+
+        for name in ("只用持久层", "两级缓存"):
+            random.seed(0)
+            # 重新打开：持久层内部的增量缓存也从空开始，模拟进程重启
+            durable = SqliteDeltaSaver(path, cache_threads=1)
+            saver = TieredCheckpointSaver(durable, max_threads=max_threads) if name == "两级缓存" else durable
+            graph = builder.compile(checkpointer=saver)
+            latencies, loads = [], []
+            for _ in range(turns):
+                config = {"configurable": {"thread_id": f"t{pick()}"}}
+                started = time.perf_counter()
+                saver.get_tuple(config)  # 单独计时：每轮开始时读取线程最新状态
+                loads.append(time.perf_counter() - started)
+                graph.invoke({"messages": [HumanMessage(content="新的问题")]}, config)
+                latencies.append(time.perf_counter() - started)
+            print(f"{name:<8} 读取状态 p50 {percentile(loads, 50) * 1000:5.2f}ms  p95 {percentile(loads, 95) * 1000:5.2f}ms  "
+                  f"每轮 p50 {percentile(latencies, 50) * 1000:5.2f}ms  p95 {percentile(latencies, 95) * 1000:5.2f}ms")
+            if saver is not durable:
+                m = saver.metrics()
+                print(f"  命中率 {m['hit_rate']:.1%}  常驻线程 {m['resident_threads']}  "
+                      f"常驻约 {m['resident_bytes'] / 1024:.0f} KB  淘汰 {m['evictions']}  "
+                      f"冷恢复 p50 {m['resume_p50_ms']:.2f}ms / p95 {m['resume_p95_ms']:.2f}ms")
+            durable.close()
+
+
+if __name__ == "__main__":
+    simulate()
@@ -0,0 +1,284 @@
+"""
+长期记忆的语义检索索引
+只能按精确的命名空间和 key 读取记忆时，记忆一多，智能体就没法快速找回"和这个问题相关的一切"。
+
+SqliteStore(index={...}) 挂上本模块的向量索引后：
+1. put 时按 index["fields"] 抽取文本、批量向量化，写入 vectors 表；删除或覆盖时同步移除旧向量
+2. 所有向量在内存中常驻为一个归一化矩阵（有 numpy 时用矩阵乘法，否则退化为纯 Python），
+   search(namespace, query=..., filter=..., limit=...) 返回余弦相似度 top-k
+3. 命名空间很窄时（如单个用户）先按前缀索引取出候选，只对候选打分；
+   命名空间很宽时对全部向量打分，再按得分从高到低逐批检查命名空间与 filter
+4. 嵌入模型可插拔：LangChain Embeddings、嵌入函数或 "openai:text-embedding-3-small" 这样的字符串；
+   HashingEmbedder 是离线的特征哈希嵌入，用于测试和没有嵌入服务的环境
+
+用法：
+    store = SqliteStore("memory_store.sqlite", index={"dims": 256, "embed": HashingEmbedder(256)})
+    store.put(("users", "user001", "memories"), "m1", {"text": "喜欢在周末爬山"})
+    store.search(("users", "user001"), query="户外运动", limit=5)
+
+运行 `python vector_index.py bench --memories 300000` 测试数十万条记忆下的检索延迟。
+"""
+
+import argparse
+import heapq
+import math
+import re
+import zlib
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖
+    np = None
+
+_LATIN = re.compile(r"[a-z0-9]+")
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+
+
+class HashingEmbedder(Embeddings):
+    """
+    离线的特征哈希嵌入：英文按词、中文按单字和相邻二字切分，哈希到 dims 维后 L2 归一化
+
+    没有语义泛化能力（"爬山" 与 "徒步" 不相近），但相同词语的文本相似度高，
+    结果确定、无需网络，适合测试和演示。
+    """
+
+    def __init__(self, dims: int = 256):
+        self.dims = dims
+
+    @staticmethod
+    def _features(text: str) -> list:
+        text = text.lower()
+        features = _LATIN.findall(text)
+        for run in _CJK.findall(text):
+            features.extend(run)
+            features.extend(run[i:i + 2] for i in range(len(run) - 1))
+        return features
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * self.dims
+        for feature in self._features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            # 最高位决定符号，减少哈希冲突带来的偏差
+            vector[h % self.dims] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+def _normalize(vector) -> list:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def encode_vector(vector) -> bytes:
+    """归一化后按 float32 存储"""
+    return array("f", _normalize(vector)).tobytes()
+
+
+def decode_vectors(blobs: list):
+    """把多条 float32 向量解码为矩阵（numpy）或 array 列表"""
+    if np is not None:
+        return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1) if blobs else []
+    vectors = []
+    for blob in blobs:
+        vector = array("f")
+        vector.frombytes(blob)
+        vectors.append(vector)
+    return vectors
+
+
+class VectorIndex:
+    """
+    内存中的向量矩阵：每个槽位存一条归一化向量，记录它属于哪个 (prefix, key)
+
+    由 SqliteStore 在持有锁、事务提交之后调用，本身不加锁。
+    """
+
+    def __init__(self, dims: int):
+        self.dims = dims
+        self._owners = []      # 槽位 -> (prefix, key)，空槽为 None
+        self._slots = {}       # (prefix, key) -> [槽位]
+        self._free = []
+        if np is not None:
+            self._matrix = np.zeros((1024, dims), dtype=np.float32)
+        else:
+            self._matrix = []
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def vector_count(self) -> int:
+        return len(self._owners) - len(self._free)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        slot = len(self._owners)
+        self._owners.append(None)
+        if np is not None:
+            if slot >= len(self._matrix):
+                grown = np.zeros((len(self._matrix) * 2, self.dims), dtype=np.float32)
+                grown[:len(self._matrix)] = self._matrix
+                self._matrix = grown
+        else:
+            self._matrix.append(None)
+        return slot
+
+    def bulk_load(self, owners: list, vectors):
+        """启动时从 SQLite 载入：按顺序占用槽位"""
+        for owner, vector in zip(owners, vectors):
+            slot = self._allocate()
+            self._matrix[slot] = vector
+            self._owners[slot] = owner
+            self._slots.setdefault(owner, []).append(slot)
+
+    def add(self, prefix: str, key: str, vectors: list):
+        """替换条目的全部向量（vectors 为空即移除）"""
+        self.remove(prefix, key)
+        slots = []
+        for vector in map(_normalize, vectors):
+            slot = self._allocate()
+            if np is not None:
+                self._matrix[slot] = vector
+            else:
+                self._matrix[slot] = array("f", vector)
+            self._owners[slot] = (prefix, key)
+            slots.append(slot)
+        if slots:
+            self._slots[(prefix, key)] = slots
+
+    def remove(self, prefix: str, key: str):
+        for slot in self._slots.pop((prefix, key), ()):
+            self._owners[slot] = None
+            if np is not None:
+                self._matrix[slot] = 0.0
+            else:
+                self._matrix[slot] = None
+            self._free.append(slot)
+
+    def slots_of(self, owners) -> list:
+        return [slot for owner in owners for slot in self._slots.get(owner, ())]
+
+    def ranked(self, query: list, slots: list | None = None, batch: int = 64):
+        """
+        按相似度从高到低逐个产出 (score, (prefix, key))，同一条目只产出得分最高的一次
+
+        先取前 batch 个，调用方还要更多时再扩大到 4 倍，避免对全部向量排序。
+        slots 为 None 时对所有向量打分。
+        """
+        query = _normalize(query)
+        if np is not None:
+            query = np.asarray(query, dtype=np.float32)
+            if slots is None:
+                # 切片是视图，不复制矩阵
+                candidates = np.arange(len(self._owners))
+                scores = self._matrix[:len(self._owners)] @ query
+            else:
+                candidates = np.asarray(slots, dtype=np.int64)
+                scores = self._matrix[candidates] @ query
+        else:
+            candidates = range(len(self._owners)) if slots is None else slots
+            scores = [
+                sum(a * b for a, b in zip(self._matrix[slot], query)) if self._matrix[slot] is not None else -2.0
+                for slot in candidates
+            ]
+        seen = set()
+        emitted = 0
+        total = len(scores)
+        while emitted < total:
+            take = min(total, max(batch, emitted * 4))
+            if np is not None:
+                top = np.argpartition(-scores, take - 1)[:take] if take < total else np.arange(total)
+                order = top[np.argsort(-scores[top], kind="stable")]
+            else:
+                order = heapq.nlargest(take, range(total), key=scores.__getitem__)
+            for position in order[emitted:]:
+                owner = self._owners[int(candidates[position])]
+                if owner is not None and owner not in seen:
+                    seen.add(owner)
+                    yield float(scores[position]), owner
+            emitted = take
+
+
+# ========== 基准测试 ==========
+
+def bench(path: str, memories: int, users: int, queries: int, dims: int):
+    """
+    每个用户若干条记忆，存放在 ("users", user_id, "memories")；
+    分别测量单个用户范围内检索、全部用户范围内检索、带 filter 检索的延迟
+    """
+    import os
+    import random
+    import time
+
+    from sqlite_store import SqliteStore
+    from tiered_checkpointer import percentile
+
+    topics = ["爬山", "咖啡", "编程", "摄影", "旅行", "跑步", "读书", "烹饪", "音乐", "电影", "猫", "游泳"]
+    places = ["北京", "上海", "杭州", "成都", "深圳", "西安"]
+
+    def memory_text(rng):
+        return f"用户提到喜欢{rng.choice(topics)}，最近常去{rng.choice(places)}，也对{rng.choice(topics)}感兴趣"
+
+    store = SqliteStore(path, index={"dims": dims, "embed": HashingEmbedder(dims), "fields": ["text"]})
+    print("=" * 60)
+    print(f"向量检索基准：{memories:,} 条记忆，{users:,} 个用户，{dims} 维，numpy={'是' if np is not None else '否'}")
+    print("=" * 60)
+
+    existing = store.stats()["items"]
+    if existing < memories:
+        rng = random.Random(0)
+        started = time.perf_counter()
+        for start in range(existing, memories, 5_000):
+            store.put_many([
+                (("users", f"user{i % users:05d}", "memories"), f"m{i:07d}",
+                 {"text": memory_text(rng), "importance": i % 5})
+                for i in range(start, min(start + 5_000, memories))
+            ])
+        elapsed = time.perf_counter() - started
+        print(f"写入（含向量化）{(memories - existing) / elapsed:>10,.0f} 条/s")
+    else:
+        print(f"复用已有数据库 {path}（{os.path.getsize(path) / 1024 / 1024:.0f} MB）")
+
+    rng = random.Random(1)
+    cases = [
+        ("单个用户范围", lambda: store.search(("users", f"user{rng.randrange(users):05d}"), query=memory_text(rng), limit=5)),
+        ("全部用户", lambda: store.search(("users",), query=memory_text(rng), limit=10)),
+        ("全部用户 + filter", lambda: store.search(
+            ("users",), query=memory_text(rng), filter={"importance": {"$gte": 4}}, limit=10)),
+    ]
+    for name, fn in cases:
+        latencies = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            results = fn()
+            latencies.append(time.perf_counter() - started)
+        print(f"{name:<14} p50 {percentile(latencies, 50) * 1000:6.2f}ms  "
+              f"p95 {percentile(latencies, 95) * 1000:6.2f}ms  返回 {len(results)} 条")
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store 向量检索")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="检索延迟基准")
+    bench_parser.add_argument("--path", default="vector_bench.sqlite")
+    bench_parser.add_argument("--memories", type=int, default=300_000)
+    bench_parser.add_argument("--users", type=int, default=10_000)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--dims", type=int, default=128)
+    args = parser.parse_args()
+    bench(args.path, args.memories, args.users, args.queries, args.dims)
+
+
+if __name__ == "__main__":
+    main()
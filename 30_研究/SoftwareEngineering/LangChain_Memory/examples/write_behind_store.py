@@ -0,0 +1,372 @@
+"""
+写回（write-behind）缓冲：合并频繁的 Store 更新
+一轮对话里智能体常常连续调用几次 update_user_preference（"语言偏好为中文，主题偏好为深色模式"），
+每次都同步写一次持久层。
+
+WriteBehindStore 包装一个持久化 Store（如 SqliteStore）：
+1. put / patch 只进入内存缓冲，按 (namespace, key) 合并：后来的 put 覆盖之前的一切
+   （包括它的 index 与 ttl 参数），连续的 patch 合成一个 merge patch，
+   put 之后的 patch 直接作用在缓冲的值上并沿用该 put 的 index 与 ttl
+2. 读到自己的写入：get 在持久层的值上叠加缓冲中的修改；search / list_namespaces 先刷写再查询
+3. 刷写时机：end_turn()（在轮结束时由后台线程异步刷写）、定时器、close() / 进程退出；
+   刷写调用持久层的 batch / patch_many，返回即已提交。刷写失败时缓冲会恢复，下次重试；
+   后台连续失败 max_failures 次后停止重试，之后的 end_turn() 抛出该错误，
+   直到一次 flush() 成功。缓冲的 key 超过 max_pending 时写入方同步刷写（背压），失败直接抛给写入方
+4. 是否支持 ttl 与持久层一致；close() 刷写后同时关闭持久层
+
+用法：
+    store = WriteBehindStore(SqliteStore("memory_store.sqlite"), interval=1.0)
+    ...每轮结束时 store.end_turn()
+
+运行 `python write_behind_store.py` 对比直接写持久层与写回缓冲的写入次数和每轮耗时。
+"""
+
+import asyncio
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    Item,
+    ListNamespacesOp,
+    PutOp,
+    SearchOp,
+    validate_op_namespace,
+)
+
+
+def _apply_merge(target, patch: dict) -> dict:
+    """RFC 7396：把 merge patch 作用到 target 上，返回新值"""
+    result = dict(target) if isinstance(target, dict) else {}
+    for field, value in patch.items():
+        if value is None:
+            result.pop(field, None)
+        elif isinstance(value, dict):
+            result[field] = _apply_merge(result.get(field), value)
+        else:
+            result[field] = value
+    return result
+
+
+def _compose_merge(first: dict, second: dict) -> dict | None:
+    """
+    把两个 merge patch 合成一个，先后执行两者与执行合成结果等价
+
+    first 把某个字段设成非字典（或删除），second 又对该字段给出字典时无法合成：
+    合成后的字典会与目标中原有的值合并，而不是替换它。这种情况返回 None。
+    """
+    result = dict(first)
+    for field, value in second.items():
+        if isinstance(value, dict) and field in result:
+            if not isinstance(result[field], dict):
+                return None
+            merged = _compose_merge(result[field], value)
+            if merged is None:
+                return None
+            result[field] = merged
+        else:
+            result[field] = value
+    return result
+
+
+def _compose(entries: list, entry: tuple) -> list:
+    """
+    把一个新操作并入某个 key 的缓冲操作序列
+
+    操作为 (kind, payload, options)：put 的 options 是 {"index", "ttl"}，patch 的为 None。
+    序列形如 [put?, patch, patch, ...]；能合并时序列长度不变
+    """
+    kind, payload, _ = entry
+    if kind == "put":
+        return [entry]
+    if not entries:
+        return [entry]
+    last_kind, last_payload, last_options = entries[-1]
+    if last_kind == "put":
+        # value 为 None 的 put 是删除，之后的 patch 从空值新建（与 SqliteStore.patch 一致）
+        return [*entries[:-1], ("put", _apply_merge(last_payload or {}, payload), last_options)]
+    merged = _compose_merge(last_payload, payload)
+    if merged is None:
+        return [*entries, entry]
+    return [*entries[:-1], ("patch", merged, None)]
+
+
+class WriteBehindStore(BaseStore):
+    """
+    合并写入、异步刷写的 Store 包装
+
+    Args:
+        durable: 持久化 Store；有 patch_many 时 patch 原样下推，否则刷写时读-改-写
+        interval: 定时刷写的秒数
+        max_pending: 缓冲中最多的 key 数，超过后写入方同步刷写
+        max_failures: 后台连续刷写失败多少次后停止重试，并在 end_turn() 中报告
+    """
+
+    def __init__(self, durable, interval: float = 1.0, max_pending: int = 10_000, max_failures: int = 5):
+        self.durable = durable
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_failures = max_failures
+        # 与持久层一致：BaseStore.put 据此决定是否接受 ttl，以及未给 ttl 时的默认值
+        self.supports_ttl = getattr(durable, "supports_ttl", False)
+        self.ttl_config = getattr(durable, "ttl_config", None)
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        # (namespace, key) -> [(kind, payload, options)]；_inflight 是正在刷写的那一批
+        self._pending = {}
+        self._inflight = {}
+        self.stats = {"writes": 0, "flushed": 0, "flushes": 0, "errors": 0}
+        # 后台连续失败的次数；达到 max_failures 后记下最后一次的异常并停止自动刷写
+        self._failures = 0
+        self._error = None
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="store-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- 写入 ----------
+
+    def _buffer(self, namespace: tuple, key: str, entry: tuple):
+        with self._lock:
+            entries = self._pending.get((namespace, key), [])
+            self._pending[(namespace, key)] = _compose(entries, entry)
+            self.stats["writes"] += 1
+            full = len(self._pending) > self.max_pending
+        if full:
+            # 背压：持久层跟不上（或一直失败）时不再无限堆积，刷写失败直接抛给写入方
+            self.flush()
+
+    def patch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()):
+        """
+        与 SqliteStore.patch 相同的语义，只写入缓冲
+
+        返回合并后的值：与 get 一样在持久层的值上叠加缓冲中的修改（写入仍不落盘）。
+        """
+        validate_op_namespace(PutOp(namespace, key, {}))
+        merge = {**(updates or {}), **{field: None for field in remove}}
+        self._buffer(namespace, key, ("patch", merge, None))
+        return self.get(namespace, key).value
+
+    async def apatch(self, namespace: tuple, key: str, updates: dict | None = None, remove=()):
+        return await asyncio.to_thread(self.patch, namespace, key, updates, remove)
+
+    # ---------- 读取 ----------
+
+    def _buffered(self, namespace: tuple, key: str) -> list:
+        with self._lock:
+            return self._inflight.get((namespace, key), []) + self._pending.get((namespace, key), [])
+
+    @staticmethod
+    def _overlay(namespace: tuple, key: str, entries: list, durable_item) -> Item | None:
+        if not entries:
+            return durable_item
+        value = durable_item.value if durable_item else None
+        exists = durable_item is not None
+        for kind, payload, _ in entries:
+            if kind == "put":
+                value, exists = payload, payload is not None
+            else:
+                value, exists = _apply_merge(value, payload), True
+        if not exists:
+            return None
+        now = datetime.now(timezone.utc)
+        return Item(
+            value=value, key=key, namespace=namespace,
+            created_at=durable_item.created_at if durable_item else now, updated_at=now,
+        )
+
+    # ---------- batch ----------
+
+    def batch(self, ops) -> list:
+        ops = list(ops)
+        for op in ops:
+            validate_op_namespace(op)
+        if any(isinstance(op, (SearchOp, ListNamespacesOp)) for op in ops):
+            # 范围查询无法在缓冲上叠加，先让持久层看到所有写入
+            self.flush()
+        results = [None] * len(ops)
+        # 与 InMemoryStore 一致：先执行读取，再写入缓冲
+        gets = [(i, op) for i, op in enumerate(ops) if isinstance(op, GetOp)]
+        # 先取缓冲快照再读持久层：期间若有刷写完成，同样的修改会被再叠加一次，
+        # put 与 merge patch 都是幂等的，结果不变；反过来则可能读到刷写前的旧值
+        buffered = {i: self._buffered(op.namespace, op.key) for i, op in gets}
+        # 缓冲里已有完整值（put）的 key 不必回源
+        remote = [(i, op) for i, op in gets if not any(entry[0] == "put" for entry in buffered[i])]
+        fetched = self.durable.batch([op for _, op in remote]) if remote else []
+        durable_items = {i: item for (i, _), item in zip(remote, fetched)}
+        for i, op in gets:
+            results[i] = self._overlay(op.namespace, op.key, buffered[i], durable_items.get(i))
+        others = [(i, op) for i, op in enumerate(ops) if isinstance(op, (SearchOp, ListNamespacesOp))]
+        if others:
+            for (i, _), result in zip(others, self.durable.batch([op for _, op in others])):
+                results[i] = result
+        for op in ops:
+            if isinstance(op, PutOp):
+                self._buffer(op.namespace, op.key, ("put", op.value, {"index": op.index, "ttl": op.ttl}))
+        return results
+
+    async def abatch(self, ops) -> list:
+        return await asyncio.to_thread(self.batch, list(ops))
+
+    # ---------- 刷写 ----------
+
+    def flush(self) -> int:
+        """把缓冲写入持久层，返回写入的操作数；返回时写入已提交"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+            puts, patches = [], []
+            for (namespace, key), entries in self._inflight.items():
+                for kind, payload, options in entries:
+                    if kind == "put":
+                        puts.append(PutOp(namespace, key, payload, **options))
+                    else:
+                        patches.append((namespace, key, payload))
+            try:
+                if puts:
+                    self.durable.batch(puts)
+                if patches:
+                    self._write_patches(patches)
+            except BaseException:
+                # 把这一批放回缓冲最前面，之后的写入继续叠加在上面
+                with self._lock:
+                    for k, entries in self._pending.items():
+                        merged = self._inflight.setdefault(k, [])
+                        for entry in entries:
+                            merged[:] = _compose(merged, entry)
+                    self._pending, self._inflight = self._inflight, {}
+                    self.stats["errors"] += 1
+                raise
+            with self._lock:
+                self._inflight = {}
+                self.stats["flushed"] += len(puts) + len(patches)
+                self.stats["flushes"] += 1
+                self._failures, self._error = 0, None
+            return len(puts) + len(patches)
+
+    def _write_patches(self, patches: list):
+        patch_many = getattr(self.durable, "patch_many", None)
+        if patch_many is not None:
+            # 合成后的 merge patch 中 None 表示删除，patch_many 原样下推
+            patch_many([(namespace, key, merge, ()) for namespace, key, merge in patches])
+            return
+        for namespace, key, merge in patches:
+            item = self.durable.get(namespace, key)
+            self.durable.put(namespace, key, _apply_merge(item.value if item else None, merge))
+
+    def end_turn(self):
+        """
+        一轮对话结束：唤醒后台线程刷写，不阻塞调用方
+
+        后台已连续失败 max_failures 次时抛出 RuntimeError（cause 为最后一次的异常），
+        缓冲保留；调用 flush() 成功后恢复自动刷写。
+        """
+        with self._lock:
+            error, pending = self._error, len(self._pending)
+        if error is not None:
+            raise RuntimeError(
+                f"写回刷写已连续失败 {self._failures} 次，缓冲中有 {pending} 个 key 未写入持久层"
+            ) from error
+        self._wake.set()
+
+    def _loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._error is not None:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                    if self._failures >= self.max_failures:
+                        self._error = e
+                if self._error is not None:
+                    print(f"[写回] 连续 {self._failures} 次刷写失败，停止后台重试: {e}")
+                else:
+                    print(f"[写回] 刷写失败，稍后重试: {e}")
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        # 持久层的 close 还要落盘它自己的状态（如 SqliteStore 缓冲的读取时间）
+        close = getattr(self.durable, "close", None)
+        if close is not None:
+            close()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(entries) for entries in self._pending.values())
+
+
+# ========== 模拟 ==========
+
+def simulate(turns: int = 200, users: int = 20):
+    """
+    每轮模拟智能体的一串工具调用：读资料、保存资料后又更正、连续设置三项偏好、读偏好
+    对比直接写 SqliteStore 和经过写回缓冲时，持久层的写入次数与每轮在 Store 上的耗时
+    """
+    import os
+    import random
+    import tempfile
+
+    from sqlite_store import SqliteStore
+
+    def turn(store, user: str, n: int):
+        store.get(("users",), user)
+        store.put(("users",), user, {"name": user, "age": 20 + n % 30})
+        store.put(("users",), user, {"name": user, "age": 21 + n % 30, "email": f"{user}@example.com"})
+        store.patch(("users", user, "preferences"), "settings", {"language": "中文"})
+        store.patch(("users", user, "preferences"), "settings", {"theme": "dark" if n % 2 else "light"})
+        store.patch(("users", user, "preferences"), "settings", {"font_size": 12 + n % 4}, remove=["legacy"])
+        return store.get(("users", user, "preferences"), "settings")
+
+    print("=" * 60)
+    print(f"{turns} 轮对话，{users} 个用户；每轮 1 次读资料 + 2 次 put + 3 次 patch + 1 次读偏好")
+    print("=" * 60)
+
+    finals = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("直接写", "写回缓冲"):
+            random.seed(0)
+            durable = SqliteStore(os.path.join(tmp, f"{name}.sqlite"))
+            store = WriteBehindStore(durable, interval=0.5) if name == "写回缓冲" else durable
+            writes = 0
+            started = time.perf_counter()
+            for n in range(turns):
+                item = turn(store, f"user{random.randrange(users):03d}", n)
+                # 读到自己的写入：本轮三次 patch 都在
+                assert {"language", "theme", "font_size"} <= set(item.value)
+                writes += 5
+                if store is not durable:
+                    store.end_turn()
+            elapsed = time.perf_counter() - started
+            if store is not durable:
+                store.flush()
+                durable_writes = store.stats["flushed"]
+                extra = f"，刷写 {store.stats['flushes']} 次"
+            else:
+                durable_writes = writes
+                extra = ""
+            print(f"{name:<8} 持久层写入 {durable_writes:>5}（请求 {writes}）{extra}  "
+                  f"每轮 Store 耗时 {elapsed / turns * 1000:.3f}ms")
+            finals.append({(tuple(i.namespace), i.key): i.value for i in durable.search((), limit=10_000)})
+            # 写回缓冲关闭时会一并关闭持久层
+            store.close()
+    assert finals[0] == finals[1], "两种方式最终落盘的数据不一致"
+    print("两种方式最终落盘的数据一致")
+
+
+if __name__ == "__main__":
+    simulate()